@@ -0,0 +1,284 @@
+"""
+Rendering benchmark suite.
+
+Renders a fixed set of scenes at several resolutions and worker counts, each case in a fresh process so load
+times and peak memory aren't skewed by earlier cases, and writes the results as JSON. Given a baseline JSON
+from an earlier run, cases whose rays/sec dropped by more than the tolerance are flagged as regressions and
+the exit code is 1.
+
+    python benchmark.py --output results.json
+    python benchmark.py --output new.json --baseline results.json --tolerance 0.1
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import resource
+import sys
+import time
+
+import numpy as np
+
+ASSET_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+SCENES = ["test_script", "suzanne", "many_objects", "high_reflection", "many_lights"]
+
+AMBIENT_LIGHT = [0.1, 0.1, 0.1]
+BG_COLOR = [80, 80, 80]
+
+
+def _asset(name: str) -> str:
+    return os.path.join(ASSET_DIRECTORY, name)
+
+
+def _load_scene(name: str):
+    """
+    - returned is (camera, meshes, light) for one of the SCENES
+    """
+    from camera import PerspectiveCamera
+    from light import LightSet, PointLight
+    from mesh import Mesh
+
+    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
+    camera.transform.set_position(0, -6, 3)
+    camera.transform.set_rotation(-25, 0, 0)
+
+    light = PointLight(15.0, np.array([1, 1, 1]))
+    light.transform.set_position(-3, -3, 2)
+
+    white = np.array([1.0, 1.0, 1.0])
+
+    if name == "suzanne":
+        camera.transform.set_position(0, -5, 0)
+        camera.transform.set_rotation(0, 0, 0)
+
+        suzanne = Mesh.from_stl(_asset("suzanne.stl"), np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]), white,
+                                0.2, 0.7, 0.3, 50.0, 0.05, False)
+        return camera, [suzanne], light
+
+    if name in ("many_objects", "many_lights"):
+        sphere = Mesh.from_stl(_asset("unit_sphere.stl"), np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]), white,
+                               0.2, 0.7, 0.3, 50.0, 0.05, False)
+        cube = Mesh.from_stl(_asset("unit_cube.stl"), np.array([161.0 / 255.0, 24.0 / 255.0, 58.0 / 255.0]), white,
+                             0.2, 0.7, 0.3, 1.0, 0.05, True)
+        floor_mesh = Mesh.from_stl(_asset("flat_cube.stl"), white, white, 0.4, 1.0, 0.0, 1.0, 0.05, True)
+        floor_mesh.transform.set_position(0, 0, -1)
+
+        # an 8 x 8 grid of props alternating between spheres and cubes
+        meshes = [floor_mesh]
+        for i in range(8):
+            for j in range(8):
+                prop = copy.deepcopy(sphere if (i + j) % 2 == 0 else cube)
+                prop.transform.set_position(-3.5 + i, -3.5 + j, -0.2)
+                meshes.append(prop)
+
+        if name == "many_objects":
+            return camera, meshes, light
+
+        # a 16 x 16 grid of dim lights over the props, each one culled where it's too faint to matter and
+        # only 8 of the ones left shaded at any point
+        lights = []
+        for i in range(16):
+            for j in range(16):
+                grid_light = PointLight(0.5, np.array([1.0, 0.9 if (i + j) % 2 == 0 else 1.0, 0.8]))
+                grid_light.transform.set_position(-7.5 + i, -7.5 + j, 1.5)
+                lights.append(grid_light)
+
+        return camera, meshes, LightSet(lights, cutoff=0.01, samples=8)
+
+    if name not in ("test_script", "high_reflection"):
+        raise Exception(f'Unknown benchmark scene {name}')
+
+    # reflective enough that most rays go the whole recursion depth in the high_reflection scene
+    km = 0.8 if name == "high_reflection" else 0.05
+
+    mesh = Mesh.from_stl(_asset("unit_sphere.stl"), np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]), white,
+                         0.2, 0.7, 0.3, 50.0, km, False)
+    mesh.transform.set_position(0, 0, 0.5)
+
+    mesh2 = Mesh.from_stl(_asset("unit_cube.stl"), np.array([7.0 / 255.0, 20.0 / 255.0, 32.0 / 255.0]), white,
+                          0.2, 0.7, 0.3, 1.0, km, True)
+    mesh2.transform.set_rotation(0, 0, 45)
+    mesh2.transform.set_position(-1.6, -1, 0)
+
+    mesh3 = Mesh.from_stl(_asset("unit_cube.stl"), np.array([161.0 / 255.0, 24.0 / 255.0, 58.0 / 255.0]), white,
+                          0.2, 0.7, 0.3, 1.0, km, True)
+    mesh3.transform.set_position(1.6, -1, 0)
+
+    floor_mesh = Mesh.from_stl(_asset("flat_cube.stl"), white, white, 0.4, 1.0, 0.0, 1.0, km, True)
+    floor_mesh.transform.set_position(0, 0, -1)
+
+    meshes = [mesh, mesh2, mesh3, floor_mesh]
+
+    if name == "high_reflection":
+        # mirrored walls in front of and behind the camera so reflection rays keep hitting geometry
+        for y in (4, -8):
+            wall = Mesh.from_stl(_asset("flat_cube.stl"), white, white, 0.1, 0.2, 0.0, 1.0, 0.9, True)
+            wall.transform.set_rotation(90, 0, 0)
+            wall.transform.set_position(0, y, 0)
+            meshes.append(wall)
+
+    return camera, meshes, light
+
+
+def case_key(case: dict) -> str:
+    return f'{case["scene"]}/{case["resolution"]}px/{case["workers"]}w/{case["mode"]}'
+
+
+def run_case(case: dict) -> dict:
+    """
+    Loads, builds and renders one case in the current process.
+    - returned is the case with its timings, ray counts, rays/sec and peak memory added
+    """
+    from renderer import Renderer
+
+    load_start_time = time.perf_counter()
+    camera, meshes, light = _load_scene(case["scene"])
+    load_time = time.perf_counter() - load_start_time
+
+    build_start_time = time.perf_counter()
+    renderer = Renderer(case["resolution"], case["resolution"], camera, meshes, light)
+    build_time = time.perf_counter() - build_start_time
+
+    backend = "process" if case["workers"] > 1 else "thread"
+
+    render_start_time = time.perf_counter()
+    renderer.render("barycentric", BG_COLOR, AMBIENT_LIGHT, mode=case["mode"], backend=backend, workers=case["workers"])
+    render_time = time.perf_counter() - render_start_time
+
+    counts = renderer.stats.totals()
+    triangle_count = sum(len(mesh.faces) for mesh in meshes)
+    # after the render, so it's what the meshes hold while rendering: world space arrays and BVH traversal lists included
+    footprints = [mesh.memory_footprint() for mesh in meshes]
+
+    result = dict(case)
+    result.update({
+        "triangles": triangle_count,
+        "bytes_per_triangle": sum(footprint["geometry"] for footprint in footprints) / max(triangle_count, 1),
+        "total_bytes_per_triangle": sum(footprint["total"] for footprint in footprints) / max(triangle_count, 1),
+        "load_time": load_time,
+        "build_time": build_time,
+        "bvh_build_time": sum(mesh.bvh.build_seconds for mesh in meshes),
+        "bvh_nodes": sum(mesh.bvh.node_count_total() for mesh in meshes),
+        "render_time": render_time,
+        "primary_rays": counts["primary_rays"],
+        "shadow_rays": counts["shadow_rays"],
+        "reflection_rays": counts["reflection_rays"],
+        "primary_rays_per_sec": counts["primary_rays"] / render_time,
+        "shadow_rays_per_sec": counts["shadow_rays"] / render_time,
+        "reflection_rays_per_sec": counts["reflection_rays"] / render_time,
+        "rays_per_sec": (counts["primary_rays"] + counts["shadow_rays"] + counts["reflection_rays"]) / render_time,
+        # ru_maxrss is in kilobytes on linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "workers_peak_memory_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    })
+
+    return result
+
+
+def _run_case_in_child(case: dict, results) -> None:
+    # keep the render's own progress output out of the report
+    sys.stdout = open(os.devnull, "w")
+    results.put(run_case(case))
+
+
+def run_case_isolated(case: dict) -> dict:
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    process = context.Process(target=_run_case_in_child, args=(case, results))
+    process.start()
+
+    while True:
+        try:
+            result = results.get(timeout=1)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise Exception(f'Benchmark case {case_key(case)} failed with exit code {process.exitcode}')
+
+    process.join()
+
+    return result
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """
+    - returned is a description of every case that got slower than its baseline by more than tolerance
+    """
+    baseline_cases = {case_key(case): case for case in baseline["cases"]}
+    regressions = []
+
+    for result in results:
+        previous = baseline_cases.get(case_key(result))
+        if previous is None:
+            continue
+
+        for metric in ("rays_per_sec", "primary_rays_per_sec", "shadow_rays_per_sec", "reflection_rays_per_sec"):
+            if previous[metric] > 0 and result[metric] < previous[metric] * (1 - tolerance):
+                regressions.append(f'{case_key(result)} {metric}: {result[metric]:.0f} vs baseline {previous[metric]:.0f}')
+
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rendering benchmark suite")
+    parser.add_argument("--scenes", nargs="+", default=SCENES, choices=SCENES)
+    parser.add_argument("--resolutions", nargs="+", type=int, default=[32, 64])
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, os.cpu_count()])
+    parser.add_argument("--mode", default="wavefront", choices=["recursive", "wavefront"])
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed fractional drop in rays/sec")
+    args = parser.parse_args()
+
+    results = []
+    for scene in args.scenes:
+        for resolution in args.resolutions:
+            for workers in sorted(set(args.workers)):
+                case = {"scene": scene, "resolution": resolution, "workers": workers, "mode": args.mode}
+                result = run_case_isolated(case)
+                results.append(result)
+
+                print(f'{case_key(result)}: {result["rays_per_sec"]:.0f} rays/s '
+                      f'(primary {result["primary_rays_per_sec"]:.0f}, shadow {result["shadow_rays_per_sec"]:.0f}, '
+                      f'reflection {result["reflection_rays_per_sec"]:.0f}), load {result["load_time"]:.3f}s, '
+                      f'build {result["build_time"]:.3f}s ({result["bvh_nodes"]} BVH nodes in {result["bvh_build_time"]:.3f}s), render {result["render_time"]:.3f}s, '
+                      f'peak {result["peak_memory_mb"]:.0f}MB, {result["total_bytes_per_triangle"]:.0f} bytes/triangle '
+                      f'({result["bytes_per_triangle"]:.0f} geometry)')
+
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "cases": results,
+    }
+
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f'wrote {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+
+        if regressions:
+            return 1
+
+        print("no regressions")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,519 @@
+import sys
+import time
+
+import numpy as np
+
+import kernels
+import math_helper
+from ray import Ray
+
+
+class BVH:
+    """
+    Bounding volume hierarchy over a list of axis aligned boxes, built top-down with binned SAH.
+    - bounds_min and bounds_max are (N, 3) arrays holding each primitive's box
+    - nodes are stored flattened, interior nodes have a left and right child, leaves
+      cover prim_indices[first:first + count]
+    - traversal_lists, see from_arrays
+    """
+
+    TRAVERSAL_COST = 1.0
+    INTERSECTION_COST = 1.0
+
+    def __init__(self, bounds_min: np.array, bounds_max: np.array, max_leaf_size: int = 4, bin_count: int = 12,
+                 traversal_lists: bool = True):
+        build_start_time = time.perf_counter()
+
+        self.max_leaf_size = max_leaf_size
+        self.bin_count = bin_count
+
+        bounds_min = np.asarray(bounds_min, dtype=np.float64).reshape(-1, 3)
+        bounds_max = np.asarray(bounds_max, dtype=np.float64).reshape(-1, 3)
+
+        self.primitive_count: int = len(bounds_min)
+        self.prim_indices: np.array = np.arange(self.primitive_count, dtype=np.int64)
+
+        node_min = []
+        node_max = []
+        node_left = []
+        node_right = []
+        node_first = []
+        node_count = []
+
+        if self.primitive_count > 0:
+            centroids = (bounds_min + bounds_max) * 0.5
+
+            node_min.append(None)
+            node_max.append(None)
+            node_left.append(-1)
+            node_right.append(-1)
+            node_first.append(0)
+            node_count.append(self.primitive_count)
+
+            # each entry is (node index, first primitive, primitive count)
+            stack = [(0, 0, self.primitive_count)]
+
+            while stack:
+                node_index, first, count = stack.pop()
+                prims = self.prim_indices[first:first + count]
+
+                box_min = bounds_min[prims].min(axis=0)
+                box_max = bounds_max[prims].max(axis=0)
+                node_min[node_index] = box_min
+                node_max[node_index] = box_max
+
+                if count <= max_leaf_size:
+                    continue
+
+                left_mask = self._find_sah_split(prims, bounds_min, bounds_max, centroids, box_min, box_max)
+
+                if left_mask is None:
+                    continue
+
+                left_count = int(np.count_nonzero(left_mask))
+                self.prim_indices[first:first + count] = np.concatenate((prims[left_mask], prims[~left_mask]))
+
+                left_index = len(node_min)
+                right_index = left_index + 1
+
+                for child_first, child_count in ((first, left_count), (first + left_count, count - left_count)):
+                    node_min.append(None)
+                    node_max.append(None)
+                    node_left.append(-1)
+                    node_right.append(-1)
+                    node_first.append(child_first)
+                    node_count.append(child_count)
+
+                node_left[node_index] = left_index
+                node_right[node_index] = right_index
+                node_count[node_index] = 0
+
+                stack.append((left_index, first, left_count))
+                stack.append((right_index, first + left_count, count - left_count))
+
+        self.node_min: np.array = np.array(node_min, dtype=np.float64).reshape(-1, 3)
+        self.node_max: np.array = np.array(node_max, dtype=np.float64).reshape(-1, 3)
+        self.node_left: np.array = np.array(node_left, dtype=np.int64)
+        self.node_right: np.array = np.array(node_right, dtype=np.int64)
+        self.node_first: np.array = np.array(node_first, dtype=np.int64)
+        self.node_count: np.array = np.array(node_count, dtype=np.int64)
+
+        self._prepare_traversal(traversal_lists)
+
+        # how long the build took, 0 for one restored with from_arrays
+        self.build_seconds: float = time.perf_counter() - build_start_time
+
+    # the arrays that make up a built BVH, see arrays and from_arrays
+    ARRAY_NAMES = ("node_min", "node_max", "node_left", "node_right", "node_first", "node_count", "prim_indices")
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in BVH.ARRAY_NAMES}
+
+    @staticmethod
+    def from_arrays(arrays: dict, max_leaf_size: int = 4, bin_count: int = 12, traversal_lists: bool = True):
+        """
+        - arrays is what arrays() returned for a BVH built earlier, e.g. loaded from a scene cache
+        - traversal_lists False has the per-ray traversal read the nodes straight from the arrays instead of
+          copying them into lists first, for memory mapped arrays too big to hold as python objects
+        - returned is that BVH, without building it again
+        """
+        bvh: BVH = BVH.__new__(BVH)
+        bvh.max_leaf_size = max_leaf_size
+        bvh.bin_count = bin_count
+
+        for name in BVH.ARRAY_NAMES:
+            setattr(bvh, name, arrays[name])
+        bvh.primitive_count = len(bvh.prim_indices)
+        bvh.build_seconds = 0.0
+
+        bvh._prepare_traversal(traversal_lists)
+
+        return bvh
+
+    def node_count_total(self) -> int:
+        return len(self.node_left)
+
+    def _prepare_traversal(self, traversal_lists: bool = True) -> None:
+        if not traversal_lists:
+            self._nodes = _ArrayRows(self.node_min, self.node_max, self.node_left, self.node_right, self.node_first,
+                                     self.node_count)
+            self._prim_list = _ArrayRows(self.prim_indices)
+            return
+
+        # plain python lists are much quicker to index than numpy arrays on the per-ray path
+        self._nodes = list(zip(self.node_min.tolist(), self.node_max.tolist(), self.node_left.tolist(),
+                               self.node_right.tolist(), self.node_first.tolist(), self.node_count.tolist()))
+        self._prim_list = self.prim_indices.tolist()
+
+    def traversal_list_bytes(self) -> int:
+        """
+        - returned is about how many bytes the per-ray traversal's lists take, 0 when it reads the arrays
+        """
+        if isinstance(self._nodes, _ArrayRows):
+            return 0
+
+        def nested_bytes(value) -> int:
+            if isinstance(value, (list, tuple)):
+                return sys.getsizeof(value) + sum(nested_bytes(item) for item in value)
+            return sys.getsizeof(value)
+
+        # every node is shaped like the root, and every number in it is its own object
+        node_bytes = len(self._nodes) * nested_bytes(self._nodes[0]) if self._nodes else 0
+        prim_bytes = len(self._prim_list) * sys.getsizeof(self._prim_list[0]) if self._prim_list else 0
+
+        return sys.getsizeof(self._nodes) + node_bytes + sys.getsizeof(self._prim_list) + prim_bytes
+
+    def _find_sah_split(self, prims: np.array, bounds_min: np.array, bounds_max: np.array, centroids: np.array,
+                        box_min: np.array, box_max: np.array):
+        """
+        - returned is a boolean mask over prims selecting the left child, or None if the node should stay a leaf
+        """
+        count = len(prims)
+        prim_centroids = centroids[prims]
+        centroid_min = prim_centroids.min(axis=0)
+        centroid_max = prim_centroids.max(axis=0)
+        extent = centroid_max - centroid_min
+
+        if not np.any(extent > 0):
+            # every centroid is in the same spot, binning can't separate them
+            return None
+
+        best_cost = np.inf
+        best_axis = -1
+        best_split = -1
+        best_bins = None
+
+        for axis in range(3):
+            if extent[axis] <= 0:
+                continue
+
+            bins = ((prim_centroids[:, axis] - centroid_min[axis]) * (self.bin_count / extent[axis])).astype(np.int64)
+            bins = np.clip(bins, 0, self.bin_count - 1)
+
+            bin_counts = np.bincount(bins, minlength=self.bin_count)
+            bin_min = np.full((self.bin_count, 3), np.inf)
+            bin_max = np.full((self.bin_count, 3), -np.inf)
+            np.minimum.at(bin_min, bins, bounds_min[prims])
+            np.maximum.at(bin_max, bins, bounds_max[prims])
+
+            left_counts = np.cumsum(bin_counts)[:-1]
+            right_counts = np.cumsum(bin_counts[::-1])[::-1][1:]
+            left_areas = _surface_areas(np.minimum.accumulate(bin_min)[:-1], np.maximum.accumulate(bin_max)[:-1])
+            right_areas = _surface_areas(np.minimum.accumulate(bin_min[::-1])[::-1][1:],
+                                         np.maximum.accumulate(bin_max[::-1])[::-1][1:])
+
+            costs = left_areas * left_counts + right_areas * right_counts
+            costs[(left_counts == 0) | (right_counts == 0)] = np.inf
+
+            split = int(np.argmin(costs))
+            if costs[split] < best_cost:
+                best_cost = costs[split]
+                best_axis = axis
+                best_split = split
+                best_bins = bins
+
+        if best_axis == -1:
+            return None
+
+        node_area = _surface_areas(box_min[None, :], box_max[None, :])[0]
+        if node_area > 0:
+            split_cost = self.TRAVERSAL_COST + self.INTERSECTION_COST * best_cost / node_area
+            leaf_cost = self.INTERSECTION_COST * count
+
+            # keep big leaves split even when SAH prefers them, leaves are tested linearly
+            if split_cost >= leaf_cost and count <= 4 * self.max_leaf_size:
+                return None
+
+        return best_bins <= best_split
+
+    def closest_hit(self, ray: Ray, t_min: float, t_max: float, hit_leaf) -> (bool, any):
+        """
+        Front to back traversal, children are visited nearest first and skipped once the closest hit so far
+        is nearer than their entry distance.
+        - hit_leaf(ray, prim_indices, t_min, t_max) returns (hit, t, payload) for the nearest primitive in the leaf
+        - returned is (hit, payload) of the closest primitive hit
+        """
+        if not self._nodes:
+            return False, None
+
+        origin = ray.origin
+        inv_direction = ray.inverse_direction()
+
+        nodes = self._nodes
+        prim_list = self._prim_list
+
+        root_min, root_max = nodes[0][0], nodes[0][1]
+        root_entry = math_helper.ray_aabb_entry(origin, inv_direction, root_min, root_max, t_min, t_max)
+        if root_entry is None:
+            return False, None
+
+        closest_t: float = t_max
+        closest_payload = None
+        found: bool = False
+
+        stack = [(root_entry, 0)]
+
+        while stack:
+            entry, node_index = stack.pop()
+
+            if entry > closest_t:
+                continue
+
+            _, _, left, right, first, count = nodes[node_index]
+
+            if count > 0:
+                hit, t, payload = hit_leaf(ray, prim_list[first:first + count], t_min, closest_t)
+                if hit and t <= closest_t:
+                    closest_t = t
+                    closest_payload = payload
+                    found = True
+                continue
+
+            left_node = nodes[left]
+            right_node = nodes[right]
+            left_entry = math_helper.ray_aabb_entry(origin, inv_direction, left_node[0], left_node[1], t_min, closest_t)
+            right_entry = math_helper.ray_aabb_entry(origin, inv_direction, right_node[0], right_node[1], t_min, closest_t)
+
+            # push the far child first so the near child is popped first
+            if left_entry is not None and right_entry is not None:
+                if left_entry < right_entry:
+                    stack.append((right_entry, right))
+                    stack.append((left_entry, left))
+                else:
+                    stack.append((left_entry, left))
+                    stack.append((right_entry, right))
+            elif left_entry is not None:
+                stack.append((left_entry, left))
+            elif right_entry is not None:
+                stack.append((right_entry, right))
+
+        return found, closest_payload
+
+    def any_hit(self, ray: Ray, t_min: float, t_max: float, occluded_leaf) -> bool:
+        """
+        Occlusion query, stops at the first primitive hit anywhere in [t_min, t_max] so no ordering is needed.
+        - occluded_leaf(ray, prim_indices, t_min, t_max) returns whether any primitive in the leaf is hit
+        """
+        if not self._nodes:
+            return False
+
+        origin = ray.origin
+        inv_direction = ray.inverse_direction()
+
+        nodes = self._nodes
+        prim_list = self._prim_list
+
+        root_min, root_max = nodes[0][0], nodes[0][1]
+        if math_helper.ray_aabb_entry(origin, inv_direction, root_min, root_max, t_min, t_max) is None:
+            return False
+
+        stack = [0]
+
+        while stack:
+            _, _, left, right, first, count = nodes[stack.pop()]
+
+            if count > 0:
+                if occluded_leaf(ray, prim_list[first:first + count], t_min, t_max):
+                    return True
+                continue
+
+            for child in (right, left):
+                child_node = nodes[child]
+                if math_helper.ray_aabb_entry(origin, inv_direction, child_node[0], child_node[1], t_min, t_max) is not None:
+                    stack.append(child)
+
+        return False
+
+    def closest_hit_batch(self, origins: np.array, directions: np.array, t_min, t_max, hit_leaf_batch) -> np.array:
+        """
+        Breadth first traversal of a whole batch of rays, each node is visited once with the subset of rays
+        whose current closest hit is beyond the node's entry distance.
+        - origins and directions are (M, 3), t_min and t_max are floats or (M,) arrays
+        - hit_leaf_batch(ray_indices, prim_indices, t_min, t_max) tests the rays against the leaf's primitives,
+          records its own payload for rays that hit and returns (hit, t) arrays over ray_indices, only hits
+          with t <= t_max may be reported
+        - returned is the (M,) array of closest t per ray, np.inf for a miss
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        ray_count = len(origins)
+
+        t_min = np.broadcast_to(np.asarray(t_min, dtype=np.float64), (ray_count,))
+        closest_t = np.array(np.broadcast_to(np.asarray(t_max, dtype=np.float64), (ray_count,)))
+        found = np.zeros(ray_count, dtype=bool)
+
+        if ray_count == 0 or not self._nodes:
+            return np.full(ray_count, np.inf)
+
+        inv_directions = math_helper.inverse_directions(directions)
+
+        stack = [(0, np.arange(ray_count))]
+
+        while stack:
+            node_index, ray_indices = stack.pop()
+
+            entry = kernels.ray_aabb_entry(origins[ray_indices], inv_directions[ray_indices],
+                                           self.node_min[node_index], self.node_max[node_index],
+                                           t_min[ray_indices], closest_t[ray_indices])
+            ray_indices = ray_indices[entry < np.inf]
+
+            if len(ray_indices) == 0:
+                continue
+
+            count = self.node_count[node_index]
+
+            if count > 0:
+                first = self.node_first[node_index]
+                hit, t = hit_leaf_batch(ray_indices, self.prim_indices[first:first + count],
+                                        t_min[ray_indices], closest_t[ray_indices])
+                closest_t[ray_indices[hit]] = t[hit]
+                found[ray_indices[hit]] = True
+                continue
+
+            stack.append((self.node_right[node_index], ray_indices))
+            stack.append((self.node_left[node_index], ray_indices))
+
+        return np.where(found, closest_t, np.inf)
+
+    def any_hit_batch(self, origins: np.array, directions: np.array, t_min, t_max, occluded_leaf_batch) -> np.array:
+        """
+        Batched any_hit, rays drop out of the traversal as soon as they're found to be occluded.
+        - occluded_leaf_batch(ray_indices, prim_indices, t_min, t_max) returns a bool array over ray_indices
+        - returned is the (M,) bool array of occluded rays
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        ray_count = len(origins)
+
+        t_min = np.broadcast_to(np.asarray(t_min, dtype=np.float64), (ray_count,))
+        t_max = np.broadcast_to(np.asarray(t_max, dtype=np.float64), (ray_count,))
+        occluded = np.zeros(ray_count, dtype=bool)
+
+        if ray_count == 0 or not self._nodes:
+            return occluded
+
+        inv_directions = math_helper.inverse_directions(directions)
+
+        stack = [(0, np.arange(ray_count))]
+
+        while stack:
+            node_index, ray_indices = stack.pop()
+            ray_indices = ray_indices[~occluded[ray_indices]]
+
+            if len(ray_indices) == 0:
+                continue
+
+            entry = kernels.ray_aabb_entry(origins[ray_indices], inv_directions[ray_indices],
+                                           self.node_min[node_index], self.node_max[node_index],
+                                           t_min[ray_indices], t_max[ray_indices])
+            ray_indices = ray_indices[entry < np.inf]
+
+            if len(ray_indices) == 0:
+                continue
+
+            count = self.node_count[node_index]
+
+            if count > 0:
+                first = self.node_first[node_index]
+                occluded[ray_indices] |= occluded_leaf_batch(ray_indices, self.prim_indices[first:first + count],
+                                                             t_min[ray_indices], t_max[ray_indices])
+                continue
+
+            stack.append((self.node_right[node_index], ray_indices))
+            stack.append((self.node_left[node_index], ray_indices))
+
+        return occluded
+
+    def containing(self, point) -> list:
+        """
+        - returned is the primitives whose boxes contain point, in no particular order
+        """
+        if not self._nodes:
+            return []
+
+        nodes = self._nodes
+        prim_list = self._prim_list
+        x, y, z = point[0], point[1], point[2]
+
+        found = []
+        stack = [0]
+
+        while stack:
+            box_min, box_max, left, right, first, count = nodes[stack.pop()]
+
+            if not (box_min[0] <= x <= box_max[0] and box_min[1] <= y <= box_max[1] and box_min[2] <= z <= box_max[2]):
+                continue
+
+            if count > 0:
+                found.extend(prim_list[first:first + count])
+                continue
+
+            stack.append(right)
+            stack.append(left)
+
+        return found
+
+    def containing_batch(self, points: np.array) -> (np.array, np.array):
+        """
+        Batched containing, each node is visited once with the subset of points inside it.
+        - returned is (point indices, primitive indices), one pair per primitive box containing a point,
+          in no particular order
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+        point_indices = []
+        prim_indices = []
+
+        if len(points) == 0 or not self._nodes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        stack = [(0, np.arange(len(points)))]
+
+        while stack:
+            node_index, indices = stack.pop()
+
+            inside = np.all((points[indices] >= self.node_min[node_index]) &
+                            (points[indices] <= self.node_max[node_index]), axis=1)
+            indices = indices[inside]
+
+            if len(indices) == 0:
+                continue
+
+            count = self.node_count[node_index]
+
+            if count > 0:
+                first = self.node_first[node_index]
+                point_indices.append(np.repeat(indices, count))
+                prim_indices.append(np.tile(self.prim_indices[first:first + count], len(indices)))
+                continue
+
+            stack.append((self.node_right[node_index], indices))
+            stack.append((self.node_left[node_index], indices))
+
+        if not point_indices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+        return np.concatenate(point_indices), np.concatenate(prim_indices)
+
+
+class _ArrayRows:
+    """
+    Stands in for the traversal lists, reading like them but converting the arrays' rows only when they're used.
+    With one array it's the list of its rows, with several the list of tuples of their rows.
+    """
+
+    def __init__(self, *arrays: np.array):
+        self.arrays = arrays
+
+    def __len__(self) -> int:
+        return len(self.arrays[0])
+
+    def __getitem__(self, index):
+        if len(self.arrays) == 1:
+            return self.arrays[0][index].tolist()
+        return tuple(values[index].tolist() for values in self.arrays)
+
+
+def _surface_areas(box_min: np.array, box_max: np.array) -> np.array:
+    extent = np.maximum(box_max - box_min, 0)
+    return 2 * (extent[:, 0] * extent[:, 1] + extent[:, 1] * extent[:, 2] + extent[:, 2] * extent[:, 0])
@@ -8,6 +8,51 @@ from ray import Ray
 from transform import Transform
 
 
+def image_plane_coordinates(camera, xs: np.array, ys: np.array, pixel_width: int, pixel_height: int,
+                            offsets: np.array = None) -> (np.array, np.array):
+    """
+    Batch version of the (u, v) computed in get_cam_space_ray_at_pixel
+    - xs and ys are the (N,) pixel coordinates, offsets the optional (N, 2) positions within each pixel in [0, 1),
+      pixel centers when left out
+    - returned is (u, v), the (N,) camera space coordinates the rays go through
+    """
+    offset_x, offset_y = (0.5, 0.5) if offsets is None else (offsets[:, 0], offsets[:, 1])
+
+    u = camera.left + (camera.right - camera.left) * (np.asarray(xs) + offset_x) / pixel_width
+    v = camera.bottom + (camera.top - camera.bottom) * (np.asarray(ys) + offset_y) / pixel_height
+
+    return u, v
+
+
+def rect_pixels(x0: int, y0: int, x1: int, y1: int, rng: np.random.Generator = None) -> (np.array, np.array, np.array):
+    """
+    - returned is (xs, ys, offsets) for the pixels in [x0, x1) x [y0, y1) ordered by x then y, offsets random
+      within each pixel if rng is given, None (pixel centers) otherwise
+    """
+    xs, ys = np.meshgrid(np.arange(x0, x1), np.arange(y0, y1), indexing="ij")
+    offsets = None if rng is None else rng.random((xs.size, 2))
+
+    return xs.ravel(), ys.ravel(), offsets
+
+
+def cam_to_world_rays(transform: Transform, origins: np.array, directions: np.array) -> (np.array, np.array):
+    """
+    Transforms camera space rays to world space with a single matrix multiply, origins as points (w = 1) and
+    directions as directions (w = 0)
+    - origins and directions are (N, 3), returned is the (N, 3) world space (origins, directions)
+    """
+    count = len(origins)
+
+    homogeneous = np.zeros((2 * count, 4))
+    homogeneous[:count, 0:3] = origins
+    homogeneous[:count, 3] = 1
+    homogeneous[count:, 0:3] = directions
+
+    world = homogeneous @ transform.matrix[0:3].T
+
+    return world[:count], world[count:]
+
+
 class OrthoCamera:
 
     def __init__(self, left, right, bottom, top, near, far):
@@ -35,7 +80,7 @@ class OrthoCamera:
         return self.transform.apply_to_point(p)
 
     def project_ray(self, ray: Ray) -> Ray:
-        direction = self.transform.apply_inverse_to_normal(ray.direction)
+        direction = self.transform.apply_inverse_to_direction(ray.direction)
         origin = self.transform.apply_inverse_to_point(ray.origin)
 
         # direction = self.transform.apply_to_normal(ray.direction)
@@ -47,7 +92,7 @@ class OrthoCamera:
         return Ray(origin, direction)
 
     def inverse_project_ray(self, ray: Ray) -> Ray:
-        direction = self.transform.apply_to_normal(ray.direction)
+        direction = self.transform.apply_to_direction(ray.direction)
         origin = self.transform.apply_to_point(ray.origin)
 
         # direction = self.project_point(ray.direction)
@@ -55,9 +100,13 @@ class OrthoCamera:
 
         return Ray(origin, direction)
 
-    def get_cam_space_ray_at_pixel(self, pixel_i: int, pixel_j: int, pixel_width: int, pixel_height: int, focal_distance: int) -> Ray:
-        u = self.left + (self.right - self.left) * (pixel_i + 0.5) / pixel_width
-        v = self.bottom + (self.top - self.bottom) * (pixel_j + 0.5) / pixel_height
+    def get_cam_space_ray_at_pixel(self, pixel_i: int, pixel_j: int, pixel_width: int, pixel_height: int, focal_distance: int,
+                                   offset_x: float = 0.5, offset_y: float = 0.5) -> Ray:
+        """
+        - offset_x and offset_y place the ray within the pixel, 0.5 is its center
+        """
+        u = self.left + (self.right - self.left) * (pixel_i + offset_x) / pixel_width
+        v = self.bottom + (self.top - self.bottom) * (pixel_j + offset_y) / pixel_height
 
         u_u: np.array = np.array([1, 0, 0]) * u
         v_v: np.array = np.array([0, 0, 1]) * v
@@ -67,6 +116,33 @@ class OrthoCamera:
 
         return Ray(origin, direction)
 
+    def get_rays_at_pixels(self, xs: np.array, ys: np.array, pixel_width: int, pixel_height: int, focal_distance: int,
+                           offsets: np.array = None) -> (np.array, np.array):
+        """
+        Batch version of get_cam_space_ray_at_pixel followed by inverse_project_ray
+        - xs and ys are the (N,) pixel coordinates, offsets the optional (N, 2) positions within each pixel in [0, 1)
+        - returned is (origins, directions), the (N, 3) world space rays
+        """
+        u, v = image_plane_coordinates(self, xs, ys, pixel_width, pixel_height, offsets)
+
+        origins = np.zeros((len(u), 3))
+        origins[:, 0] = u
+        origins[:, 2] = v
+
+        directions = np.zeros((len(u), 3))
+        directions[:, 1] = 1
+
+        return cam_to_world_rays(self.transform, origins, directions)
+
+    def get_rays_in_rect(self, x0: int, y0: int, x1: int, y1: int, pixel_width: int, pixel_height: int,
+                         focal_distance: int, rng: np.random.Generator = None) -> (np.array, np.array):
+        """
+        - returned is (origins, directions), the (N, 3) world space rays through the pixels in [x0, x1) x [y0, y1)
+          ordered by x then y, jittered within each pixel if rng is given
+        """
+        xs, ys, offsets = rect_pixels(x0, y0, x1, y1, rng)
+        return self.get_rays_at_pixels(xs, ys, pixel_width, pixel_height, focal_distance, offsets)
+
 
 class PerspectiveCamera:
     def __init__(self, left, right, bottom, top, near, far):
@@ -93,20 +169,24 @@ class PerspectiveCamera:
         return self.transform.apply_to_point(p)
 
     def project_ray(self, ray: Ray) -> Ray:
-        direction = self.transform.apply_inverse_to_normal(ray.direction)
+        direction = self.transform.apply_inverse_to_direction(ray.direction)
         origin = self.transform.apply_inverse_to_point(ray.origin)
 
         return Ray(origin, direction)
 
     def inverse_project_ray(self, ray: Ray) -> Ray:
-        direction = self.transform.apply_to_normal(ray.direction)
+        direction = self.transform.apply_to_direction(ray.direction)
         origin = self.transform.apply_to_point(ray.origin)
 
         return Ray(origin, direction)
 
-    def get_cam_space_ray_at_pixel(self, pixel_i: int, pixel_j: int, pixel_width: int, pixel_height: int, focal_distance: int) -> Ray:
-        u = self.left + (self.right - self.left) * (pixel_i + 0.5) / pixel_width
-        v = self.bottom + (self.top - self.bottom) * (pixel_j + 0.5) / pixel_height
+    def get_cam_space_ray_at_pixel(self, pixel_i: int, pixel_j: int, pixel_width: int, pixel_height: int, focal_distance: int,
+                                   offset_x: float = 0.5, offset_y: float = 0.5) -> Ray:
+        """
+        - offset_x and offset_y place the ray within the pixel, 0.5 is its center
+        """
+        u = self.left + (self.right - self.left) * (pixel_i + offset_x) / pixel_width
+        v = self.bottom + (self.top - self.bottom) * (pixel_j + offset_y) / pixel_height
 
         u_u: np.array = np.array([1, 0, 0]) * u
         v_v: np.array = np.array([0, 0, 1]) * v
@@ -118,6 +198,32 @@ class PerspectiveCamera:
 
         return Ray(origin, direction)
 
+    def get_rays_at_pixels(self, xs: np.array, ys: np.array, pixel_width: int, pixel_height: int, focal_distance: int,
+                           offsets: np.array = None) -> (np.array, np.array):
+        """
+        Batch version of get_cam_space_ray_at_pixel followed by inverse_project_ray
+        - xs and ys are the (N,) pixel coordinates, offsets the optional (N, 2) positions within each pixel in [0, 1)
+        - returned is (origins, directions), the (N, 3) world space rays
+        """
+        u, v = image_plane_coordinates(self, xs, ys, pixel_width, pixel_height, offsets)
+
+        directions = np.empty((len(u), 3))
+        directions[:, 0] = u
+        directions[:, 1] = focal_distance
+        directions[:, 2] = v
+        directions /= np.sqrt(np.einsum("ij,ij->i", directions, directions))[:, None]
+
+        return cam_to_world_rays(self.transform, np.zeros((len(u), 3)), directions)
+
+    def get_rays_in_rect(self, x0: int, y0: int, x1: int, y1: int, pixel_width: int, pixel_height: int,
+                         focal_distance: int, rng: np.random.Generator = None) -> (np.array, np.array):
+        """
+        - returned is (origins, directions), the (N, 3) world space rays through the pixels in [x0, x1) x [y0, y1)
+          ordered by x then y, jittered within each pixel if rng is given
+        """
+        xs, ys, offsets = rect_pixels(x0, y0, x1, y1, rng)
+        return self.get_rays_at_pixels(xs, ys, pixel_width, pixel_height, focal_distance, offsets)
+
     @staticmethod
     def from_FOV(fov, near, far, ratio):
         right: float = math.tan(math.radians(fov) / 2) * abs(near)
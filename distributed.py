@@ -0,0 +1,490 @@
+"""
+Spreads the tiles of a frame over worker processes on other hosts, see Renderer.render with backend "distributed".
+
+On each worker host run
+    RAYTRACER_AUTHKEY=... python distributed.py worker COORDINATOR_HOST PORT --processes 8
+and render with a Coordinator listening on that port with the same authkey. Workers can connect before or during
+a render and stay connected between renders.
+
+Messages are pickled, so every one carries an HMAC under a key derived from the shared authkey and is checked
+before it's unpickled, see Channel. The coordinator only listens on localhost unless given another address.
+"""
+import argparse
+import hashlib
+import hmac
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import traceback
+
+import kernels
+from renderer import Renderer, prepare_worker_renderer, render_tile_counted
+
+# every message is its pickled size as an unsigned 64 bit big endian int, its HMAC, then the pickle
+HEADER = struct.Struct(">Q")
+DIGEST_SIZE = hashlib.sha256().digest_size
+NONCE_SIZE = 32
+# largest message read from a worker before it has proven it knows the authkey
+HELLO_MAX_SIZE = 1024
+
+# the environment variable the worker command line and, by default, Coordinator take the authkey from
+AUTHKEY_ENV = "RAYTRACER_AUTHKEY"
+
+# copies of a tile rendered at once, the second one only goes to an idle worker when the first is straggling
+MAX_TILE_COPIES = 2
+# a tile is straggling once it's taken this many times the average tile time
+STRAGGLER_FACTOR = 3.0
+
+
+class AuthenticationError(ConnectionError):
+    pass
+
+
+def authkey_from_env() -> bytes:
+    """
+    - returned is the authkey in the AUTHKEY_ENV environment variable, None if it isn't set
+    """
+    authkey = os.environ.get(AUTHKEY_ENV)
+    return None if not authkey else authkey.encode("utf-8")
+
+
+class Channel:
+    """
+    Authenticated messages over a connected socket. On connecting each end sends a random nonce, and the session
+    key is the HMAC of both under the shared authkey. Each message then carries the HMAC under the session key of
+    who sent it, its sequence number and its bytes, which is checked before the message is unpickled. So only a peer
+    knowing the authkey gets anything unpickled, and messages recorded from one connection can't be replayed into
+    another or reordered within it.
+    - coordinator is which end of the connection this is
+    """
+
+    def __init__(self, sock: socket.socket, authkey: bytes, coordinator: bool):
+        if not authkey:
+            raise Exception("Distributed rendering needs an authkey shared by the coordinator and its workers")
+
+        self.socket = sock
+
+        own_nonce = os.urandom(NONCE_SIZE)
+        sock.sendall(own_nonce)
+        other_nonce = _receive_exactly(sock, NONCE_SIZE)
+        if other_nonce is None:
+            raise ConnectionError("connection closed during the handshake")
+
+        nonces = own_nonce + other_nonce if coordinator else other_nonce + own_nonce
+        self.session_key: bytes = hmac.new(authkey, b"raytracer session" + nonces, hashlib.sha256).digest()
+
+        self.own_role: bytes = b"coordinator" if coordinator else b"worker"
+        self.other_role: bytes = b"worker" if coordinator else b"coordinator"
+        self.sent: int = 0
+        self.received: int = 0
+
+    def _digest(self, role: bytes, sequence: int, payload: bytes) -> bytes:
+        digest = hmac.new(self.session_key, role + HEADER.pack(sequence), hashlib.sha256)
+        digest.update(payload)
+        return digest.digest()
+
+    def send(self, message) -> None:
+        self.send_payload(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def send_payload(self, payload: bytes) -> None:
+        """
+        - payload is a message pickled once up front, e.g. to send it to every worker
+        """
+        digest = self._digest(self.own_role, self.sent, payload)
+        self.sent += 1
+        self.socket.sendall(HEADER.pack(len(payload)) + digest + payload)
+
+    def receive(self, max_size: int = None):
+        """
+        - max_size, if given, is the largest message accepted, bigger ones raise without being read
+        - returned is the next message, None if the other end closed the connection
+        """
+        header = _receive_exactly(self.socket, HEADER.size + DIGEST_SIZE)
+        if header is None:
+            return None
+
+        size = HEADER.unpack(header[:HEADER.size])[0]
+        if max_size is not None and size > max_size:
+            raise AuthenticationError(f'message of {size} bytes before authenticating')
+
+        payload = _receive_exactly(self.socket, size)
+        if payload is None:
+            raise ConnectionError("connection closed mid message")
+
+        if not hmac.compare_digest(header[HEADER.size:], self._digest(self.other_role, self.received, payload)):
+            raise AuthenticationError("message failed authentication, the authkeys differ or it was tampered with")
+        self.received += 1
+
+        return pickle.loads(payload)
+
+
+def _receive_exactly(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    remaining = size
+
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        remaining -= len(chunk)
+
+    return b"".join(chunks)
+
+
+class WorkerConnection:
+    """
+    A worker connected to the coordinator. Only one job's thread talks to it at a time, holding lock
+    """
+
+    def __init__(self, channel: Channel, address: tuple):
+        self.channel = channel
+        self.socket = channel.socket
+        self.address = address
+        self.lock = threading.Lock()
+        self.alive: bool = True
+        # the job whose scene the worker has
+        self.job_id: int = None
+
+    def close(self) -> None:
+        self.alive = False
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+
+
+class RenderJob:
+    """
+    The tiles of one frame and which of them are pending, being rendered and done
+    """
+
+    def __init__(self, job_id: int, payload: bytes, tiles: list):
+        self.job_id: int = job_id
+        self.payload: bytes = payload
+
+        self.pending: list = list(reversed(tiles))
+        # tile -> [copies being rendered, time the first copy was handed out], oldest first
+        self.in_flight: dict = {}
+        self.done: set = set()
+        self.tile_seconds: float = 0.0
+
+        self.results = queue.Queue()
+        self.condition = threading.Condition()
+        self.finished: bool = False
+
+    def next_tile(self) -> tuple:
+        """
+        Blocks until there's a tile for a worker to render
+        - returned is the tile, or None once the job is finished
+        """
+        with self.condition:
+            while not self.finished:
+                if self.pending:
+                    tile = self.pending.pop()
+                    self.in_flight[tile] = [1, time.monotonic()]
+                    return tile
+
+                straggler = self._straggler()
+                if straggler is not None:
+                    self.in_flight[straggler][0] += 1
+                    return straggler
+
+                self.condition.wait(0.1)
+
+        return None
+
+    def _straggler(self) -> tuple:
+        if not self.done:
+            return None
+
+        average_seconds = self.tile_seconds / len(self.done)
+        now = time.monotonic()
+
+        for tile, (copies, start_time) in self.in_flight.items():
+            if copies < MAX_TILE_COPIES and now - start_time > STRAGGLER_FACTOR * average_seconds:
+                return tile
+
+        return None
+
+    def complete(self, tile: tuple, result: tuple) -> None:
+        with self.condition:
+            # the first copy of a tile to finish wins
+            if self.finished or tile in self.done:
+                return
+
+            self.tile_seconds += time.monotonic() - self.in_flight.pop(tile)[1]
+            self.done.add(tile)
+            self.results.put(("result", tile) + result)
+            self.condition.notify_all()
+
+    def failed(self, tile: tuple) -> None:
+        """
+        The worker rendering tile is gone, hands the tile out again unless another copy is still being rendered
+        """
+        with self.condition:
+            if tile in self.done or tile not in self.in_flight:
+                return
+
+            self.in_flight[tile][0] -= 1
+            if self.in_flight[tile][0] == 0:
+                del self.in_flight[tile]
+                self.pending.append(tile)
+                self.condition.notify_all()
+
+    def error(self, message: str) -> None:
+        self.results.put(("error", message))
+
+    def finish(self) -> None:
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+
+
+class Coordinator:
+    """
+    Listens for workers and hands them the tiles of each frame rendered with it.
+    - address is the (host, port) to listen on, port 0 picks a free one, see self.address. It's localhost only by
+      default, listening on other interfaces (like ("0.0.0.0", port)) has to be asked for
+    - authkey is the secret workers have to know to connect, by default the AUTHKEY_ENV environment variable
+      or else a random one, see self.authkey
+    - a worker that doesn't return a tile within tile_timeout seconds is dropped and its tile handed to another,
+      tiles that take much longer than the average are also copied to idle workers, first result wins
+    - a render fails if no worker is connected for worker_wait seconds
+    """
+
+    def __init__(self, address: tuple = ("127.0.0.1", 0), authkey: bytes = None, tile_timeout: float = 120.0,
+                 worker_wait: float = 60.0):
+        if authkey is None:
+            authkey = authkey_from_env() or os.urandom(32)
+        self.authkey: bytes = authkey
+
+        self.tile_timeout: float = tile_timeout
+        self.worker_wait: float = worker_wait
+
+        self.listener = socket.create_server(address)
+        self.address: tuple = self.listener.getsockname()
+
+        self.lock = threading.Lock()
+        self.connections: list[WorkerConnection] = []
+        self.job: RenderJob = None
+        self.job_ids = itertools.count()
+        self.closed: bool = False
+
+        self.accept_thread = threading.Thread(target=self._accept, daemon=True)
+        self.accept_thread.start()
+
+    def worker_count(self) -> int:
+        with self.lock:
+            return sum(connection.alive for connection in self.connections)
+
+    def close(self) -> None:
+        """
+        Stops listening and disconnects the workers, which then exit
+        """
+        self.closed = True
+        self.listener.close()
+
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+
+    def render_tiles(self, renderer: Renderer, tiles, ambient_light, mode: str):
+        """
+        Sends the renderer (scene, camera and light) to each worker once, then hands out the tiles
+        - yields (tile, colors, stats counts, cost tile or None) as the tiles arrive, in no particular order
+        """
+        payload = pickle.dumps(("job", renderer, ambient_light, mode, kernels.get_backend().name),
+                               protocol=pickle.HIGHEST_PROTOCOL)
+        tiles = list(tiles)
+        job = RenderJob(next(self.job_ids), payload, tiles)
+
+        with self.lock:
+            self.job = job
+            for connection in self.connections:
+                self._start_serving(connection, job)
+
+        try:
+            remaining = len(tiles)
+            waiting_since = time.monotonic()
+
+            while remaining > 0:
+                try:
+                    item = job.results.get(timeout=0.1)
+                except queue.Empty:
+                    if self.worker_count() > 0:
+                        waiting_since = time.monotonic()
+                    elif time.monotonic() - waiting_since > self.worker_wait:
+                        raise Exception(f'No render workers connected to {self.address[0]}:{self.address[1]} '
+                                        f'for {self.worker_wait}s')
+                    continue
+
+                if item[0] == "error":
+                    raise Exception(f'Render worker failed:\n{item[1]}')
+
+                remaining -= 1
+                yield item[1:]
+        finally:
+            job.finish()
+            with self.lock:
+                self.job = None
+
+    def _accept(self) -> None:
+        while not self.closed:
+            try:
+                sock, address = self.listener.accept()
+            except OSError:
+                return
+
+            # authenticated on its own thread, so a client that never finishes the handshake holds nothing up
+            threading.Thread(target=self._admit, args=(sock, address), daemon=True).start()
+
+    def _admit(self, sock: socket.socket, address: tuple) -> None:
+        sock.settimeout(self.tile_timeout)
+
+        try:
+            channel = Channel(sock, self.authkey, coordinator=True)
+            if channel.receive(max_size=HELLO_MAX_SIZE) != ("hello",):
+                raise AuthenticationError("worker didn't say hello")
+        except (OSError, ConnectionError, pickle.UnpicklingError) as error:
+            print(f'rejected connection from {address[0]}:{address[1]}: {error!r}')
+            sock.close()
+            return
+
+        connection = WorkerConnection(channel, address)
+        print(f'render worker connected from {address[0]}:{address[1]}')
+
+        with self.lock:
+            if self.closed:
+                connection.close()
+                return
+
+            self.connections = [connection for connection in self.connections if connection.alive]
+            self.connections.append(connection)
+            if self.job is not None:
+                self._start_serving(connection, self.job)
+
+    def _start_serving(self, connection: WorkerConnection, job: RenderJob) -> None:
+        threading.Thread(target=self._serve, args=(connection, job), daemon=True).start()
+
+    def _serve(self, connection: WorkerConnection, job: RenderJob) -> None:
+        # waits for the connection's thread from an earlier job to get its last tile back
+        with connection.lock:
+            tile = None
+
+            try:
+                if not connection.alive or job.finished:
+                    return
+
+                if connection.job_id != job.job_id:
+                    connection.channel.send_payload(job.payload)
+                    connection.job_id = job.job_id
+
+                while True:
+                    tile = job.next_tile()
+                    if tile is None:
+                        return
+
+                    connection.channel.send(("tile", tile))
+                    message = connection.channel.receive()
+                    if message is None:
+                        raise ConnectionError("worker disconnected")
+
+                    if message[0] == "error":
+                        job.error(message[1])
+                        return
+
+                    job.complete(tile, message[1:])
+                    tile = None
+            except (OSError, ConnectionError, pickle.UnpicklingError) as error:
+                print(f'render worker {connection.address[0]}:{connection.address[1]} dropped: {error!r}')
+                connection.close()
+                if tile is not None:
+                    job.failed(tile)
+
+
+def run_worker(host: str, port: int, authkey: bytes, connect_timeout: float = 30.0) -> None:
+    """
+    Connects to the coordinator at host:port and renders the tiles it sends until it disconnects.
+    Retries connecting for connect_timeout seconds, so workers can be started before the coordinator.
+    - authkey is the coordinator's, raises AuthenticationError if it doesn't match
+    """
+    deadline = time.monotonic() + connect_timeout
+
+    while True:
+        try:
+            sock = socket.create_connection((host, port))
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(1.0)
+
+    renderer = None
+    ambient_light = None
+    mode = None
+
+    with sock:
+        channel = Channel(sock, authkey, coordinator=False)
+        channel.send(("hello",))
+
+        while True:
+            message = channel.receive()
+            if message is None:
+                return
+
+            if message[0] == "job":
+                _, renderer, ambient_light, mode, kernel_backend = message
+                prepare_worker_renderer(renderer, kernel_backend)
+                continue
+
+            _, tile = message
+            try:
+                result = render_tile_counted(renderer, tile, ambient_light, mode)
+            except Exception:
+                channel.send(("error", traceback.format_exc()))
+                continue
+
+            channel.send(("result",) + result)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Distributed rendering worker")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    worker_parser = subparsers.add_parser("worker", help="render tiles for a coordinator")
+    worker_parser.add_argument("host")
+    worker_parser.add_argument("port", type=int)
+    worker_parser.add_argument("--processes", type=int, default=os.cpu_count(), help="worker processes on this host")
+    worker_parser.add_argument("--connect-timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    # taken from the environment rather than the command line, where other users could read it
+    authkey = authkey_from_env()
+    if authkey is None:
+        parser.error(f'set {AUTHKEY_ENV} to the authkey the coordinator was given')
+
+    if args.processes == 1:
+        run_worker(args.host, args.port, authkey, args.connect_timeout)
+        return 0
+
+    processes = [multiprocessing.Process(target=run_worker, args=(args.host, args.port, authkey, args.connect_timeout))
+                 for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
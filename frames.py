@@ -0,0 +1,117 @@
+import os
+import queue
+import threading
+
+import numpy as np
+
+from output import NpySink, OutputSink, PNGSink, PPMSink
+
+# file sink used for each extension a frame path can have
+FRAME_SINKS = {".png": PNGSink, ".ppm": PPMSink, ".npy": NpySink}
+
+
+class Frame:
+    """
+    One frame of a batch render, see Renderer.render_frames
+    - camera_matrix is the camera transform's 4x4 matrix for this frame, None keeps the previous frame's
+    - object_matrices maps meshes (or their index in the renderer's mesh list) to their 4x4 matrix for this frame,
+      meshes left out keep theirs
+    - name is available to the frame path pattern as {name}, like "left" and "right" for a stereo pair
+    """
+
+    def __init__(self, camera_matrix: np.array = None, object_matrices: dict = None, name: str = ""):
+        self.camera_matrix = camera_matrix
+        self.object_matrices: dict = object_matrices if object_matrices is not None else {}
+        self.name: str = name
+
+    def apply(self, camera, meshes: list) -> None:
+        """
+        Sets the transforms, ones that don't change are left alone so nothing built on them gets rebuilt
+        """
+        if self.camera_matrix is not None:
+            camera.transform.set_matrix(self.camera_matrix)
+
+        for mesh, matrix in self.object_matrices.items():
+            if isinstance(mesh, int):
+                mesh = meshes[mesh]
+            mesh.transform.set_matrix(matrix)
+
+
+class FrameWriter(OutputSink):
+    """
+    Writes the frames it's given to numbered files on a background thread, so encoding and writing one frame
+    overlaps with rendering the next.
+    - path_pattern is formatted with {index} and {name} of the frame, its extension picks the format
+    - at most max_pending frames wait to be written, write blocks once that many are queued
+    """
+
+    def __init__(self, path_pattern: str, max_pending: int = 2):
+        extension = os.path.splitext(path_pattern)[1].lower()
+        if extension not in FRAME_SINKS:
+            raise Exception(f'Unknown frame file extension {extension}, use one of {", ".join(FRAME_SINKS)}')
+
+        self.path_pattern = path_pattern
+        self.sink_class = FRAME_SINKS[extension]
+        self.paths: list[str] = []
+
+        self.index: int = 0
+        self.name: str = ""
+
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.error: Exception = None
+        self.thread = threading.Thread(target=self._write_frames, daemon=True)
+        self.thread.start()
+
+    def next_frame(self, index: int, name: str = "") -> None:
+        self.index = index
+        self.name = name
+
+    def path(self) -> str:
+        return self.path_pattern.format(index=self.index, name=self.name)
+
+    def write(self, image: np.array) -> None:
+        self._raise_error()
+
+        path = self.path()
+        self.paths.append(path)
+        # copied since the caller is free to reuse the buffer for its next frame
+        self.pending.put(("image", path, np.array(image)))
+
+    def write_cost_image(self, cost: np.array) -> None:
+        self._raise_error()
+        self.pending.put(("cost", self.path(), np.array(cost)))
+
+    def close(self) -> None:
+        """
+        Waits for every queued frame to be written, raises the first error the writer thread hit
+        """
+        self.pending.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise Exception(f'Writing frames failed: {self.error}')
+
+    def _write_frames(self) -> None:
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+
+            # after an error keep draining so the renderer never blocks on a full queue
+            if self.error is not None:
+                continue
+
+            kind, path, values = item
+            try:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+                if kind == "image":
+                    self.sink_class(path).write(values)
+                else:
+                    self.sink_class(path).write_cost_image(values)
+            except Exception as error:
+                self.error = error
@@ -0,0 +1,59 @@
+import numpy as np
+
+from hit_record import HitRecordBatch
+
+
+class GBuffer:
+    """
+    The primary (eye ray) hits of a whole frame, kept so a frame can be reshaded after the light or the
+    materials change without tracing the eye rays again. Arrays are indexed [x, y] like the image.
+    - mesh_index doubles as the material id, -1 where the eye ray missed
+    - key records the camera and mesh transforms it was traced with, see Renderer.gbuffer_key
+    """
+
+    def __init__(self, width: int, height: int, key: tuple):
+        self.width: int = width
+        self.height: int = height
+        self.key: tuple = key
+
+        self.origins: np.array = np.zeros((width, height, 3))
+        self.directions: np.array = np.zeros((width, height, 3))
+        self.hit: np.array = np.zeros((width, height), dtype=bool)
+        self.t: np.array = np.zeros((width, height))
+        self.point_hit: np.array = np.zeros((width, height, 3))
+        self.face_normal: np.array = np.zeros((width, height, 3))
+        self.normal_w: np.array = np.zeros((width, height, 3))
+        self.mesh_index: np.array = np.full((width, height), -1, dtype=np.int64)
+        self.face_index: np.array = np.full((width, height), -1, dtype=np.int64)
+
+    def store(self, x0: int, y0: int, x1: int, y1: int, origins: np.array, directions: np.array, record: HitRecordBatch) -> None:
+        """
+        - origins, directions and record are the tile's eye rays and hits, ordered by x then y like Renderer.primary_rays
+        """
+        shape = (x1 - x0, y1 - y0)
+
+        self.origins[x0:x1, y0:y1] = origins.reshape(shape + (3,))
+        self.directions[x0:x1, y0:y1] = directions.reshape(shape + (3,))
+        self.hit[x0:x1, y0:y1] = record.hit.reshape(shape)
+        self.t[x0:x1, y0:y1] = record.t.reshape(shape)
+        self.point_hit[x0:x1, y0:y1] = record.point_hit.reshape(shape + (3,))
+        self.face_normal[x0:x1, y0:y1] = record.face_normal.reshape(shape + (3,))
+        self.normal_w[x0:x1, y0:y1] = record.normal_w.reshape(shape + (3,))
+        self.mesh_index[x0:x1, y0:y1] = record.mesh_index.reshape(shape)
+        self.face_index[x0:x1, y0:y1] = record.face_index.reshape(shape)
+
+    def tile(self, x0: int, y0: int, x1: int, y1: int) -> (np.array, np.array, HitRecordBatch):
+        """
+        - returned is (origins, directions, record) for the tile, in the order store took them
+        """
+        def rows(values: np.array) -> np.array:
+            return values[x0:x1, y0:y1].reshape((-1,) + values.shape[2:])
+
+        record = HitRecordBatch(rows(self.hit), rows(self.t), rows(self.point_hit), rows(self.face_normal),
+                                rows(self.normal_w), rows(self.mesh_index), rows(self.face_index))
+
+        return rows(self.origins), rows(self.directions), record
+
+    def nbytes(self) -> int:
+        return sum(values.nbytes for values in (self.origins, self.directions, self.hit, self.t, self.point_hit,
+                                                self.face_normal, self.normal_w, self.mesh_index, self.face_index))
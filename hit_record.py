@@ -4,10 +4,31 @@ from ray_triangle_intersection_result import RayTriangleIntersectionResult
 
 
 class HitRecord:
+    """
+    - point_hit, face_normal and normal_w are (x, y, z) tuples of floats, see Ray
+    """
 
-    def __init__(self, point_hit: np.array, face_normal: np.array, intersection_result: RayTriangleIntersectionResult, w_normal: np.array, material: Material):
+    __slots__ = ("point_hit", "face_normal", "intersection_result", "normal_w", "material")
+
+    def __init__(self, point_hit: tuple, face_normal: tuple, intersection_result: RayTriangleIntersectionResult, w_normal: tuple, material: Material):
+        self.point_hit: tuple = point_hit
+        self.face_normal: tuple = face_normal
+        self.intersection_result: RayTriangleIntersectionResult = intersection_result
+        self.normal_w: tuple = w_normal
+        self.material = material
+
+
+class HitRecordBatch:
+    """
+    Structure of arrays counterpart of HitRecord for a batch of M rays, rows where hit is False hold zeros.
+    - mesh_index is the index into Scene.meshes of the mesh hit, -1 for a miss
+    """
+
+    def __init__(self, hit: np.array, t: np.array, point_hit: np.array, face_normal: np.array, w_normal: np.array, mesh_index: np.array, face_index: np.array):
+        self.hit: np.array = hit
+        self.t: np.array = t
         self.point_hit: np.array = point_hit
         self.face_normal: np.array = face_normal
-        self.intersection_result: np.array = intersection_result
-        self.normal_w = w_normal
-        self.material = material
+        self.normal_w: np.array = w_normal
+        self.mesh_index: np.array = mesh_index
+        self.face_index: np.array = face_index
@@ -0,0 +1,656 @@
+"""
+Swappable implementations of the batch kernels behind the wavefront and progressive renderers: ray/triangle
+closest and any hit with backface culling, the closest hit reduction, ray/AABB slab tests and Blinn-Phong shading.
+
+- "reference" loops over the per-ray functions in math_helper (and the loop kernels below where there is no
+  per-ray function), it's slow but it's what the others are checked against
+- "numpy" is the vectorized version and the default
+- "numba" compiles the loop kernels with Numba, it's only registered when numba can be imported
+
+Pick one with set_backend or the RAYTRACER_KERNELS environment variable. Asking for a backend that isn't
+available falls back to numpy with a warning. Run `python kernels.py` to check every available backend
+against the reference, test_kernels.py does the same under pytest.
+"""
+import os
+import sys
+
+import numpy as np
+
+import math_helper
+import stats
+from ray import Ray
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+EPSILON = 0.00001
+
+
+class KernelBackend:
+    """
+    The kernels every backend implements. Arrays are float64 unless noted, M is the ray count and N the
+    triangle count.
+    """
+
+    name = None
+    # whether the backend adds its own triangle and AABB tests to stats.active, the module level kernels count
+    # them for the backends that don't
+    counts_tests = False
+
+    def closest_hit(self, origins: np.array, directions: np.array, triangles: np.array, face_normals: np.array,
+                    t0: np.array, t1: np.array) -> (np.array, np.array, np.array, np.array):
+        """
+        - origins and directions are (M, 3), triangles (N, 3, 3), face_normals (N, 3), t0 and t1 (M,)
+        - triangles facing away from a ray (direction . normal > 0) are skipped
+        - returned is (closest_index, t, theta, beta), each (M,), closest_index is -1 and the rest 0 for a miss
+        """
+        raise NotImplementedError
+
+    def any_hit(self, origins: np.array, directions: np.array, triangles: np.array, face_normals: np.array,
+                t0: np.array, t1: np.array) -> np.array:
+        """
+        Same arguments as closest_hit
+        - returned is the (M,) bool array of rays that hit any front facing triangle in [t0, t1]
+        """
+        raise NotImplementedError
+
+    def closest_hit_reduction(self, hit: np.array, t: np.array, theta: np.array, beta: np.array) -> (np.array, np.array, np.array, np.array):
+        """
+        - hit (bool), t, theta and beta are (M, N) ray/triangle results
+        - returned is (closest_index, t, theta, beta) of the nearest hit per ray, closest_index is -1 for a miss
+        """
+        raise NotImplementedError
+
+    def ray_aabb_entry(self, origins: np.array, inv_directions: np.array, box_min: np.array, box_max: np.array,
+                       t_min: np.array, t_max: np.array) -> np.array:
+        """
+        - origins and inv_directions are (M, 3), box_min and box_max (3,), t_min and t_max (M,)
+        - returned is the (M,) array of entry distances, np.inf where a ray misses the box within [t_min, t_max]
+        """
+        raise NotImplementedError
+
+    def shade(self, point_hit: np.array, normal_w: np.array, directions: np.array, lit: np.array,
+              light_position: np.array, light_radiance: np.array, ambient_light: np.array, ka: np.array, kd: np.array,
+              ks: np.array, p: np.array, diffuse_color: np.array, specular_color: np.array) -> np.array:
+        """
+        Blinn-Phong shading of K hits, the same formula as Renderer.ray_color
+        - point_hit, normal_w and directions (the incoming rays') are (K, 3), lit (bool) is (K,)
+        - light_position and light_radiance (intensity times color) are (K, 3), the light each hit is shaded by,
+          ambient_light is (3,)
+        - ka, kd, ks and p are (K,), diffuse_color and specular_color (K, 3)
+        - returned is the (K, 3) colors, only the ambient term where a hit isn't lit
+        """
+        raise NotImplementedError
+
+
+class NumpyBackend(KernelBackend):
+
+    name = "numpy"
+
+    def closest_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        hit, t, theta, beta = self.intersect_all(origins, directions, triangles, t0, t1)
+
+        # skip faces we'd hit from the back
+        hit &= directions @ face_normals.T <= 0
+
+        return self.closest_hit_reduction(hit, t, theta, beta)
+
+    def any_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        hit, _, _, _ = self.intersect_all(origins, directions, triangles, t0, t1)
+        hit &= directions @ face_normals.T <= 0
+
+        return hit.any(axis=1)
+
+    @staticmethod
+    def intersect_all(origins: np.array, directions: np.array, triangles: np.array, t0, t1) -> (np.array, np.array, np.array, np.array):
+        """
+        math_helper.ray_triangle_intersection of every ray against every triangle, same t0/t1 and epsilon rules.
+        - origins and directions are (M, 3) arrays, triangles is (N, 3, 3) holding each triangle's a, b and c points
+        - t0 and t1 are floats or (M,) arrays
+        - returned is (hit, t, theta, beta), each of shape (M, N)
+        """
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)[:, None, :]
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)[:, None, :]
+        triangles = np.asarray(triangles, dtype=np.float64).reshape(-1, 3, 3)[None, :, :, :]
+
+        t0 = np.asarray(t0, dtype=np.float64).reshape(-1, 1)
+        t1 = np.asarray(t1, dtype=np.float64).reshape(-1, 1)
+
+        a_point = triangles[..., 0, :]
+        a_b = a_point - triangles[..., 1, :]
+        a_c = a_point - triangles[..., 2, :]
+        a_o = a_point - origins
+
+        a, b, c = a_b[..., 0], a_b[..., 1], a_b[..., 2]
+        d, e, f = a_c[..., 0], a_c[..., 1], a_c[..., 2]
+        g, h, i = directions[..., 0], directions[..., 1], directions[..., 2]
+        j, k, l = a_o[..., 0], a_o[..., 1], a_o[..., 2]
+
+        ei_minus_hf = e*i - h*f
+        gf_minus_di = g*f - d*i
+        dh_minus_eg = d*h - e*g
+
+        M = a*ei_minus_hf + b*gf_minus_di + c*dh_minus_eg
+
+        valid = np.abs(M) >= EPSILON
+        M = np.where(valid, M, 1.0)
+
+        ak_minus_jb = a*k - j*b
+        jc_minus_al = j*c - a*l
+        bl_minus_kc = b*l - k*c
+
+        t = -(f*ak_minus_jb + e*jc_minus_al + d*bl_minus_kc) / M
+        theta = (i*ak_minus_jb + h*jc_minus_al + g*bl_minus_kc) / M
+        beta = (j*ei_minus_hf + k*gf_minus_di + l*dh_minus_eg) / M
+
+        hit = valid & (t >= t0) & (t <= t1) & (theta >= 0) & (theta <= 1) & (beta >= 0) & (beta <= 1 - theta)
+
+        return hit, t, theta, beta
+
+    def closest_hit_reduction(self, hit, t, theta, beta):
+        masked_t = np.where(hit, t, np.inf)
+        index = np.argmin(masked_t, axis=1)
+        rows = np.arange(len(index))
+
+        any_hit = hit[rows, index]
+
+        closest_index = np.where(any_hit, index, -1)
+        closest_t = np.where(any_hit, t[rows, index], 0)
+        closest_theta = np.where(any_hit, theta[rows, index], 0)
+        closest_beta = np.where(any_hit, beta[rows, index], 0)
+
+        return closest_index, closest_t, closest_theta, closest_beta
+
+    def ray_aabb_entry(self, origins, inv_directions, box_min, box_max, t_min, t_max):
+        t0 = (box_min - origins) * inv_directions
+        t1 = (box_max - origins) * inv_directions
+
+        t_near = np.maximum(np.minimum(t0, t1).max(axis=1), t_min)
+        t_far = np.minimum(np.maximum(t0, t1).min(axis=1), t_max)
+
+        return np.where(t_far >= t_near, t_near, np.inf)
+
+    def shade(self, point_hit, normal_w, directions, lit, light_position, light_radiance, ambient_light, ka, kd, ks,
+              p, diffuse_color, specular_color):
+        color = ka[:, None] * ambient_light
+
+        point_to_light_vec = light_position - point_hit
+        distance_from_point_to_light = np.linalg.norm(point_to_light_vec, axis=1)
+        point_to_light_vec_normalized = point_to_light_vec / distance_from_point_to_light[:, None]
+
+        d_sq = distance_from_point_to_light ** 2
+        cos_t = np.maximum(0, np.sum(point_to_light_vec_normalized * normal_w, axis=1))
+
+        e = light_radiance * (1 / d_sq)[:, None] * cos_t[:, None]
+
+        diffuse_ray_color = kd[:, None] * diffuse_color / np.pi
+
+        neg_direction = -directions
+        normalized_neg_direction = neg_direction / np.linalg.norm(neg_direction, axis=1)[:, None]
+        h = point_to_light_vec_normalized + normalized_neg_direction
+        h /= np.linalg.norm(h, axis=1)[:, None]
+        spec_calc = np.power(np.maximum(0, np.sum(h * normal_w, axis=1)), p)
+
+        specular_ray_color = ks[:, None] * specular_color * spec_calc[:, None]
+
+        color[lit] += e[lit] * (specular_ray_color[lit] + diffuse_ray_color[lit])
+
+        return color
+
+
+def _make_loop_kernels(jit):
+    """
+    Builds the loop kernels, jit is applied to each of them: the identity for the reference backend,
+    numba.njit for the compiled one. They only use what Numba's nopython mode supports.
+    - returned is (closest_hit, any_hit, closest_hit_reduction, ray_aabb_entry, shade)
+    """
+
+    @jit
+    def intersect(origins, directions, triangles, face_normals, ray, face, t0, t1):
+        # math_helper.ray_triangle_intersection for one ray and face, written out on arrays so Numba can compile it.
+        # returns (hit, t, theta, beta)
+        g = directions[ray, 0]
+        h = directions[ray, 1]
+        i = directions[ray, 2]
+
+        # check if hitting back of face
+        if g * face_normals[face, 0] + h * face_normals[face, 1] + i * face_normals[face, 2] > 0:
+            return False, 0.0, 0.0, 0.0
+
+        a = triangles[face, 0, 0] - triangles[face, 1, 0]
+        b = triangles[face, 0, 1] - triangles[face, 1, 1]
+        c = triangles[face, 0, 2] - triangles[face, 1, 2]
+        d = triangles[face, 0, 0] - triangles[face, 2, 0]
+        e = triangles[face, 0, 1] - triangles[face, 2, 1]
+        f = triangles[face, 0, 2] - triangles[face, 2, 2]
+        j = triangles[face, 0, 0] - origins[ray, 0]
+        k = triangles[face, 0, 1] - origins[ray, 1]
+        l = triangles[face, 0, 2] - origins[ray, 2]
+
+        ei_minus_hf = e*i - h*f
+        gf_minus_di = g*f - d*i
+        dh_minus_eg = d*h - e*g
+
+        M = a*ei_minus_hf + b*gf_minus_di + c*dh_minus_eg
+
+        if abs(M) < EPSILON:
+            return False, 0.0, 0.0, 0.0
+
+        ak_minus_jb = a*k - j*b
+        jc_minus_al = j*c - a*l
+        bl_minus_kc = b*l - k*c
+
+        t = -(f*ak_minus_jb + e*jc_minus_al + d*bl_minus_kc) / M
+
+        if t < t0 or t > t1:
+            return False, 0.0, 0.0, 0.0
+
+        theta = (i*ak_minus_jb + h*jc_minus_al + g*bl_minus_kc) / M
+
+        if theta < 0 or theta > 1:
+            return False, 0.0, 0.0, 0.0
+
+        beta = (j*ei_minus_hf + k*gf_minus_di + l*dh_minus_eg) / M
+
+        if beta < 0 or beta > (1 - theta):
+            return False, 0.0, 0.0, 0.0
+
+        return True, t, theta, beta
+
+    @jit
+    def closest_hit(origins, directions, triangles, face_normals, t0, t1):
+        ray_count = origins.shape[0]
+        closest_index = np.full(ray_count, -1, dtype=np.int64)
+        closest_t = np.zeros(ray_count)
+        closest_theta = np.zeros(ray_count)
+        closest_beta = np.zeros(ray_count)
+
+        for ray in range(ray_count):
+            lowest_t = np.inf
+            for face in range(triangles.shape[0]):
+                hit, t, theta, beta = intersect(origins, directions, triangles, face_normals, ray, face, t0[ray], t1[ray])
+                if hit and t < lowest_t:
+                    lowest_t = t
+                    closest_index[ray] = face
+                    closest_t[ray] = t
+                    closest_theta[ray] = theta
+                    closest_beta[ray] = beta
+
+        return closest_index, closest_t, closest_theta, closest_beta
+
+    @jit
+    def any_hit(origins, directions, triangles, face_normals, t0, t1):
+        ray_count = origins.shape[0]
+        occluded = np.zeros(ray_count, dtype=np.bool_)
+
+        for ray in range(ray_count):
+            for face in range(triangles.shape[0]):
+                hit, _, _, _ = intersect(origins, directions, triangles, face_normals, ray, face, t0[ray], t1[ray])
+                if hit:
+                    occluded[ray] = True
+                    break
+
+        return occluded
+
+    @jit
+    def closest_hit_reduction(hit, t, theta, beta):
+        ray_count = hit.shape[0]
+        closest_index = np.full(ray_count, -1, dtype=np.int64)
+        closest_t = np.zeros(ray_count)
+        closest_theta = np.zeros(ray_count)
+        closest_beta = np.zeros(ray_count)
+
+        for ray in range(ray_count):
+            lowest_t = np.inf
+            for face in range(hit.shape[1]):
+                if hit[ray, face] and (closest_index[ray] == -1 or t[ray, face] < lowest_t):
+                    lowest_t = t[ray, face]
+                    closest_index[ray] = face
+                    closest_t[ray] = t[ray, face]
+                    closest_theta[ray] = theta[ray, face]
+                    closest_beta[ray] = beta[ray, face]
+
+        return closest_index, closest_t, closest_theta, closest_beta
+
+    @jit
+    def ray_aabb_entry(origins, inv_directions, box_min, box_max, t_min, t_max):
+        ray_count = origins.shape[0]
+        entry = np.full(ray_count, np.inf)
+
+        for ray in range(ray_count):
+            t_near = t_min[ray]
+            t_far = t_max[ray]
+
+            for axis in range(3):
+                t0 = (box_min[axis] - origins[ray, axis]) * inv_directions[ray, axis]
+                t1 = (box_max[axis] - origins[ray, axis]) * inv_directions[ray, axis]
+                t_near = max(t_near, min(t0, t1))
+                t_far = min(t_far, max(t0, t1))
+
+            if t_far >= t_near:
+                entry[ray] = t_near
+
+        return entry
+
+    @jit
+    def shade(point_hit, normal_w, directions, lit, light_position, light_radiance, ambient_light, ka, kd, ks, p,
+              diffuse_color, specular_color):
+        hit_count = point_hit.shape[0]
+        color = np.zeros((hit_count, 3))
+
+        for hit in range(hit_count):
+            for channel in range(3):
+                color[hit, channel] = ka[hit] * ambient_light[channel]
+
+            if not lit[hit]:
+                continue
+
+            to_light_x = light_position[hit, 0] - point_hit[hit, 0]
+            to_light_y = light_position[hit, 1] - point_hit[hit, 1]
+            to_light_z = light_position[hit, 2] - point_hit[hit, 2]
+            distance = np.sqrt(to_light_x * to_light_x + to_light_y * to_light_y + to_light_z * to_light_z)
+            to_light_x /= distance
+            to_light_y /= distance
+            to_light_z /= distance
+
+            cos_t = max(0.0, to_light_x * normal_w[hit, 0] + to_light_y * normal_w[hit, 1] + to_light_z * normal_w[hit, 2])
+            inv_d_sq = 1 / (distance * distance)
+
+            view_length = np.sqrt(directions[hit, 0] ** 2 + directions[hit, 1] ** 2 + directions[hit, 2] ** 2)
+            h_x = to_light_x - directions[hit, 0] / view_length
+            h_y = to_light_y - directions[hit, 1] / view_length
+            h_z = to_light_z - directions[hit, 2] / view_length
+            h_length = np.sqrt(h_x * h_x + h_y * h_y + h_z * h_z)
+            h_x /= h_length
+            h_y /= h_length
+            h_z /= h_length
+            spec_calc = max(0.0, h_x * normal_w[hit, 0] + h_y * normal_w[hit, 1] + h_z * normal_w[hit, 2]) ** p[hit]
+
+            for channel in range(3):
+                e = light_radiance[hit, channel] * inv_d_sq * cos_t
+                diffuse_ray_color = kd[hit] * diffuse_color[hit, channel] / np.pi
+                specular_ray_color = ks[hit] * specular_color[hit, channel] * spec_calc
+                color[hit, channel] += e * (specular_ray_color + diffuse_ray_color)
+
+        return color
+
+    return closest_hit, any_hit, closest_hit_reduction, ray_aabb_entry, shade
+
+
+class LoopBackend(KernelBackend):
+    """
+    Backend running the loop kernels of _make_loop_kernels, compiled with jit
+    """
+
+    def __init__(self, name: str, jit):
+        self.name = name
+        self._closest_hit, self._any_hit, self._closest_hit_reduction, self._ray_aabb_entry, self._shade = _make_loop_kernels(jit)
+
+    def closest_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        ray_count = len(origins)
+        return self._closest_hit(_floats(origins), _floats(directions), _floats(triangles), _floats(face_normals),
+                                 _floats(np.broadcast_to(t0, (ray_count,))), _floats(np.broadcast_to(t1, (ray_count,))))
+
+    def any_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        ray_count = len(origins)
+        return self._any_hit(_floats(origins), _floats(directions), _floats(triangles), _floats(face_normals),
+                             _floats(np.broadcast_to(t0, (ray_count,))), _floats(np.broadcast_to(t1, (ray_count,))))
+
+    def closest_hit_reduction(self, hit, t, theta, beta):
+        return self._closest_hit_reduction(np.ascontiguousarray(hit, dtype=np.bool_), _floats(t), _floats(theta), _floats(beta))
+
+    def ray_aabb_entry(self, origins, inv_directions, box_min, box_max, t_min, t_max):
+        ray_count = len(origins)
+        return self._ray_aabb_entry(_floats(origins), _floats(inv_directions), _floats(box_min), _floats(box_max),
+                                    _floats(np.broadcast_to(t_min, (ray_count,))), _floats(np.broadcast_to(t_max, (ray_count,))))
+
+    def shade(self, point_hit, normal_w, directions, lit, light_position, light_radiance, ambient_light, ka, kd, ks,
+              p, diffuse_color, specular_color):
+        return self._shade(_floats(point_hit), _floats(normal_w), _floats(directions), np.ascontiguousarray(lit, dtype=np.bool_),
+                           _floats(light_position), _floats(light_radiance), _floats(ambient_light), _floats(ka),
+                           _floats(kd), _floats(ks), _floats(p), _floats(diffuse_color), _floats(specular_color))
+
+
+class ReferenceBackend(LoopBackend):
+    """
+    The per-ray code run on a batch: ray/triangle and ray/AABB tests go through math_helper's per-ray functions
+    exactly as Mesh.hit and the BVH traversal call them, the reduction and shading run the loop kernels as plain
+    Python. math_helper counts its own tests.
+    """
+
+    counts_tests = True
+
+    def __init__(self):
+        super().__init__("reference", lambda function: function)
+
+    def closest_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        ray_count = len(origins)
+        closest_index = np.full(ray_count, -1, dtype=np.int64)
+        closest_t = np.zeros(ray_count)
+        closest_theta = np.zeros(ray_count)
+        closest_beta = np.zeros(ray_count)
+
+        for ray_index, ray, ray_t0, ray_t1 in self._rays(origins, directions, t0, t1):
+            lowest_t = np.inf
+            for face, (a, b, c), normal in zip(range(len(triangles)), triangles.tolist(), face_normals.tolist()):
+                # check if hitting back of face
+                if math_helper.dot3(normal, ray.direction) > 0:
+                    continue
+
+                result = math_helper.ray_triangle_intersection(ray, a, b, c, ray_t0, ray_t1)
+                if result.hit and result.t < lowest_t:
+                    lowest_t = result.t
+                    closest_index[ray_index] = face
+                    closest_t[ray_index] = result.t
+                    closest_theta[ray_index] = result.theta
+                    closest_beta[ray_index] = result.beta
+
+        return closest_index, closest_t, closest_theta, closest_beta
+
+    def any_hit(self, origins, directions, triangles, face_normals, t0, t1):
+        occluded = np.zeros(len(origins), dtype=bool)
+        triangle_list = triangles.tolist()
+        normal_list = face_normals.tolist()
+
+        for ray_index, ray, ray_t0, ray_t1 in self._rays(origins, directions, t0, t1):
+            occluded[ray_index] = any(math_helper.dot3(normal, ray.direction) <= 0 and
+                                      math_helper.ray_triangle_intersection(ray, a, b, c, ray_t0, ray_t1).hit
+                                      for (a, b, c), normal in zip(triangle_list, normal_list))
+
+        return occluded
+
+    def ray_aabb_entry(self, origins, inv_directions, box_min, box_max, t_min, t_max):
+        ray_count = len(origins)
+        entry = np.full(ray_count, np.inf)
+        box_min = np.asarray(box_min, dtype=np.float64).tolist()
+        box_max = np.asarray(box_max, dtype=np.float64).tolist()
+
+        for ray_index, (origin, inv_direction, ray_t_min, ray_t_max) in enumerate(zip(
+                _floats(origins).tolist(), _floats(inv_directions).tolist(),
+                _floats(np.broadcast_to(t_min, (ray_count,))).tolist(), _floats(np.broadcast_to(t_max, (ray_count,))).tolist())):
+            ray_entry = math_helper.ray_aabb_entry(origin, inv_direction, box_min, box_max, ray_t_min, ray_t_max)
+            if ray_entry is not None:
+                entry[ray_index] = ray_entry
+
+        return entry
+
+    @staticmethod
+    def _rays(origins, directions, t0, t1):
+        ray_count = len(origins)
+        for ray_index, (origin, direction, ray_t0, ray_t1) in enumerate(zip(
+                _floats(origins).tolist(), _floats(directions).tolist(),
+                _floats(np.broadcast_to(t0, (ray_count,))).tolist(), _floats(np.broadcast_to(t1, (ray_count,))).tolist())):
+            yield ray_index, Ray(tuple(origin), tuple(direction)), ray_t0, ray_t1
+
+
+def _floats(values) -> np.array:
+    return np.ascontiguousarray(values, dtype=np.float64)
+
+
+BACKENDS: dict = {}
+
+# backends that may not be installed, asking for one of these falls back instead of failing
+OPTIONAL_BACKENDS = ("numba",)
+
+DEFAULT_BACKEND = "numpy"
+
+
+def register_backend(backend: KernelBackend) -> None:
+    BACKENDS[backend.name] = backend
+
+
+def available_backends() -> list[str]:
+    return list(BACKENDS)
+
+
+def set_backend(name: str) -> KernelBackend:
+    """
+    Makes name the backend every kernel call goes to
+    - returned is the backend picked, numpy if name is an optional backend that isn't installed
+    """
+    global active
+
+    if name not in BACKENDS:
+        if name not in OPTIONAL_BACKENDS:
+            raise Exception(f'Unknown kernel backend {name}, available: {", ".join(BACKENDS)}')
+
+        print(f'kernel backend {name} is not available, falling back to {DEFAULT_BACKEND}')
+        name = DEFAULT_BACKEND
+
+    active = BACKENDS[name]
+    return active
+
+
+def get_backend() -> KernelBackend:
+    return active
+
+
+register_backend(ReferenceBackend())
+register_backend(NumpyBackend())
+
+if numba is not None:
+    register_backend(LoopBackend("numba", numba.njit(cache=True)))
+
+active: KernelBackend = BACKENDS[DEFAULT_BACKEND]
+set_backend(os.environ.get("RAYTRACER_KERNELS", DEFAULT_BACKEND))
+
+
+# the kernels as called by the rest of the renderer, they count the work done into the active stats and
+# hand the call to the active backend
+
+def closest_hit(origins: np.array, directions: np.array, triangles: np.array, face_normals: np.array, t0, t1) -> (np.array, np.array, np.array, np.array):
+    if stats.active is not None and not active.counts_tests:
+        stats.active.add("triangle_tests", len(origins) * len(triangles))
+
+    return active.closest_hit(origins, directions, triangles, face_normals, t0, t1)
+
+
+def any_hit(origins: np.array, directions: np.array, triangles: np.array, face_normals: np.array, t0, t1) -> np.array:
+    if stats.active is not None and not active.counts_tests:
+        stats.active.add("triangle_tests", len(origins) * len(triangles))
+
+    return active.any_hit(origins, directions, triangles, face_normals, t0, t1)
+
+
+def closest_hit_reduction(hit: np.array, t: np.array, theta: np.array, beta: np.array) -> (np.array, np.array, np.array, np.array):
+    return active.closest_hit_reduction(hit, t, theta, beta)
+
+
+def ray_aabb_entry(origins: np.array, inv_directions: np.array, box_min: np.array, box_max: np.array, t_min, t_max) -> np.array:
+    if stats.active is not None and not active.counts_tests:
+        stats.active.add("aabb_tests", len(origins))
+
+    return active.ray_aabb_entry(origins, inv_directions, box_min, box_max, t_min, t_max)
+
+
+def shade(point_hit: np.array, normal_w: np.array, directions: np.array, lit: np.array, light_position: np.array,
+          light_radiance: np.array, ambient_light: np.array, ka: np.array, kd: np.array, ks: np.array, p: np.array,
+          diffuse_color: np.array, specular_color: np.array) -> np.array:
+    """
+    - light_position and light_radiance are (3,) for one light shading every hit, or (K, 3) for a light per hit
+    """
+    light_position = np.broadcast_to(light_position, point_hit.shape)
+    light_radiance = np.broadcast_to(light_radiance, point_hit.shape)
+
+    return active.shade(point_hit, normal_w, directions, lit, light_position, light_radiance, ambient_light, ka, kd,
+                        ks, p, diffuse_color, specular_color)
+
+
+def verify_backend(name: str, seed: int = 0, tolerance: float = 1e-9) -> list[str]:
+    """
+    Runs every kernel of backend name and of the reference backend on the same random rays, triangles,
+    boxes and hits.
+    - returned is a description of every result that differs from the reference by more than tolerance
+    """
+    backend = BACKENDS[name]
+    reference = BACKENDS["reference"]
+    rng = np.random.default_rng(seed)
+    failures = []
+
+    def compare(kernel: str, results, expected) -> None:
+        if not isinstance(results, tuple):
+            results, expected = (results,), (expected,)
+
+        for index, (result, expected_result) in enumerate(zip(results, expected)):
+            result = np.asarray(result)
+            expected_result = np.asarray(expected_result)
+
+            if result.shape != expected_result.shape:
+                failures.append(f'{name} {kernel} output {index}: shape {result.shape} vs {expected_result.shape}')
+            elif result.dtype == np.bool_ or np.issubdtype(result.dtype, np.integer):
+                mismatches = np.count_nonzero(result != expected_result)
+                if mismatches:
+                    failures.append(f'{name} {kernel} output {index}: {mismatches} values differ')
+            else:
+                finite = np.isfinite(expected_result)
+                if not np.array_equal(finite, np.isfinite(result)) or not np.allclose(result[finite], expected_result[finite], rtol=0, atol=tolerance):
+                    failures.append(f'{name} {kernel} output {index}: differs by more than {tolerance}')
+
+    # rays from around the origin towards points on a cloud of triangles, so most hit something
+    ray_count, triangle_count = 64, 40
+    triangles = rng.uniform(-1, 1, (triangle_count, 3, 3))
+    edge_normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    face_normals = edge_normals / np.linalg.norm(edge_normals, axis=1)[:, None]
+    origins = rng.uniform(-3, 3, (ray_count, 3))
+    targets = triangles[rng.integers(0, triangle_count, ray_count)].mean(axis=1)
+    directions = targets - origins
+    t0 = np.full(ray_count, EPSILON)
+    t1 = rng.uniform(0.5, 2, ray_count)
+
+    arguments = (origins, directions, triangles, face_normals, t0, t1)
+    compare("closest_hit", backend.closest_hit(*arguments), reference.closest_hit(*arguments))
+    compare("any_hit", backend.any_hit(*arguments), reference.any_hit(*arguments))
+
+    hit = rng.random((ray_count, triangle_count)) < 0.2
+    t, theta, beta = rng.random((3, ray_count, triangle_count))
+    compare("closest_hit_reduction", backend.closest_hit_reduction(hit, t, theta, beta),
+            reference.closest_hit_reduction(hit, t, theta, beta))
+
+    inv_directions = math_helper.inverse_directions(directions)
+    box_min, box_max = np.array([-0.5, -0.5, -0.5]), np.array([0.5, 0.75, 1.0])
+    t_min, t_max = np.zeros(ray_count), np.full(ray_count, 10.0)
+    compare("ray_aabb_entry", backend.ray_aabb_entry(origins, inv_directions, box_min, box_max, t_min, t_max),
+            reference.ray_aabb_entry(origins, inv_directions, box_min, box_max, t_min, t_max))
+
+    shade_arguments = (targets, face_normals[rng.integers(0, triangle_count, ray_count)], directions, rng.random(ray_count) < 0.7,
+                       rng.uniform(-3, 3, (ray_count, 3)), rng.uniform(0, 15, (ray_count, 3)), np.array([0.1, 0.1, 0.1]),
+                       rng.random(ray_count), rng.random(ray_count), rng.random(ray_count), rng.uniform(1, 50, ray_count),
+                       rng.random((ray_count, 3)), rng.random((ray_count, 3)))
+    compare("shade", backend.shade(*shade_arguments), reference.shade(*shade_arguments))
+
+    return failures
+
+
+if __name__ == "__main__":
+    all_failures = []
+    for backend_name in available_backends():
+        backend_failures = verify_backend(backend_name)
+        all_failures += backend_failures
+        print(f'{backend_name}: {"ok" if not backend_failures else f"{len(backend_failures)} failures"}')
+
+    for failure in all_failures:
+        print(failure)
+
+    sys.exit(1 if all_failures else 0)
@@ -1,10 +1,263 @@
-from transform import Transform
+import math
+
 import numpy as np
 
+from bvh import BVH
+from transform import Transform
+
 
 class PointLight:
 
-    def __init__(self, intensity: float, color: np.array):
+    def __init__(self, intensity: float, color: np.array, radius: float = None):
         self.transform = Transform()
         self.intensity = intensity
         self.color = color
+        # points further away than radius aren't lit at all, None leaves it to the LightSet's cutoff
+        self.radius = radius
+
+
+class LightSet:
+    """
+    The lights of a scene, and which of them shade a given point.
+    A light's contribution falls off with 1/d², so it's skipped wherever intensity * max(color) / d² drops below
+    cutoff, that is beyond sqrt(intensity * max(color) / cutoff), or beyond its own radius if it has one. The lights
+    reaching a point are found with a BVH over those spheres.
+    If more than samples lights reach a point, only samples of them are shaded (with a shadow ray each), picked with
+    probability proportional to their unshadowed contribution and weighted by one over that, so the image converges to
+    the same one and shading costs at most samples lights per point however many there are. A point none of them
+    would light (all behind it) is shaded with all of them, as without sampling.
+    - cutoff 0 and samples None shade every light at every point
+    - the picks are seeded from seed and each point's coordinates, the same way for lights_at and light_pairs,
+      so renders are repeatable on any backend
+    """
+
+    def __init__(self, lights: list[PointLight], cutoff: float = 0.0, samples: int = None, seed: int = 0):
+        if len(lights) == 0:
+            raise Exception("A LightSet needs at least one light")
+        if samples is not None and samples < 1:
+            raise Exception(f'LightSet samples must be at least 1, not {samples}')
+
+        self.lights: list[PointLight] = list(lights)
+        self.cutoff: float = cutoff
+        self.samples: int = samples
+        self.seed: int = seed
+
+        # world positions, intensity times color and reach of the lights, see update
+        self.positions: np.array = None
+        self.radiance: np.array = None
+        self.radii: np.array = None
+        # the lights reaching everywhere, and a BVH over the others (None if there are none)
+        self.unbounded: np.array = None
+        self.bounded: np.array = None
+        self.bvh: BVH = None
+
+        self._key: tuple = None
+        self.update()
+
+    def __len__(self) -> int:
+        return len(self.lights)
+
+    def update(self) -> None:
+        """
+        Picks up changes to the lights' transforms, intensities, colors and radii, the BVH is only rebuilt then
+        """
+        key = (self.cutoff, tuple((light.transform.version, light.intensity, tuple(np.asarray(light.color).tolist()),
+                                   light.radius) for light in self.lights))
+        if key == self._key:
+            return
+
+        self.positions = np.array([light.transform.apply_to_point(np.zeros(3)) for light in self.lights], dtype=np.float64)
+        self.radiance = np.array([light.intensity * np.asarray(light.color, dtype=np.float64) for light in self.lights])
+
+        brightest = self.radiance.max(axis=1)
+        self.radii = np.array([light.radius if light.radius is not None
+                               else math.sqrt(max(peak, 0.0) / self.cutoff) if self.cutoff > 0
+                               else math.inf for light, peak in zip(self.lights, brightest)], dtype=np.float64)
+
+        self.unbounded = np.nonzero(np.isinf(self.radii))[0]
+        self.bounded = np.nonzero(~np.isinf(self.radii))[0]
+        self.bvh = None
+        if len(self.bounded) > 0:
+            reach = self.radii[self.bounded, None]
+            self.bvh = BVH(self.positions[self.bounded] - reach, self.positions[self.bounded] + reach)
+
+        # ray_color works on plain floats
+        self.position_list: list = self.positions.tolist()
+        self.radiance_list: list = self.radiance.tolist()
+        self._radius_sq_list: list = (self.radii ** 2).tolist()
+        self._power_list: list = self.radiance.sum(axis=1).tolist()
+        self._unbounded_list: list = self.unbounded.tolist()
+        self._bounded_list: list = self.bounded.tolist()
+        self._everywhere: list = [(light, 1.0) for light in range(len(self.lights))]
+
+        self._key = key
+
+    def lights_at(self, point: tuple, normal: tuple) -> list:
+        """
+        - point and normal are (x, y, z) tuples of floats
+        - returned is [(light index, weight)] of the lights to shade point with, in light order, a light's
+          contribution is multiplied by its weight
+        """
+        if self.bvh is None and (self.samples is None or len(self.lights) <= self.samples):
+            return self._everywhere
+
+        positions = self.position_list
+        candidates = list(self._unbounded_list)
+        if self.bvh is not None:
+            radius_sq = self._radius_sq_list
+            bounded = self._bounded_list
+            for prim in self.bvh.containing(point):
+                light = bounded[prim]
+                position = positions[light]
+                d_x, d_y, d_z = position[0] - point[0], position[1] - point[1], position[2] - point[2]
+                if d_x * d_x + d_y * d_y + d_z * d_z <= radius_sq[light]:
+                    candidates.append(light)
+        candidates.sort()
+
+        if self.samples is None or len(candidates) <= self.samples:
+            return [(light, 1.0) for light in candidates]
+
+        # the same picks light_pairs makes, for a batch of one point
+        lights = np.array(candidates)
+        points = np.array([point], dtype=np.float64)
+        estimates = self._estimates(points, np.array([normal], dtype=np.float64), lights)
+        picks, weights, sampled = self._pick(points, np.zeros(1, dtype=np.int64), np.array([len(lights)]), estimates)
+        if not sampled[0]:
+            return [(light, 1.0) for light in candidates]
+
+        return list(zip(lights[picks].tolist(), weights.tolist()))
+
+    def light_pairs(self, points: np.array, normals: np.array) -> (np.array, np.array, np.array):
+        """
+        Batched lights_at
+        - points and normals are (K, 3)
+        - returned is (point indices, light indices, weights), one entry per light to shade a point with,
+          ordered by point then light
+        """
+        point_count = len(points)
+        light_count = len(self.lights)
+
+        if self.bvh is None:
+            point_indices = np.repeat(np.arange(point_count), light_count)
+            light_indices = np.tile(np.arange(light_count), point_count)
+        else:
+            bounded_points, prims = self.bvh.containing_batch(points)
+            bounded_lights = self.bounded[prims]
+            offsets = self.positions[bounded_lights] - points[bounded_points]
+            reaches = np.sum(offsets * offsets, axis=1) <= self.radii[bounded_lights] ** 2
+
+            point_indices = np.concatenate((np.repeat(np.arange(point_count), len(self.unbounded)), bounded_points[reaches]))
+            light_indices = np.concatenate((np.tile(self.unbounded, point_count), bounded_lights[reaches]))
+
+            order = np.lexsort((light_indices, point_indices))
+            point_indices = point_indices[order]
+            light_indices = light_indices[order]
+
+        weights = np.ones(len(point_indices))
+
+        if self.samples is not None and len(point_indices) > 0:
+            point_indices, light_indices, weights = self._sample_pairs(points, normals, point_indices, light_indices, weights)
+
+        return point_indices, light_indices, weights
+
+    def _sample_pairs(self, points: np.array, normals: np.array, point_indices: np.array, light_indices: np.array,
+                      weights: np.array) -> (np.array, np.array, np.array):
+        crowded = np.bincount(point_indices, minlength=len(points))[point_indices] > self.samples
+        if not np.any(crowded):
+            return point_indices, light_indices, weights
+
+        crowded_points = point_indices[crowded]
+        crowded_lights = light_indices[crowded]
+        estimates = self._estimates(points[crowded_points], normals[crowded_points], crowded_lights)
+
+        # pairs are ordered by point, so each crowded point's candidates are a run starting at starts
+        group_points, starts, counts = np.unique(crowded_points, return_index=True, return_counts=True)
+        picks, pick_weights, sampled = self._pick(points[group_points], starts, counts, estimates)
+
+        # points that couldn't be sampled keep all their pairs
+        kept = ~crowded
+        kept[np.nonzero(crowded)[0][~np.repeat(sampled, counts)]] = True
+
+        point_indices = np.concatenate((point_indices[kept], crowded_points[picks]))
+        light_indices = np.concatenate((light_indices[kept], crowded_lights[picks]))
+        weights = np.concatenate((weights[kept], pick_weights))
+
+        order = np.lexsort((light_indices, point_indices))
+
+        return point_indices[order], light_indices[order], weights[order]
+
+    def _estimates(self, points: np.array, normals: np.array, lights: np.array) -> np.array:
+        """
+        - points and normals are (n, 3) and lights (n,), one per pair
+        - returned is the (n,) unshadowed contribution of each light at its point, what the picks are weighted by
+        """
+        offsets = self.positions[lights] - points
+        d_sq = np.sum(offsets * offsets, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cos_t = np.sum(offsets * normals, axis=1) / np.sqrt(d_sq)
+            return np.where(d_sq > 0, self.radiance[lights].sum(axis=1) * np.maximum(cos_t, 0) / d_sq, 0.0)
+
+    def _pick(self, points: np.array, starts: np.array, counts: np.array, estimates: np.array) -> (np.array, np.array, np.array):
+        """
+        Draws samples candidates per point with probability proportional to their estimates
+        - points are the (G, 3) points sampled, their candidates are estimates[starts[g]:starts[g] + counts[g]]
+        - returned is (picked indices into estimates, their weights, which points were sampled), ordered by point
+          then candidate, a candidate picked more than once is returned once with the weights added up. Points
+          whose estimates are all zero aren't sampled and get no picks
+        """
+        samples = self.samples
+        group_count = len(starts)
+        group = np.repeat(np.arange(group_count), counts)
+        column = np.arange(len(estimates)) - starts[group]
+
+        # one row of running sums per point, summed along the row so each comes out the same as for the point alone
+        table = np.zeros((group_count, int(counts.max())))
+        table[group, column] = estimates
+        cumulative = np.cumsum(table, axis=1)
+        totals = cumulative[:, -1]
+        sampled = totals > 0
+
+        # a pick is the first candidate whose running sum passes u * total, which has a positive estimate. Should
+        # u * total reach the total, the pick is held to the last candidate with a positive estimate
+        last_positive = table.shape[1] - 1 - np.argmax(table[:, ::-1] > 0, axis=1)
+        targets = point_uniforms(self.seed, points, samples) * totals[:, None]
+        picks = np.empty((group_count, samples), dtype=np.int64)
+        for sample in range(samples):
+            picks[:, sample] = np.count_nonzero(cumulative <= targets[:, sample, None], axis=1)
+        picks = np.minimum(picks, last_positive[:, None])
+
+        picks = (starts[:, None] + picks)[sampled].ravel()
+        picks, pick_counts = np.unique(picks, return_counts=True)
+        weights = pick_counts * totals[group[picks]] / (samples * estimates[picks])
+
+        return picks, weights, sampled
+
+
+# SplitMix64's constants, see Steele et al. "Fast Splittable Pseudorandom Number Generators"
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def _mix64(values: np.array) -> np.array:
+    values = (values ^ (values >> np.uint64(30))) * MIX_MULTIPLIERS[0]
+    values = (values ^ (values >> np.uint64(27))) * MIX_MULTIPLIERS[1]
+    return values ^ (values >> np.uint64(31))
+
+
+def point_uniforms(seed: int, points: np.array, count: int) -> np.array:
+    """
+    Random numbers keyed by each point's coordinates, so a point gets the same ones whatever else is in the batch.
+    The coordinates are rounded to float32 first, the recursive and wavefront paths can differ in the last bits of
+    the same hit point.
+    - points is (K, 3)
+    - returned is (K, count) floats in [0, 1)
+    """
+    bits = np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 3).astype(np.float32).view(np.uint32).astype(np.uint64)
+
+    keys = _mix64(np.full(len(bits), seed & 0xFFFFFFFFFFFFFFFF, dtype=np.uint64) + GOLDEN_GAMMA)
+    for axis in range(3):
+        keys = _mix64((keys ^ bits[:, axis]) + GOLDEN_GAMMA)
+
+    steps = np.arange(1, count + 1, dtype=np.uint64) * GOLDEN_GAMMA
+    # the top 53 bits, as many as a float64 holds
+    return (_mix64(keys[:, None] + steps[None, :]) >> np.uint64(11)) * (1.0 / (1 << 53))
@@ -1,5 +1,8 @@
+import math
+
 import numpy as np
 
+import stats
 from ray import Ray
 from ray_triangle_intersection_result import RayTriangleIntersectionResult
 
@@ -23,6 +26,35 @@ def check_if_vectors_identical(v1: np.array, v2: np.array) -> bool:
     return np.array_equal(v1, v2)
 
 
+def weld_vertices(points: np.array, tolerance: float = 0.0) -> (np.array, np.array):
+    """
+    Merges duplicate vertices with one np.unique pass rather than comparing every pair.
+    - points is an (N, 3) array of possibly repeated vertices
+    - tolerance > 0 snaps the points to a grid of that size first, so near duplicates merge too
+    - returned is (vertices, indices): the unique vertices in order of first appearance, and for each
+      point the index of its vertex
+    """
+    points = np.ascontiguousarray(points)
+
+    if tolerance > 0:
+        keys = np.ascontiguousarray(np.round(points / tolerance).astype(np.int64))
+    else:
+        # +0.0 folds -0.0 into 0.0 so they weld like np.array_equal would
+        keys = points + 0.0
+
+    # viewing each row as one opaque value lets np.unique sort whole vertices at once instead of column by column
+    row_view = keys.view(np.dtype((np.void, keys.dtype.itemsize * 3))).ravel()
+    _, first_index, inverse = np.unique(row_view, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # renumber so vertices keep the order they first appear in
+    order = np.argsort(first_index, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+
+    return points[first_index[order]], rank[inverse]
+
+
 def multiply_matrices(v1: np.array, v2: np.array) -> np.array:
     if v1.shape[1] != v2.shape[0]:
         raise Exception("Malformed matrix multiplication")
@@ -34,6 +66,22 @@ def get_normalized(v1: np.array) -> np.array:
     return v1 / magnitude(v1)
 
 
+# scalar versions of the above for the per-ray path, on (x, y, z) tuples of floats (or anything indexable).
+# They skip numpy's per call overhead, which costs far more than the arithmetic on 3 values
+
+def dot3(v1, v2) -> float:
+    return v1[0] * v2[0] + v1[1] * v2[1] + v1[2] * v2[2]
+
+
+def magnitude3(v1) -> float:
+    return math.sqrt(v1[0] * v1[0] + v1[1] * v1[1] + v1[2] * v1[2])
+
+
+def get_normalized3(v1) -> tuple:
+    length = magnitude3(v1)
+    return v1[0] / length, v1[1] / length, v1[2] / length
+
+
 def get_3d_barycentric_coords(p: np.array, a: np.array, b: np.array, c: np.array) -> np.array:
     """
     - p is the 3d point being tested against the triangle
@@ -99,10 +147,17 @@ def get_2d_barycentric_coords(p: np.array, a: np.array, b: np.array, c: np.array
     return np.array([alpha, beta, gamma])
 
 
+# shared by every miss so the scalar path doesn't allocate a result per rejected triangle, never modify it
+MISS = RayTriangleIntersectionResult(False, 0, 0, 0)
+
+
 def ray_triangle_intersection(ray: Ray, a_point: np.array, b_point: np.array, c_point: np.array, t0: float, t1: float) -> RayTriangleIntersectionResult:
 
     EPSILON = 0.00001
 
+    if stats.active is not None:
+        stats.active.add("triangle_tests")
+
     a_point_x = a_point[0]
     a_point_y = a_point[1]
     a_point_z = a_point[2]
@@ -143,7 +198,7 @@ def ray_triangle_intersection(ray: Ray, a_point: np.array, b_point: np.array, c_
     M = a*ei_minus_hf + b*gf_minus_di + c*dh_minus_eg
 
     if abs(M) < EPSILON:
-        return RayTriangleIntersectionResult(False, 0, 0, 0)
+        return MISS
 
     ak_minus_jb = a*k - j*b
     jc_minus_al = j*c - a*l
@@ -152,17 +207,17 @@ def ray_triangle_intersection(ray: Ray, a_point: np.array, b_point: np.array, c_
     t = -(f*ak_minus_jb + e*jc_minus_al + d*bl_minus_kc) / M
 
     if t < t0 or t > t1:
-        return RayTriangleIntersectionResult(False, 0, 0, 0)
+        return MISS
 
     theta = (i*ak_minus_jb + h*jc_minus_al + g*bl_minus_kc) / M
 
     if theta < 0 or theta > 1:
-        return RayTriangleIntersectionResult(False, 0, 0, 0)
+        return MISS
 
     beta = (j*ei_minus_hf + k*gf_minus_di + l*dh_minus_eg) / M
 
     if beta < 0 or beta > (1 - theta):
-        return RayTriangleIntersectionResult(False, 0, 0, 0)
+        return MISS
 
     return RayTriangleIntersectionResult(True, t, theta, beta)
 
@@ -171,6 +226,9 @@ EPSILON = 0.00001
 
 def ray_aabb_intersection(ray: Ray, min_aabb_point: np.array, max_aabb_point: np.array) -> bool:
 
+    if stats.active is not None:
+        stats.active.add("aabb_tests")
+
     ray_t_max = 1000
     ray_t_min = -1000
 
@@ -201,3 +259,84 @@ def ray_aabb_intersection(ray: Ray, min_aabb_point: np.array, max_aabb_point: np
             return False
 
     return True
+
+
+def inverse_direction(direction: np.array) -> tuple:
+    """
+    - returned is 1 / direction per axis as plain floats, axes parallel to the ray get a huge value
+      keeping the sign, so the slab test still works out
+    """
+    inv = []
+    for i in range(3):
+        d = float(direction[i])
+        if abs(d) < EPSILON:
+            inv.append(1e32 if d >= 0 else -1e32)
+        else:
+            inv.append(1.0 / d)
+
+    return inv[0], inv[1], inv[2]
+
+
+def ray_aabb_entry(origin: tuple, inv_direction: tuple, min_aabb_point, max_aabb_point, t_min: float, t_max: float):
+    """
+    Slab test of a ray with precomputed inverse direction against an AABB.
+    - returned is the distance at which the ray enters the box (clamped to t_min), or None if it misses the box
+      within [t_min, t_max]
+    """
+    if stats.active is not None:
+        stats.active.add("aabb_tests")
+
+    # unrolled by axis, a loop over range(3) costs about as much as the arithmetic
+    inv_d = inv_direction[0]
+    if inv_d < 0:
+        t0 = (max_aabb_point[0] - origin[0]) * inv_d
+        t1 = (min_aabb_point[0] - origin[0]) * inv_d
+    else:
+        t0 = (min_aabb_point[0] - origin[0]) * inv_d
+        t1 = (max_aabb_point[0] - origin[0]) * inv_d
+    if t0 > t_min:
+        t_min = t0
+    if t1 < t_max:
+        t_max = t1
+    if t_max < t_min:
+        return None
+
+    inv_d = inv_direction[1]
+    if inv_d < 0:
+        t0 = (max_aabb_point[1] - origin[1]) * inv_d
+        t1 = (min_aabb_point[1] - origin[1]) * inv_d
+    else:
+        t0 = (min_aabb_point[1] - origin[1]) * inv_d
+        t1 = (max_aabb_point[1] - origin[1]) * inv_d
+    if t0 > t_min:
+        t_min = t0
+    if t1 < t_max:
+        t_max = t1
+    if t_max < t_min:
+        return None
+
+    inv_d = inv_direction[2]
+    if inv_d < 0:
+        t0 = (max_aabb_point[2] - origin[2]) * inv_d
+        t1 = (min_aabb_point[2] - origin[2]) * inv_d
+    else:
+        t0 = (min_aabb_point[2] - origin[2]) * inv_d
+        t1 = (max_aabb_point[2] - origin[2]) * inv_d
+    if t0 > t_min:
+        t_min = t0
+    if t1 < t_max:
+        t_max = t1
+    if t_max < t_min:
+        return None
+
+    return t_min
+
+
+def inverse_directions(directions: np.array) -> np.array:
+    """
+    Vectorized inverse_direction for an (M, 3) array of directions
+    """
+    directions = np.asarray(directions, dtype=np.float64)
+    safe = np.where(directions >= 0, 1e32, -1e32)
+    with np.errstate(divide='ignore'):
+        return np.where(np.abs(directions) < EPSILON, safe, 1.0 / np.where(directions == 0, 1.0, directions))
@@ -1,8 +1,9 @@
-import sys
-
 import numpy as np
 from stl import mesh
+import kernels
 import math_helper
+import stl_stream
+from bvh import BVH
 from hit_record import HitRecord
 from material import Material
 from ray import Ray
@@ -12,11 +13,25 @@ from transform import Transform
 
 class Mesh:
 
+    # leaves with at least this many faces are tested with the vectorized kernel, below it numpy's
+    # per call overhead costs more than the scalar loop
+    BATCH_LEAF_THRESHOLD = 24
+
+    # rows transformed to world space (and triangles bounded for the BVH) at a time
+    WORLD_CHUNK_ROWS = 1 << 18
+
+    # geometry is kept at the precision STL files store it in, vertex normals are computed in float64
+    VERTEX_DTYPE = np.float32
+    NORMAL_DTYPE = np.float32
+    VERTEX_NORMAL_DTYPE = np.float64
+    FACE_DTYPE = np.int32
+
     def __init__(self, diffuse_color: np.array, specular_color: np.array, ka: float, kd: float, ks: float, ke: float, km: float, hard_edges: bool):
-        self.faces = []
-        self.normals = []
-        self.verts = []
-        self.vertex_normals = []
+        # (V, 3) vertices and vertex normals, (F, 3) vertex indices of each face and (F, 3) face normals
+        self.verts: np.array = np.zeros((0, 3), dtype=Mesh.VERTEX_DTYPE)
+        self.vertex_normals: np.array = np.zeros((0, 3), dtype=Mesh.VERTEX_NORMAL_DTYPE)
+        self.faces: np.array = np.zeros((0, 3), dtype=Mesh.FACE_DTYPE)
+        self.normals: np.array = np.zeros((0, 3), dtype=Mesh.NORMAL_DTYPE)
 
         self.diffuse_color: np.array = diffuse_color
         self.specular_color: np.array = specular_color
@@ -28,6 +43,13 @@ class Mesh:
 
         self.hard_edges = hard_edges
 
+        # the STL it was loaded from and how, see from_stl and scene_cache
+        self.source_path: str = None
+        self.weld_tolerance: float = 0.0
+        # where a streamed mesh keeps its memory mapped arrays, its world space ones and BVH included,
+        # see from_stl_streamed. None keeps them all in memory
+        self.out_dir: str = None
+
         self.material = Material(ka, kd, diffuse_color, ks, specular_color, ke, km)
 
         self.aabb_smallest_point_world = np.array([0, 0, 0])
@@ -35,156 +57,369 @@ class Mesh:
 
         self.transform = Transform()
 
-        self.calced_aabb_box = False
+        self.bvh = None
+
+        # world space copies of the geometry, rebuilt whenever the transform's version moves on. Triangles and
+        # their corner normals are gathered through faces for the faces being tested, see triangles_of
+        self.world_vertices: np.array = np.zeros((0, 3))
+        self.world_vertex_normals: np.array = np.zeros((0, 3))
+        self.world_face_normals: np.array = np.zeros((0, 3))
+        self.world_geometry_version: int = -1
+
+    def is_world_geometry_stale(self) -> bool:
+        return self.world_geometry_version != self.transform.version
+
+    def update_world_geometry(self) -> bool:
+        """
+        Re-transforms the vertices and normals to world space, recomputes the AABB and rebuilds the BVH,
+        but only if the transform changed since the last time.
+        - returned is whether anything was rebuilt
+        """
+        if not self.is_world_geometry_stale():
+            return False
+
+        version = self.transform.version
+
+        if self.out_dir is None:
+            world_vertices = self._world_points(self.verts)
+            world_vertex_normals = self._world_normals(self.vertex_normals)
+            world_face_normals = self._world_normals(self.normals)
+        else:
+            # a streamed mesh's are written to out_dir a chunk at a time, so no more than a chunk is in memory
+            world_vertices = self._write_world_array("world_vertices", self.verts, self._world_points)
+            world_vertex_normals = self._write_world_array("world_vertex_normals", self.vertex_normals, self._world_normals)
+            world_face_normals = self._write_world_array("world_face_normals", self.normals, self._world_normals)
+
+        self.set_world_geometry(world_vertices, world_vertex_normals, world_face_normals)
+        self.world_geometry_version = version
+
+        return True
+
+    def _world_points(self, points: np.array) -> np.array:
+        # the float32 arrays are promoted by the float64 matrices, so world space is float64
+        return self.transform.apply_to_points(points)
+
+    def _world_normals(self, normals: np.array) -> np.array:
+        # the normal matrix stretches normals under non-uniform scale, so they're renormalized.
+        # Degenerate triangles have zero normals, they're left at zero instead of turning into NaNs
+        world_normals = self.transform.apply_to_normals(normals)
+        lengths = np.linalg.norm(world_normals, axis=1)
+        return world_normals / np.where(lengths > 0, lengths, 1)[:, None]
+
+    def _write_world_array(self, name: str, rows: np.array, to_world) -> np.array:
+        def fill(values: np.array) -> None:
+            for start in range(0, len(rows), Mesh.WORLD_CHUNK_ROWS):
+                values[start:start + Mesh.WORLD_CHUNK_ROWS] = to_world(rows[start:start + Mesh.WORLD_CHUNK_ROWS])
+
+        return stl_stream.write_mapped(self.out_dir, name, np.float64, (len(rows), 3), fill)
+
+    def triangles_of(self, face_indices) -> np.array:
+        """
+        - face_indices is an array or slice of faces
+        - returned is the (n, 3, 3) world space corners of those faces
+        """
+        return self.world_vertices[self.faces[face_indices]]
+
+    def set_world_geometry(self, world_vertices: np.array, world_vertex_normals: np.array, world_face_normals: np.array,
+                           bvh: BVH = None) -> None:
+        """
+        Sets the world space geometry for the current transform and everything derived from it, building the BVH
+        unless one built over these triangles is given
+        """
+        self.world_vertices = world_vertices
+        self.world_vertex_normals = world_vertex_normals
+        self.world_face_normals = world_face_normals
+
+        self.calc_aabb_box()
+        if bvh is None:
+            self.build_bvh()
+        else:
+            self.bvh = bvh
 
     def hit(self, ray: Ray, t_min: float, t_max: float) -> (bool, HitRecord):
 
-        if not self.calced_aabb_box:
-            self.calc_aabb_box()
-            self.calced_aabb_box = True
+        if self.world_geometry_version != self.transform.version:
+            self.update_world_geometry()
 
-        if not math_helper.ray_aabb_intersection(ray, self.aabb_smallest_point_world, self.aabb_greatest_point_world):
-            # print("rejecting from AABB miss")
-            return False, None
+        # the BVH root box is the mesh's AABB, so the traversal does the AABB rejection
+        face_hit, payload = self.bvh.closest_hit(ray, t_min, t_max, self._hit_faces)
 
-        # print("got here")
+        if not face_hit:
+            return False, None
 
-        hit_record = None
+        face_index, result = payload
+        face_normal_world = tuple(self.world_face_normals[face_index].tolist())
+
+        if self.hard_edges:
+            normal_w = face_normal_world
+        else:
+            n0, n1, n2 = self.world_vertex_normals[self.faces[face_index]].tolist()
+            alpha, beta, theta = result.alpha, result.beta, result.theta
+            normal_w = (n0[0] * alpha + n1[0] * beta + n2[0] * theta,
+                        n0[1] * alpha + n1[1] * beta + n2[1] * theta,
+                        n0[2] * alpha + n1[2] * beta + n2[2] * theta)
+            # opposing vertex normals can cancel out, that normal is left at zero as in world_normals_at
+            if math_helper.magnitude3(normal_w) > 0:
+                normal_w = math_helper.get_normalized3(normal_w)
+
+        point_hit = ray.at(result.t)
+        hit_record = HitRecord(point_hit, face_normal_world, result, normal_w, self.material)
+
+        return True, hit_record
+
+    def _hit_faces(self, ray: Ray, face_indices: list, t_min: float, t_max: float) -> (bool, float, any):
+        """
+        BVH leaf test, finds the closest front facing triangle among face_indices
+        """
+        if len(face_indices) >= self.BATCH_LEAF_THRESHOLD:
+            return self._hit_faces_batch(ray, face_indices, t_min, t_max)
+
+        hit_payload = None
         face_hit: bool = False
         lowest_t: float = t_max + 1
 
-        for face_index, face in enumerate(self.faces):
-            face_normal = self.normals[face_index]
-            face_normal_world = math_helper.get_normalized(self.transform.apply_to_normal(face_normal))
+        # only the leaf's triangles are converted to floats, the mesh keeps just the arrays
+        face_normals = self.world_face_normals[face_indices].tolist()
+        triangles = self.triangles_of(face_indices).tolist()
+        direction = ray.direction
 
+        for face_index, face_normal, (a, b, c) in zip(face_indices, face_normals, triangles):
             # check if hitting back of face
-            if math_helper.dot(face_normal_world, ray.direction) > 0:
-                # hitting the back of the face
-                # print("rejecting from back face")
+            if math_helper.dot3(face_normal, direction) > 0:
                 continue
 
-            # let's try to do this in camera space to avoid ray -> world space complications
-
-            world_space_vertices: list = []
-            world_space_normals: list = []
-
-            for index in face:
-                w_vert = self.transform.apply_to_point(self.verts[index])
-                world_space_vertices.append(w_vert)
-
-                w_vert_normal = self.transform.apply_to_normal(self.vertex_normals[index])
-                world_space_normals.append(w_vert_normal)
-
-            # print(f'w_s_verts: {str(world_space_vertices)}')
-
-            result: RayTriangleIntersectionResult = math_helper.ray_triangle_intersection(ray, world_space_vertices[0], world_space_vertices[1], world_space_vertices[2], t_min, t_max)
-
-            if self.hard_edges:
-                normal_w = face_normal_world
-            else:
-                normal_w: np.array = math_helper.get_normalized(world_space_normals[0] * result.alpha + world_space_normals[1] * result.beta +
-                                               world_space_normals[2] * result.theta)
+            result: RayTriangleIntersectionResult = math_helper.ray_triangle_intersection(ray, a, b, c, t_min, t_max)
 
             if result.hit and result.t < lowest_t:
                 lowest_t = result.t
                 face_hit = True
-                point_hit = ray.at(result.t)
-                hit_record = HitRecord(point_hit, face_normal_world, result, normal_w, self.material)
+                hit_payload = (face_index, result)
 
-        return face_hit, hit_record
+        return face_hit, lowest_t, hit_payload
 
-    def calc_aabb_box(self):
-        large_num: float = 100000.0
-        small_num: float = -100000.0
-        aabb_smallest_point: np.array = np.array([large_num, large_num, large_num])
-        aabb_greatest_point: np.array = np.array([small_num, small_num, small_num])
+    def _hit_faces_batch(self, ray: Ray, face_indices: list, t_min: float, t_max: float) -> (bool, float, any):
+        face_indices = np.asarray(face_indices)
+
+        closest_index, t, theta, beta = kernels.closest_hit(np.array([ray.origin], dtype=np.float64), np.array([ray.direction], dtype=np.float64),
+                                                            self.triangles_of(face_indices), self.world_face_normals[face_indices],
+                                                            t_min, t_max)
 
-        world_space_vertices: list = []
-        for vert in self.verts:
-            nw_vert = self.transform.apply_to_point(vert)
-            world_space_vertices.append(nw_vert)
-            # print(f'original vert: {vert} nw_vert: {nw_vert}')
+        if closest_index[0] == -1:
+            return False, t_max + 1, None
 
-        for w_vert in world_space_vertices:
-            # SMALLEST
-            if w_vert[0] < aabb_smallest_point[0]:
-                aabb_smallest_point[0] = w_vert[0]
+        result = RayTriangleIntersectionResult(True, float(t[0]), float(theta[0]), float(beta[0]))
 
-            if w_vert[1] < aabb_smallest_point[1]:
-                aabb_smallest_point[1] = w_vert[1]
+        return True, result.t, (int(face_indices[closest_index[0]]), result)
 
-            if w_vert[2] < aabb_smallest_point[2]:
-                aabb_smallest_point[2] = w_vert[2]
+    def occluded(self, ray: Ray, t_min: float, t_max: float) -> bool:
+        """
+        Shadow ray query, True as soon as any front facing triangle is hit in [t_min, t_max].
+        No normals are interpolated and no HitRecord is built.
+        """
+        if self.world_geometry_version != self.transform.version:
+            self.update_world_geometry()
 
-            # GREATEST
-            if w_vert[0] > aabb_greatest_point[0]:
-                aabb_greatest_point[0] = w_vert[0]
+        return self.bvh.any_hit(ray, t_min, t_max, self._occluded_faces)
 
-            if w_vert[1] > aabb_greatest_point[1]:
-                aabb_greatest_point[1] = w_vert[1]
+    def _occluded_faces(self, ray: Ray, face_indices: list, t_min: float, t_max: float) -> bool:
+        if len(face_indices) >= self.BATCH_LEAF_THRESHOLD:
+            face_hit, _, _ = self._hit_faces_batch(ray, face_indices, t_min, t_max)
+            return face_hit
 
-            if w_vert[2] > aabb_greatest_point[2]:
-                aabb_greatest_point[2] = w_vert[2]
+        face_normals = self.world_face_normals[face_indices].tolist()
+        triangles = self.triangles_of(face_indices).tolist()
+        direction = ray.direction
 
-        print("smallest point: " + str(aabb_smallest_point))
-        print("greatest point: " + str(aabb_greatest_point))
+        for face_normal, (a, b, c) in zip(face_normals, triangles):
+            # check if hitting back of face
+            if math_helper.dot3(face_normal, direction) > 0:
+                continue
 
-        # copy vertices from vert_list
-        self.aabb_smallest_point_world = aabb_smallest_point
-        self.aabb_greatest_point_world = aabb_greatest_point
+            if math_helper.ray_triangle_intersection(ray, a, b, c, t_min, t_max).hit:
+                return True
+
+        return False
+
+    def occluded_batch(self, origins: np.array, directions: np.array, t_min, t_max, triangle_tests: np.array = None) -> np.array:
+        """
+        Vectorized occluded for (M, 3) arrays of ray origins and directions
+        - triangle_tests, if given, is an (M,) array each ray's triangle test count is added to
+        - returned is the (M,) bool array of occluded rays
+        """
+        if self.world_geometry_version != self.transform.version:
+            self.update_world_geometry()
+
+        def occluded_leaf_batch(ray_indices, face_indices, leaf_t_min, leaf_t_max):
+            if triangle_tests is not None:
+                triangle_tests[ray_indices] += len(face_indices)
+
+            return kernels.any_hit(origins[ray_indices], directions[ray_indices], self.triangles_of(face_indices),
+                                   self.world_face_normals[face_indices], leaf_t_min, leaf_t_max)
+
+        return self.bvh.any_hit_batch(origins, directions, t_min, t_max, occluded_leaf_batch)
+
+    def hit_batch(self, origins: np.array, directions: np.array, t_min, t_max, triangle_tests: np.array = None) -> (np.array, np.array, np.array, np.array, np.array):
+        """
+        Vectorized hit for (M, 3) arrays of ray origins and directions, normals are left to world_normals_at
+        - triangle_tests, if given, is an (M,) array each ray's triangle test count is added to
+        - returned is (hit, t, face_index, theta, beta), each of shape (M,)
+        """
+        if self.world_geometry_version != self.transform.version:
+            self.update_world_geometry()
+
+        ray_count = len(origins)
+        face_index = np.full(ray_count, -1, dtype=np.int64)
+        theta = np.zeros(ray_count)
+        beta = np.zeros(ray_count)
+
+        def hit_leaf_batch(ray_indices, face_indices, leaf_t_min, leaf_t_max):
+            if triangle_tests is not None:
+                triangle_tests[ray_indices] += len(face_indices)
+
+            # back facing faces are skipped by the kernel
+            closest, t, leaf_theta, leaf_beta = kernels.closest_hit(origins[ray_indices], directions[ray_indices],
+                                                                    self.triangles_of(face_indices),
+                                                                    self.world_face_normals[face_indices],
+                                                                    leaf_t_min, leaf_t_max)
+            hit = closest >= 0
+
+            rays_hit = ray_indices[hit]
+            face_index[rays_hit] = face_indices[closest[hit]]
+            theta[rays_hit] = leaf_theta[hit]
+            beta[rays_hit] = leaf_beta[hit]
+
+            return hit, t
+
+        t = self.bvh.closest_hit_batch(origins, directions, t_min, t_max, hit_leaf_batch)
+
+        return face_index >= 0, t, face_index, theta, beta
+
+    def world_normals_at(self, face_index: np.array, theta: np.array, beta: np.array) -> (np.array, np.array):
+        """
+        - returned is (face_normal, normal_w) for hits on face_index at barycentrics theta and beta, normal_w is
+          interpolated from the vertex normals unless the mesh has hard edges
+        """
+        face_normal = self.world_face_normals[face_index]
+
+        if self.hard_edges:
+            return face_normal, face_normal
+
+        corner_normals = self.world_vertex_normals[self.faces[face_index]]
+        alpha = (1 - beta) - theta
+        normal_w = corner_normals[:, 0] * alpha[:, None] + corner_normals[:, 1] * beta[:, None] + corner_normals[:, 2] * theta[:, None]
+        # opposing vertex normals can cancel out, those are left at zero instead of turning into NaNs
+        lengths = np.linalg.norm(normal_w, axis=1)
+        normal_w /= np.where(lengths > 0, lengths, 1)[:, None]
+
+        return face_normal, normal_w
+
+    def build_bvh(self) -> None:
+        """
+        Builds the BVH over the world space triangles of this mesh. A streamed mesh's is written to out_dir and
+        traversed straight from the mapped arrays
+        """
+        face_count = len(self.faces)
+        bounds_min = np.empty((face_count, 3))
+        bounds_max = np.empty((face_count, 3))
+
+        for start in range(0, face_count, Mesh.WORLD_CHUNK_ROWS):
+            triangles = self.triangles_of(slice(start, start + Mesh.WORLD_CHUNK_ROWS))
+            bounds_min[start:start + len(triangles)] = triangles.min(axis=1)
+            bounds_max[start:start + len(triangles)] = triangles.max(axis=1)
+
+        bvh = BVH(bounds_min, bounds_max, traversal_lists=self.out_dir is None)
+        del bounds_min, bounds_max
+
+        if self.out_dir is not None:
+            arrays = {name: stl_stream.write_mapped(self.out_dir, "bvh_" + name, values.dtype, values.shape, values)
+                      for name, values in bvh.arrays().items()}
+            mapped = BVH.from_arrays(arrays, bvh.max_leaf_size, bvh.bin_count, traversal_lists=False)
+            mapped.build_seconds = bvh.build_seconds
+            bvh = mapped
+
+        self.bvh = bvh
+
+    def calc_aabb_box(self):
+        if len(self.world_vertices) == 0:
+            return
+
+        self.aabb_smallest_point_world = self.world_vertices.min(axis=0)
+        self.aabb_greatest_point_world = self.world_vertices.max(axis=0)
+
+    def memory_footprint(self) -> dict:
+        """
+        What the mesh holds while it's rendered, the per-ray path converts only the triangles of the leaf it's
+        testing so nothing is added once it's been hit.
+        - returned is the bytes held by the mesh's geometry ("geometry"), its world space arrays ("world"), the
+          BVH's arrays ("bvh") and its per-ray traversal lists ("bvh_lists", estimated), plus
+          "bytes_per_triangle" for the geometry alone and "total_bytes_per_triangle" for all of it.
+          Memory mapped arrays count as much as ones in memory
+        """
+        footprint = {
+            "geometry": sum(np.asarray(values).nbytes for values in (self.verts, self.vertex_normals, self.faces, self.normals)),
+            "world": sum(values.nbytes for values in (self.world_vertices, self.world_vertex_normals, self.world_face_normals)),
+            "bvh": 0 if self.bvh is None else sum(values.nbytes for values in self.bvh.arrays().values()),
+            "bvh_lists": 0 if self.bvh is None else self.bvh.traversal_list_bytes(),
+        }
+
+        footprint["total"] = sum(footprint.values())
+
+        triangle_count = max(len(self.faces), 1)
+        footprint["bytes_per_triangle"] = footprint["geometry"] / triangle_count
+        footprint["total_bytes_per_triangle"] = footprint["total"] / triangle_count
+
+        return footprint
 
     @staticmethod
     def from_stl(stl_path, diffuse_color: np.array, specular_color: np.array, ka: float, kd: float, ks: float,
-                 ke: float, km: float, hard_edges: bool):
+                 ke: float, km: float, hard_edges: bool, weld_tolerance: float = 0.0):
+        """
+        - weld_tolerance: vertices closer than this (per axis, snapped to a grid of that size) are merged,
+          0 only merges identical vertices
+        """
         my_mesh: Mesh = Mesh(diffuse_color, specular_color, ka, kd, ks, ke, km, hard_edges)
-        stl_mesh: mesh.Mesh = mesh.Mesh.from_file(stl_path)
-
-        num_faces = len(stl_mesh.points)
-
-        vert_list = []
-        temp_faces = np.zeros((num_faces, 3), dtype=int)
-        temp_normals = np.zeros((num_faces, 3))
-
-        vert_normal_dict: dict[int, list[np.array]] = {}
+        my_mesh.source_path = stl_path
+        my_mesh.weld_tolerance = weld_tolerance
 
-        for face_index, face in enumerate(stl_mesh.points):
-
-            face_normal = stl_mesh.normals[face_index]
-            temp_normals[face_index] = face_normal
-
-            verts = [np.array(face[0:3]), np.array(face[3:6]), np.array(face[6:9])]
+        stl_mesh: mesh.Mesh = mesh.Mesh.from_file(stl_path)
 
-            for vert_index, vertex in enumerate(verts):
+        face_normals = np.asarray(stl_mesh.normals, dtype=Mesh.NORMAL_DTYPE).reshape(-1, 3)
 
-                # check if vertex is in vert_list
-                index = -1
-                for existing_index, existing_vert in enumerate(vert_list):
-                    if math_helper.check_if_vectors_identical(existing_vert, vertex):
-                        index = existing_index
-                        vert_normal_dict[index].append(np.array(face_normal))
-                        break
+        verts, vert_indices = math_helper.weld_vertices(stl_mesh.points.reshape(-1, 3), weld_tolerance)
+        faces = vert_indices.reshape(-1, 3)
 
-                if index == -1:  # get new index if not found
-                    index = len(vert_list)
-                    vert_list.append(vertex.tolist())
-                    vert_normal_dict[index] = [np.array(face_normal)]
+        # each vertex normal is the normalized sum of the normals of the faces using it
+        vert_normals = np.zeros((len(verts), 3))
+        np.add.at(vert_normals, vert_indices, np.repeat(face_normals.astype(np.float64), 3, axis=0))
+        lengths = np.linalg.norm(vert_normals, axis=1)
+        vert_normals /= np.where(lengths > 0, lengths, 1.0)[:, None]
 
-                temp_faces[face_index][vert_index] = index
+        my_mesh.verts = np.ascontiguousarray(verts, dtype=Mesh.VERTEX_DTYPE)
+        my_mesh.vertex_normals = vert_normals
+        my_mesh.faces = faces.astype(Mesh.FACE_DTYPE)
+        my_mesh.normals = face_normals
 
-        vert_normals = []
+        return my_mesh
 
-        for index, vert in enumerate(vert_list):
-            normals = vert_normal_dict[index]
-            normal_sum = np.array([0.0, 0.0, 0.0])
-            for normal in normals:
-                normal_sum += normal
+    @staticmethod
+    def from_stl_streamed(stl_path, out_dir, diffuse_color: np.array, specular_color: np.array, ka: float, kd: float,
+                          ks: float, ke: float, km: float, hard_edges: bool, weld_tolerance: float = 0.0,
+                          chunk_triangles: int = stl_stream.STL_CHUNK_TRIANGLES):
+        """
+        from_stl for binary STLs too big to load at once. The file is read and welded chunk_triangles at a time,
+        into memory mapped arrays kept in out_dir (see stl_stream), which the mesh uses as its geometry. Its world
+        space arrays and BVH are written there too, so rendering it keeps only the parts being traced in memory.
+        """
+        my_mesh: Mesh = Mesh(diffuse_color, specular_color, ka, kd, ks, ke, km, hard_edges)
+        my_mesh.source_path = stl_path
+        my_mesh.weld_tolerance = weld_tolerance
 
-            vert_normals.append(math_helper.get_normalized(normal_sum))
+        arrays = stl_stream.stream_stl_to_memmaps(stl_path, out_dir, weld_tolerance, chunk_triangles)
+        my_mesh.out_dir = out_dir
 
-        # copy vertices from vert_list
-        my_mesh.verts = vert_list
-        my_mesh.vertex_normals = vert_normals
-        my_mesh.faces = temp_faces.tolist()
-        my_mesh.normals = temp_normals.tolist()
+        my_mesh.verts = arrays["verts"]
+        my_mesh.vertex_normals = arrays["vertex_normals"]
+        my_mesh.faces = arrays["faces"]
+        my_mesh.normals = arrays["normals"]
 
-        return my_mesh
\ No newline at end of file
+        return my_mesh
@@ -0,0 +1,90 @@
+import os
+import struct
+import zlib
+
+import numpy as np
+
+
+class OutputSink:
+    """
+    Somewhere the renderer writes finished frames to.
+    - images are (width, height, 3) arrays of colors in [0, 255], indexed [x, y] with y going up
+    """
+
+    def write(self, image: np.array) -> None:
+        raise NotImplementedError
+
+    def write_cost_image(self, cost: np.array) -> None:
+        """
+        Called after write when the render kept a cost image, see RenderStats
+        - cost is a (width, height) array of triangle tests per pixel
+        """
+        pass
+
+
+class FileSink(OutputSink):
+    """
+    A sink writing to a file, the cost image goes next to it as <name>_cost.npy and a <name>_cost.png heatmap
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def write_cost_image(self, cost: np.array) -> None:
+        stem = os.path.splitext(self.path)[0]
+        np.save(stem + "_cost.npy", cost)
+
+        # brightest pixel is the most expensive one
+        scale = 255 / cost.max() if cost.max() > 0 else 0
+        PNGSink(stem + "_cost.png").write(np.repeat((cost * scale)[:, :, None], 3, axis=2))
+
+
+def to_rows(image: np.array) -> np.array:
+    """
+    - returned is the image as a (height, width, 3) uint8 array, top row first, the way image files store it
+    """
+    return np.ascontiguousarray(np.clip(image, 0, 255).astype(np.uint8).transpose(1, 0, 2)[::-1])
+
+
+class PNGSink(FileSink):
+
+    def write(self, image: np.array) -> None:
+        rows = to_rows(image)
+        height, width, _ = rows.shape
+
+        # every scanline starts with filter type 0 (none)
+        raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)
+        raw[:, 1:] = rows.reshape(height, width * 3)
+
+        with open(self.path, "wb") as file:
+            file.write(b"\x89PNG\r\n\x1a\n")
+            _write_png_chunk(file, b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            _write_png_chunk(file, b"IDAT", zlib.compress(raw.tobytes(), 6))
+            _write_png_chunk(file, b"IEND", b"")
+
+
+def _write_png_chunk(file, chunk_type: bytes, data: bytes) -> None:
+    file.write(struct.pack(">I", len(data)))
+    file.write(chunk_type)
+    file.write(data)
+    file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+class PPMSink(FileSink):
+
+    def write(self, image: np.array) -> None:
+        rows = to_rows(image)
+        height, width, _ = rows.shape
+
+        with open(self.path, "wb") as file:
+            file.write(f'P6\n{width} {height}\n255\n'.encode("ascii"))
+            file.write(rows.tobytes())
+
+
+class NpySink(FileSink):
+    """
+    Saves the frame exactly as rendered, (width, height, 3) and y going up
+    """
+
+    def write(self, image: np.array) -> None:
+        np.save(self.path, image)
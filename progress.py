@@ -0,0 +1,100 @@
+from output import FileSink, OutputSink
+
+
+class RenderCancelled(Exception):
+    """
+    Raised out of a render once Renderer.cancel() has been called, nothing is written to the sinks
+    """
+    pass
+
+
+class RenderProgress:
+    """
+    A snapshot of how far a render has got, handed to RenderObservers
+    """
+
+    def __init__(self, pixels_done: int, total_pixels: int, rays: int, elapsed: float, cancelled: bool = False):
+        self.pixels_done: int = pixels_done
+        self.total_pixels: int = total_pixels
+        self.rays: int = rays
+        self.elapsed: float = elapsed
+        self.cancelled: bool = cancelled
+
+    @property
+    def fraction(self) -> float:
+        return self.pixels_done / self.total_pixels if self.total_pixels > 0 else 1.0
+
+    @property
+    def rays_per_sec(self) -> float:
+        return self.rays / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float:
+        """
+        - returned is the estimated seconds left, assuming the remaining pixels go as fast as the finished ones,
+          None until a pixel has finished
+        """
+        if self.pixels_done == 0:
+            return None
+
+        return self.elapsed * (self.total_pixels - self.pixels_done) / self.pixels_done
+
+
+class RenderObserver:
+    """
+    Told about a render's progress. Notifications come from the thread that called render, once per finished
+    tile or batch, so they're never concurrent. Call Renderer.cancel() from here (or any other thread) to stop
+    the render.
+    """
+
+    def on_start(self, progress: RenderProgress) -> None:
+        pass
+
+    def on_progress(self, progress: RenderProgress) -> None:
+        pass
+
+    def on_finish(self, progress: RenderProgress) -> None:
+        """
+        Called whether the render completed or was cancelled, see progress.cancelled
+        """
+        pass
+
+    def on_write(self, sink: OutputSink) -> None:
+        """
+        Called once the finished frame has been written to sink, before on_finish
+        """
+        pass
+
+
+class PrintProgress(RenderObserver):
+    """
+    Prints the progress each time another step of the image is done, the files written and how long the render took
+    """
+
+    def __init__(self, step: float = 0.1):
+        self.step = step
+        self.next_fraction = step
+
+    def on_start(self, progress: RenderProgress) -> None:
+        self.next_fraction = self.step
+
+    def on_progress(self, progress: RenderProgress) -> None:
+        if progress.fraction < self.next_fraction and progress.fraction < 1.0:
+            return
+
+        while self.next_fraction <= progress.fraction:
+            self.next_fraction += self.step
+
+        eta = "" if progress.eta is None else f', {progress.eta:.1f}s left'
+        print(f'{100.0 * progress.fraction:.1f}% complete, {progress.rays_per_sec:.0f} rays/s{eta}')
+
+    def on_write(self, sink: OutputSink) -> None:
+        if isinstance(sink, FileSink):
+            print(sink.path)
+
+    def on_finish(self, progress: RenderProgress) -> None:
+        if progress.cancelled:
+            print(f'cancelled at {100.0 * progress.fraction:.1f}%')
+        else:
+            minutes, seconds = divmod(progress.elapsed, 60)
+            print(f'Rendering took {minutes:.0f}m and {seconds:.2f}s')
@@ -1,15 +1,33 @@
-import numpy as np
 import math_helper
 
 
 class Ray:
+    """
+    A single ray. On the per-ray path origin and direction are (x, y, z) tuples of floats, which are much
+    quicker to do arithmetic on one at a time than 3 element numpy arrays. Arrays work too.
+    """
 
-    def __init__(self, origin: np.array, direction: np.array):
-        self.origin: np.array = origin
-        self.direction: np.array = direction
+    __slots__ = ("origin", "direction", "_inverse_direction")
+
+    def __init__(self, origin, direction):
+        self.origin = origin
+        self.direction = direction
+        self._inverse_direction: tuple = None
 
     def normalize(self):
         self.direction = math_helper.get_normalized(self.direction)
+        self._inverse_direction = None
+
+    def inverse_direction(self) -> tuple:
+        """
+        - returned is the cached math_helper.inverse_direction of the direction, shared by every BVH the ray visits
+        """
+        if self._inverse_direction is None:
+            self._inverse_direction = math_helper.inverse_direction(self.direction)
+
+        return self._inverse_direction
 
-    def at(self, t: float):
-        return self.origin + (self.direction * t)
\ No newline at end of file
+    def at(self, t: float) -> tuple:
+        origin = self.origin
+        direction = self.direction
+        return (float(origin[0] + direction[0] * t), float(origin[1] + direction[1] * t), float(origin[2] + direction[2] * t))
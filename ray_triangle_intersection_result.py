@@ -2,6 +2,8 @@
 
 class RayTriangleIntersectionResult:
 
+    __slots__ = ("hit", "t", "theta", "beta", "alpha")
+
     def __init__(self, hit: bool, t: float, theta: float, beta: float):
         self.hit = hit
         self.t = t
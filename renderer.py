@@ -1,172 +1,949 @@
+import collections
 import concurrent.futures
 import datetime
-import logging
+import os
 import threading
+import time
+from multiprocessing import shared_memory
 
-from light import PointLight
+from frames import FrameWriter
+from gbuffer import GBuffer
+from hit_record import HitRecordBatch
+from light import LightSet, PointLight
 from material import Material
 from mesh import Mesh
 from ray import Ray
-from ray_triangle_intersection_result import RayTriangleIntersectionResult
 from scene import Scene
-from screen import Screen
-from camera import PerspectiveCamera, OrthoCamera
+import stats
+from stats import RenderStats
+from output import OutputSink
+from progress import RenderCancelled, RenderObserver, RenderProgress
 
 import numpy as np
+import kernels
 import math_helper
 
 EPSILON = 0.00001
+SKY_COLOR = np.array([99 / 255.0, 215 / 255.0, 228 / 255.0])
+SKY_COLOR_TUPLE = tuple(SKY_COLOR.tolist())
+MAX_RECURSION_DEPTH = 3
+# tiles handed to the thread or process pool ahead of the ones being rendered, per worker
+MAX_PENDING_TILES_PER_WORKER = 4
+
+# what render accepts for shading, mode and backend. Blinn-Phong with normals interpolated by the hit's
+# barycentric coordinates (face normals for hard edged meshes) is the only shading there is
+SHADING_MODELS = ("barycentric",)
+RENDER_MODES = ("recursive", "wavefront")
+RENDER_BACKENDS = ("thread", "process", "distributed")
+
 
 class Renderer:
 
-    def __init__(self, screen: Screen, camera, meshes: list[Mesh], light_):
-        self.screen = screen
+    def __init__(self, width: int, height: int, camera=None, meshes: list[Mesh] = None, light_=None,
+                 sinks: list[OutputSink] = None, observers: list[RenderObserver] = None):
+        # Renderer(screen, camera, meshes, light_) as before there were sinks, the screen gives the image size and
+        # is written to like any other sink
+        if isinstance(width, OutputSink):
+            screen = width
+            width, height, camera, meshes, light_ = screen.width, screen.height, height, camera, meshes
+            sinks = [screen] + (sinks if sinks is not None else [])
+
+        self.width: int = width
+        self.height: int = height
+        self.sinks: list[OutputSink] = sinks if sinks is not None else []
         self.camera = camera
         self.meshes = meshes
         self.scene = Scene(meshes)
 
-        self.light = light_
+        # light_ is a PointLight, a list of them, or a LightSet to cull and sample many lights with
+        if isinstance(light_, LightSet):
+            self.lights: LightSet = light_
+        else:
+            self.lights: LightSet = LightSet([light_] if isinstance(light_, PointLight) else light_)
 
         self.image_buffer: np.array = np.zeros(1)
 
-        self.increment_pixel_lock = threading.Lock()
-        self.pixels_completed: float = 0.0
+        # only ever touched by the thread driving the render, which counts whole tiles and batches
+        self.pixels_completed: int = 0
+        self.observers: list[RenderObserver] = observers if observers is not None else []
+        self.progress_start_time: float = 0.0
+        self.cancel_requested = threading.Event()
 
-    def set_image_buffer(self, x, y, color):
-        self.image_buffer[x, y] = color
+        # rays cast by type during the last render, see RenderStats for turning on detailed counters and timers
+        self.stats = RenderStats()
 
-    def increment_pixels_finished(self):
-        with self.increment_pixel_lock:
-            self.pixels_completed += 1.0
-            if self.pixels_completed % 500 == 0:
-                total_pixels = self.screen.width * self.screen.height
-                print(str(100.0 * (self.pixels_completed / total_pixels)) + "% complete")
-
-    def render(self, shading, bg_color: list, ambient_light) -> None:
-
-        render_start_time = datetime.datetime.now()
+        # primary hits kept by render_relight
+        self.gbuffer: GBuffer = None
 
-        image_buffer_l: np.array = np.full((self.screen.width, self.screen.height, 3), bg_color)
-        # self.image_buffer: np.array = np.full((self.screen.width, self.screen.height, 3), bg_color)
+    def __getstate__(self):
+        # what gets shipped to worker processes, sinks (like the preview window), observers, the G-buffer and the
+        # event stay behind
+        state = self.__dict__.copy()
+        state["sinks"] = []
+        state["observers"] = []
+        state["gbuffer"] = None
+        del state["cancel_requested"]
+        return state
 
-        args_list = list()
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.cancel_requested = threading.Event()
 
-        for x in range(0, self.screen.width):
-            for y in range(0, self.screen.height):
-                args_list.append((x, y, ambient_light, self))
-
-        executor = concurrent.futures.ThreadPoolExecutor(max_workers=20)
-        results = executor.map(thread_function, args_list)
-
-        for value in results:
-            # print(value)
-            x = value[0]
-            y = value[1]
-            color = value[2]
-
-            if color is not None:
-                if color.shape != (3,):
-                    print("shape not (3,) " + str(color))
-
-                image_buffer_l[x, y] = color
-
-        print("drawing buffer")
-        self.screen.draw(image_buffer_l)
+    def set_image_buffer(self, x, y, color):
+        self.image_buffer[x, y] = color
 
-        self.screen.do_capture()
+    def cancel(self) -> None:
+        """
+        Stops the render in progress at its next tile or batch, render then raises RenderCancelled.
+        Safe to call from any thread
+        """
+        self.cancel_requested.set()
+
+    def progress(self, cancelled: bool = False) -> RenderProgress:
+        return RenderProgress(self.pixels_completed, self.width * self.height, self.stats.rays_cast(),
+                              time.perf_counter() - self.progress_start_time, cancelled)
+
+    def start_progress(self) -> None:
+        self.cancel_requested.clear()
+        self.pixels_completed = 0
+        self.progress_start_time = time.perf_counter()
+
+        progress = self.progress()
+        for observer in self.observers:
+            observer.on_start(progress)
+
+    def finish_progress(self, cancelled: bool) -> None:
+        progress = self.progress(cancelled)
+        for observer in self.observers:
+            observer.on_finish(progress)
+
+    def increment_pixels_finished(self, count: int) -> None:
+        """
+        Called by the thread driving the render once per finished tile or batch, never per pixel.
+        Raises RenderCancelled if cancel() was called
+        """
+        self.pixels_completed += count
+
+        if self.observers:
+            progress = self.progress()
+            for observer in self.observers:
+                observer.on_progress(progress)
+
+        if self.cancel_requested.is_set():
+            raise RenderCancelled()
+
+    def render(self, shading, bg_color: list, ambient_light, mode: str = "recursive", tile_size: int = 64,
+               backend: str = "thread", workers: int = None, framebuffer_path: str = None, coordinator=None) -> np.array:
+        """
+        - shading is one of SHADING_MODELS
+        - mode "recursive" traces each pixel on its own with ray_color, tiles are handed out to worker threads,
+          "wavefront" traces tile_size x tile_size tiles a stage at a time with ray_color_batch
+        - backend "thread" renders in this process, "process" hands tiles to a pool of workers (os.cpu_count()
+          by default) that write straight into a shared memory framebuffer, "distributed" hands them to the
+          workers connected to coordinator, a distributed.Coordinator
+        - framebuffer_path, if given, is a .npy file the image is memory mapped to. Tiles are written to it as they
+          finish (np.load(framebuffer_path, mmap_mode="r") sees them while the render runs), so the image doesn't
+          have to fit in memory
+        - observers are told about the progress after each tile, raises RenderCancelled if cancel() is called
+        - returned is the image in [0, 255], the memory mapped file if framebuffer_path is given
+        """
+        # checked before anything is started, so a bad argument leaves no observer or stats half way through a frame
+        if shading not in SHADING_MODELS:
+            raise Exception(f'Unknown shading {shading}, use one of {", ".join(SHADING_MODELS)}')
+        if mode not in RENDER_MODES:
+            raise Exception(f'Unknown render mode {mode}, use one of {", ".join(RENDER_MODES)}')
+        if backend not in RENDER_BACKENDS:
+            raise Exception(f'Unknown render backend {backend}, use one of {", ".join(RENDER_BACKENDS)}')
+        if backend == "distributed" and coordinator is None:
+            raise Exception('The "distributed" backend needs a coordinator')
+
+        # picks up any transform changes made since the scene was built
+        self.scene.update()
+        self.lights.update()
+
+        image_buffer_l: np.array = self.new_image_buffer(bg_color, framebuffer_path)
+
+        self.stats.begin_frame(self.width, self.height)
+        self.start_progress()
+        cancelled = False
+
+        try:
+            with self.stats.timer("render"):
+                if backend == "process":
+                    self.render_processes(image_buffer_l, ambient_light, mode, tile_size, workers or os.cpu_count())
+                elif backend == "distributed":
+                    self.render_distributed(image_buffer_l, ambient_light, mode, tile_size, coordinator)
+                elif mode == "recursive":
+                    self.render_recursive(image_buffer_l, ambient_light, tile_size, workers or 20)
+                else:
+                    self.render_wavefront(image_buffer_l, ambient_light, tile_size)
+
+            self.finish_frame(image_buffer_l)
+        except RenderCancelled:
+            cancelled = True
+            raise
+        finally:
+            self.stats.end_frame()
+            self.finish_progress(cancelled)
+            if isinstance(image_buffer_l, np.memmap):
+                image_buffer_l.flush()
+
+        return image_buffer_l
+
+    def new_image_buffer(self, bg_color: list, framebuffer_path: str = None) -> np.array:
+        """
+        - returned is a (width, height, 3) image filled with bg_color, memory mapped to framebuffer_path if given
+        """
+        if framebuffer_path is None:
+            return np.full((self.width, self.height, 3), bg_color)
+
+        # same dtype np.full picks, so a mapped render comes out identical to one in memory
+        image_buffer_l = np.lib.format.open_memmap(framebuffer_path, mode="w+", dtype=np.asarray(bg_color).dtype,
+                                                   shape=(self.width, self.height, 3))
+        # filled a column at a time, the file can be bigger than memory
+        for x in range(self.width):
+            image_buffer_l[x] = bg_color
+
+        return image_buffer_l
+
+    def render_frames(self, frames, bg_color: list, ambient_light, path_pattern: str = "frame_{index:04d}.png",
+                      shading: str = "barycentric", mode: str = "recursive", **render_args) -> list[str]:
+        """
+        Renders a sequence of Frames (camera and object transforms) with the same scene, camera, light and sinks.
+        Meshes keep their BVHs between frames, only the ones whose transform changed are rebuilt.
+        Each frame is also written to path_pattern formatted with the frame's {index} and {name}, on a background
+        thread while the next frame renders.
+        - shading and mode are as in render, render_args are passed on to it too, e.g. backend and workers
+        - returned is the paths written, in frame order
+        """
+        writer = FrameWriter(path_pattern)
+        self.sinks.append(writer)
+
+        try:
+            for index, frame in enumerate(frames):
+                frame.apply(self.camera, self.meshes)
+                writer.next_frame(index, frame.name)
+                self.render(shading, bg_color, ambient_light, mode=mode, **render_args)
+        finally:
+            self.sinks.remove(writer)
+            writer.close()
+
+        return writer.paths
+
+    def finish_frame(self, image_buffer_l: np.array) -> None:
+        """
+        Writes the frame to the sinks, observers are told about each write. Prints nothing itself unless the
+        stats are detailed, the render time is left to observers like PrintProgress
+        """
+        with self.stats.timer("write"):
+            for sink in self.sinks:
+                sink.write(image_buffer_l)
+
+                if self.stats.cost_image is not None:
+                    sink.write_cost_image(self.stats.cost_image)
+
+                for observer in self.observers:
+                    observer.on_write(sink)
+
+        if self.stats.detailed:
+            print(self.stats.report())
+
+    def render_progressive(self, bg_color: list, ambient_light, time_budget: float = None, target_error: float = 0.01,
+                           max_samples: int = 16, tile_size: int = 64, batch_size: int = 4096, seed: int = 0) -> np.array:
+        """
+        Renders one sample through every pixel center, then keeps adding jittered samples to the pixels with the
+        highest estimated error until none is above target_error, every pixel has max_samples, or time_budget
+        seconds have passed. Whatever has been rendered by then is written to the sinks.
+        Progress is counted over the first pass, the refinement batches after it still report rays/sec and can be
+        cancelled.
+        - a pixel's error is the standard error of its mean color once it has two samples, before that the
+          largest color difference to its neighbours
+        - colors are in [0, 1] when compared against target_error
+        - returned is the image in [0, 255]
+        """
+        render_start_time = datetime.datetime.now()
+        deadline = None if time_budget is None else render_start_time + datetime.timedelta(seconds=time_budget)
+        self.stats.begin_frame(self.width, self.height)
+        self.start_progress()
+
+        def out_of_time() -> bool:
+            return deadline is not None and datetime.datetime.now() >= deadline
+
+        try:
+            image_buffer_l = self.render_progressive_samples(bg_color, ambient_light, out_of_time, target_error,
+                                                             max_samples, tile_size, batch_size, seed)
+            self.finish_frame(image_buffer_l)
+        except RenderCancelled:
+            self.finish_progress(True)
+            raise
+        finally:
+            self.stats.end_frame()
+
+        self.finish_progress(False)
+
+        return image_buffer_l
+
+    def render_progressive_samples(self, bg_color: list, ambient_light, out_of_time, target_error: float,
+                                   max_samples: int, tile_size: int, batch_size: int, seed: int) -> np.array:
+        """
+        The sampling passes of render_progressive
+        - returned is the image in [0, 255]
+        """
+        self.scene.update()
+        self.lights.update()
+        rng = np.random.default_rng(seed)
+
+        color_sum = np.zeros((self.width, self.height, 3))
+        color_sq_sum = np.zeros((self.width, self.height, 3))
+        sample_count = np.zeros((self.width, self.height))
+
+        # cheap first pass, one sample per pixel at its center
+        for x0, y0, x1, y1 in self.tiles(tile_size):
+            if out_of_time():
+                break
+
+            tile = np.clip(self.render_tile_wavefront(x0, y0, x1, y1, ambient_light, self._cost_tile(x0, y0, x1, y1)) / 255, 0, 1)
+            color_sum[x0:x1, y0:y1] = tile
+            color_sq_sum[x0:x1, y0:y1] = tile ** 2
+            sample_count[x0:x1, y0:y1] = 1
+            self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+
+        while not out_of_time():
+            error = _pixel_error(color_sum, color_sq_sum, sample_count)
+            error[sample_count >= max_samples] = 0
+
+            needs_samples = np.nonzero(error.ravel() > target_error)[0]
+            if len(needs_samples) == 0:
+                break
+
+            # worst pixels first, so running out of time mid-pass still spends it where it matters most
+            needs_samples = needs_samples[np.argsort(-error.ravel()[needs_samples], kind="stable")]
+
+            for start in range(0, len(needs_samples), batch_size):
+                if out_of_time():
+                    break
+
+                xs, ys = np.unravel_index(needs_samples[start:start + batch_size], (self.width, self.height))
+                offsets = rng.random((len(xs), 2))
+
+                origins, directions = self.primary_rays_at(xs, ys, offsets)
+                ray_cost = None if self.stats.cost_image is None else np.zeros(len(xs))
+                colors = np.clip(self.ray_color_batch(origins, directions, ambient_light, MAX_RECURSION_DEPTH, ray_cost), 0, 1)
+
+                if ray_cost is not None:
+                    self.stats.cost_image[xs, ys] += ray_cost
+
+                color_sum[xs, ys] += colors
+                color_sq_sum[xs, ys] += colors ** 2
+                sample_count[xs, ys] += 1
+                self.increment_pixels_finished(0)
+
+        # printed with the rest of the stats when they're detailed
+        self.stats.add("progressive_samples", int(sample_count.sum()))
+        self.stats.add("progressive_samples_busiest_pixel", int(sample_count.max()))
+
+        image_buffer_l: np.array = np.full((self.width, self.height, 3), bg_color, dtype=np.float64)
+        rendered = sample_count > 0
+        image_buffer_l[rendered] = color_sum[rendered] / sample_count[rendered][:, None] * 255
+
+        return image_buffer_l
+
+    def render_relight(self, bg_color: list, ambient_light, tile_size: int = 64) -> np.array:
+        """
+        Wavefront render that keeps the primary hits in a G-buffer. Rendering again after only the light or the
+        materials changed reuses them, so just the shading, shadow rays and reflections are redone.
+        The G-buffer is retraced when the camera or a mesh moves, call invalidate_gbuffer after any other
+        change to what the eye rays see (camera parameters, the scene's meshes, the image size).
+        - returned is the image in [0, 255]
+        """
+        self.stats.begin_frame(self.width, self.height)
+        self.start_progress()
+        cancelled = False
+
+        self.scene.update()
+        self.lights.update()
+
+        image_buffer_l: np.array = np.full((self.width, self.height, 3), bg_color)
+
+        try:
+            with self.stats.timer("render"):
+                if self.gbuffer is None or self.gbuffer.key != self.gbuffer_key():
+                    self.gbuffer = GBuffer(self.width, self.height, self.gbuffer_key())
+                    trace_primary = True
+                else:
+                    trace_primary = False
+
+                for x0, y0, x1, y1 in self.tiles(tile_size):
+                    if trace_primary:
+                        with self.stats.timer("primary_rays"):
+                            origins, directions = self.primary_rays(x0, y0, x1, y1)
+
+                        self.stats.add("primary_rays", len(origins))
+                        with self.stats.timer("intersect"):
+                            record = self.scene.hit_batch(origins, directions, 0, 100)
+
+                        self.gbuffer.store(x0, y0, x1, y1, origins, directions, record)
+                    else:
+                        origins, directions, record = self.gbuffer.tile(x0, y0, x1, y1)
+
+                    cost_tile = self._cost_tile(x0, y0, x1, y1)
+                    ray_cost = None if cost_tile is None else np.zeros(len(origins))
+                    colors = self.ray_color_batch(origins, directions, ambient_light, MAX_RECURSION_DEPTH, ray_cost, record)
+
+                    if cost_tile is not None:
+                        cost_tile += ray_cost.reshape(x1 - x0, y1 - y0)
+
+                    image_buffer_l[x0:x1, y0:y1] = (np.clip(colors, 0, 1) * 255).reshape(x1 - x0, y1 - y0, 3)
+                    self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+
+            # printed with the rest of the stats when they're detailed
+            if trace_primary:
+                self.stats.add("gbuffer_traced")
+                self.stats.add("gbuffer_bytes", self.gbuffer.nbytes())
+            else:
+                self.stats.add("gbuffer_reused")
+            self.finish_frame(image_buffer_l)
+        except RenderCancelled:
+            cancelled = True
+            # a half traced G-buffer can't be reused
+            if trace_primary:
+                self.gbuffer = None
+            raise
+        finally:
+            self.stats.end_frame()
+            self.finish_progress(cancelled)
+
+        return image_buffer_l
+
+    def gbuffer_key(self) -> tuple:
+        """
+        - returned is what a G-buffer depends on that the renderer can see change: the image size and the
+          camera's and meshes' transforms
+        """
+        return ((self.width, self.height), id(self.camera), self.camera.transform.version,
+                tuple((id(mesh), mesh.transform.version) for mesh in self.scene.meshes))
+
+    def invalidate_gbuffer(self) -> None:
+        self.gbuffer = None
+
+    def render_recursive(self, image_buffer_l: np.array, ambient_light, tile_size: int, workers: int) -> None:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        results = bounded_map(executor, thread_function, ((tile, ambient_light, self) for tile in self.tiles(tile_size)),
+                              MAX_PENDING_TILES_PER_WORKER * workers)
+
+        try:
+            for (x0, y0, x1, y1), tile_colors in results:
+                image_buffer_l[x0:x1, y0:y1] = tile_colors
+                self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+        finally:
+            results.close()
+            # on a cancel the queued tiles are dropped rather than waited for
+            executor.shutdown(cancel_futures=True)
+
+    def render_wavefront(self, image_buffer_l: np.array, ambient_light, tile_size: int) -> None:
+        for x0, y0, x1, y1 in self.tiles(tile_size):
+            image_buffer_l[x0:x1, y0:y1] = self.render_tile_wavefront(x0, y0, x1, y1, ambient_light, self._cost_tile(x0, y0, x1, y1))
+            self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+
+    def render_processes(self, image_buffer_l: np.array, ambient_light, mode: str, tile_size: int, workers: int) -> None:
+        """
+        Renders the tiles on a pool of worker processes. Each worker is sent this renderer (scene, camera and light)
+        once when it starts and writes its tiles straight into a shared memory framebuffer, or into the file itself
+        when image_buffer_l is memory mapped.
+        """
+        mapped_path = image_buffer_l.filename if isinstance(image_buffer_l, np.memmap) else None
+        shm = None
+
+        if mapped_path is None:
+            shape = image_buffer_l.shape
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(np.float64).itemsize)
+
+        try:
+            if shm is not None:
+                framebuffer = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+                framebuffer[:] = image_buffer_l
+            else:
+                # the workers need to see the background already written
+                image_buffer_l.flush()
+
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_process_worker,
+                                                              initargs=(self, shm.name if shm is not None else None,
+                                                                        image_buffer_l.shape, mapped_path, ambient_light,
+                                                                        mode, kernels.get_backend().name))
+            results = bounded_map(executor, _render_tile_in_process, self.tiles(tile_size),
+                                  MAX_PENDING_TILES_PER_WORKER * workers)
+            try:
+                for tile, counts, cost_tile in results:
+                    x0, y0, x1, y1 = tile
+                    self.stats.merge(counts)
+                    if cost_tile is not None:
+                        self.stats.cost_image[x0:x1, y0:y1] = cost_tile
+                    self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+            finally:
+                results.close()
+                executor.shutdown(cancel_futures=True)
+
+            if shm is not None:
+                image_buffer_l[:] = framebuffer
+                del framebuffer
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    def render_distributed(self, image_buffer_l: np.array, ambient_light, mode: str, tile_size: int, coordinator) -> None:
+        """
+        Renders the tiles on the workers connected to coordinator (see distributed.py), filling in the image as
+        they come back
+        """
+        if coordinator is None:
+            raise Exception("The distributed backend needs a coordinator")
+
+        for tile, tile_colors, counts, cost_tile in coordinator.render_tiles(self, self.tiles(tile_size), ambient_light, mode):
+            x0, y0, x1, y1 = tile
+            image_buffer_l[x0:x1, y0:y1] = tile_colors
+            self.stats.merge(counts)
+            if cost_tile is not None:
+                self.stats.cost_image[x0:x1, y0:y1] = cost_tile
+            self.increment_pixels_finished((x1 - x0) * (y1 - y0))
+
+    def tiles(self, tile_size: int):
+        """
+        - yields (x0, y0, x1, y1) for each tile_size x tile_size block of the image, clipped at the edges
+        """
+        for x0 in range(0, self.width, tile_size):
+            for y0 in range(0, self.height, tile_size):
+                yield x0, y0, min(x0 + tile_size, self.width), min(y0 + tile_size, self.height)
+
+    def _cost_tile(self, x0: int, y0: int, x1: int, y1: int):
+        return None if self.stats.cost_image is None else self.stats.cost_image[x0:x1, y0:y1]
+
+    def render_tile(self, x0: int, y0: int, x1: int, y1: int, ambient_light, mode: str, cost_tile: np.array = None) -> np.array:
+        """
+        - cost_tile, if given, is an (x1 - x0, y1 - y0) array each pixel's triangle test count is added to
+        - returned is the (x1 - x0, y1 - y0, 3) block of pixel colors in [0, 255]
+        """
+        if mode == "wavefront":
+            return self.render_tile_wavefront(x0, y0, x1, y1, ambient_light, cost_tile)
+
+        counter = self.stats.counter()
+        tile = np.zeros((x1 - x0, y1 - y0, 3))
+        for x in range(x0, x1):
+            # the rest of the tile is thrown away after a cancel, no need to finish it
+            if self.cancel_requested.is_set():
+                break
+
+            for y in range(y0, y1):
+                triangle_tests = counter["triangle_tests"]
+                tile[x - x0, y - y0] = self.pixel_color(x, y, ambient_light)
+
+                if cost_tile is not None:
+                    cost_tile[x - x0, y - y0] += counter["triangle_tests"] - triangle_tests
+
+        return tile
+
+    def render_tile_wavefront(self, x0: int, y0: int, x1: int, y1: int, ambient_light, cost_tile: np.array = None) -> np.array:
+        """
+        - cost_tile, if given, is an (x1 - x0, y1 - y0) array each pixel's triangle test count is added to
+        - returned is the (x1 - x0, y1 - y0, 3) block of pixel colors in [0, 255]
+        """
+        with self.stats.timer("primary_rays"):
+            origins, directions = self.primary_rays(x0, y0, x1, y1)
+
+        ray_cost = None if cost_tile is None else np.zeros(len(origins))
+        colors = self.ray_color_batch(origins, directions, ambient_light, MAX_RECURSION_DEPTH, ray_cost)
+
+        if cost_tile is not None:
+            cost_tile += ray_cost.reshape(x1 - x0, y1 - y0)
+
+        return (np.clip(colors, 0, 1) * 255).reshape(x1 - x0, y1 - y0, 3)
+
+    def primary_rays(self, x0: int, y0: int, x1: int, y1: int) -> (np.array, np.array):
+        """
+        - returned is (origins, directions), the (N, 3) world space eye rays through the pixels in [x0, x1) x [y0, y1),
+          ordered by x then y
+        """
+        return self.camera.get_rays_in_rect(x0, y0, x1, y1, self.width, self.height, 1)
+
+    def primary_rays_at(self, xs: np.array, ys: np.array, offsets: np.array = None) -> (np.array, np.array):
+        """
+        - xs and ys are the (N,) pixel coordinates, offsets the optional (N, 2) positions within each pixel
+          in [0, 1), pixel centers when left out
+        - returned is (origins, directions), the (N, 3) world space eye rays
+        """
+        return self.camera.get_rays_at_pixels(xs, ys, self.width, self.height, 1, offsets)
+
+    def ray_color_batch(self, origins: np.array, directions: np.array, ambient_light: np.array, max_recursion_depth: int,
+                        ray_cost: np.array = None, primary_record: HitRecordBatch = None) -> np.array:
+        """
+        Breadth first version of ray_color, every bounce is one pass over all the rays still alive:
+        intersect, shade (with the shadow rays cast together), then emit the reflection rays for the next pass.
+        Reflected colors are folded back in from the deepest bounce up, so the clipping matches ray_color.
+        - ray_cost, if given, is an (N,) array the triangle tests spent on each ray and everything it spawned are added to
+        - primary_record, if given, is the already traced hits of the rays, see GBuffer
+        - returned is the (N, 3) array of colors, unclipped like ray_color's
+        """
+        # per bounce: (local color, lit, reflection coefficient, index of the reflection ray in the next bounce)
+        bounces = []
+
+        # which of the original rays each ray in the current bounce descends from
+        source_ray = np.arange(len(origins))
+
+        for recursion_depth in range(max_recursion_depth):
+            if len(origins) == 0:
+                break
+
+            triangle_tests = None if ray_cost is None else np.zeros(len(origins))
+
+            if recursion_depth == 0 and primary_record is not None:
+                record = primary_record
+            else:
+                self.stats.add("primary_rays" if recursion_depth == 0 else "reflection_rays", len(origins))
+
+                with self.stats.timer("intersect"):
+                    record = self.scene.hit_batch(origins, directions, 0, 100, triangle_tests)
+
+            with self.stats.timer("shade"):
+                local_color, lit, km = self.shade_batch(record, directions, ambient_light, triangle_tests)
+
+            if stats.active is not None:
+                stats.active.add(f'rays_at_depth_{recursion_depth}', len(origins))
+                stats.active.add("hits", int(np.count_nonzero(record.hit)))
+
+            if ray_cost is not None:
+                np.add.at(ray_cost, source_ray, triangle_tests)
+
+            reflects = lit & (km > 0)
+            reflection_index = np.full(len(origins), -1, dtype=np.int64)
+
+            if recursion_depth + 1 < max_recursion_depth:
+                reflecting = np.nonzero(reflects)[0]
+                reflection_index[reflecting] = np.arange(len(reflecting))
+                source_ray = source_ray[reflecting]
+
+                normal_w = record.normal_w[reflecting]
+                incoming = directions[reflecting]
+                origins = record.point_hit[reflecting]
+                directions = incoming - 2 * np.sum(incoming * normal_w, axis=1)[:, None] * normal_w
+            else:
+                origins = np.zeros((0, 3))
+                directions = np.zeros((0, 3))
+
+            bounces.append((local_color, lit, km, reflection_index))
+
+        reflected_color = np.zeros((0, 3))
+
+        for local_color, lit, km, reflection_index in reversed(bounces):
+            color = local_color.copy()
+
+            reflected = np.zeros_like(color)
+            has_reflection = reflection_index >= 0
+            reflected[has_reflection] = reflected_color[reflection_index[has_reflection]]
+
+            color[lit] = np.clip(color[lit] + km[lit, None] * reflected[lit], 0, 1)
+            reflected_color = color
+
+        return reflected_color
+
+    def shade_batch(self, record: HitRecordBatch, directions: np.array, ambient_light: np.array,
+                    triangle_tests: np.array = None) -> (np.array, np.array, np.array):
+        """
+        Blinn-Phong shading of a batch of eye hits, the vectorized counterpart of the body of ray_color.
+        - triangle_tests, if given, gets each ray's shadow ray triangle tests added to it
+        - returned is (color, lit, km): misses get the sky color, shadowed hits only the ambient term,
+          lit is True where the diffuse and specular terms were added and km is the hit material's
+          reflection coefficient
+        """
+        ray_count = len(directions)
+        color = np.tile(SKY_COLOR, (ray_count, 1))
+        lit = np.zeros(ray_count, dtype=bool)
+        km = np.zeros(ray_count)
+
+        hit_rays = np.nonzero(record.hit)[0]
+        if len(hit_rays) == 0:
+            return color, lit, km
+
+        materials: list[Material] = [mesh.material for mesh in self.scene.meshes]
+        mesh_index = record.mesh_index[hit_rays]
+
+        def material_values(name: str) -> np.array:
+            return np.array([getattr(material, name) for material in materials], dtype=np.float64)[mesh_index]
+
+        ka = material_values("ka")
+        kd = material_values("kd")
+        ks = material_values("ks")
+        p = material_values("p")
+        km[hit_rays] = material_values("km")
+        diffuse_color = np.array([material.diffuse_color for material in materials], dtype=np.float64).reshape(-1, 3)[mesh_index]
+        specular_color = np.array([material.specular_color for material in materials], dtype=np.float64).reshape(-1, 3)[mesh_index]
+
+        point_hit = record.point_hit[hit_rays]
+        normal_w = record.normal_w[hit_rays]
+        hit_directions = directions[hit_rays]
+
+        # a shadow ray for each (hit, light) pair, see LightSet.light_pairs for which lights a hit gets
+        lights: LightSet = self.lights
+        pair_hit, pair_light, pair_weight = lights.light_pairs(point_hit, normal_w)
+        light_position: np.array = lights.positions[pair_light]
+        point_to_light_vec: np.array = light_position - point_hit[pair_hit]
 
-        render_end_time = datetime.datetime.now()
+        # shadow rays run from the point to the light, so t = 1 is the light itself
+        self.stats.add("shadow_rays", len(pair_hit))
+        shadow_triangle_tests = None if triangle_tests is None else np.zeros(len(pair_hit))
+        pair_lit = ~self.scene.occluded_batch(point_hit[pair_hit], point_to_light_vec, EPSILON, 1.0, shadow_triangle_tests)
 
-        render_duration: datetime.timedelta = render_end_time - render_start_time
-        total_seconds = render_duration.total_seconds()
-        minutes, seconds = divmod(total_seconds, 60)
+        if triangle_tests is not None:
+            np.add.at(triangle_tests, hit_rays[pair_hit], shadow_triangle_tests)
 
-        print(f'Rendering took {minutes}m and {seconds}s')
+        if stats.active is not None:
+            stats.active.add("shadow_hits", int(np.count_nonzero(~pair_lit)))
+
+        # ambient everywhere, plus the diffuse and specular terms of each light that isn't shadowed,
+        # added up in light order like ray_color does
+        hit_color = ka[:, None] * np.asarray(ambient_light, dtype=np.float64)
+
+        shaded = np.nonzero(pair_lit)[0]
+        shaded_hit = pair_hit[shaded]
+        light_color = kernels.shade(point_hit[shaded_hit], normal_w[shaded_hit], hit_directions[shaded_hit],
+                                    np.ones(len(shaded), dtype=bool), light_position[shaded],
+                                    lights.radiance[pair_light[shaded]] * pair_weight[shaded, None], np.zeros(3),
+                                    np.zeros(len(shaded)), kd[shaded_hit], ks[shaded_hit], p[shaded_hit],
+                                    diffuse_color[shaded_hit], specular_color[shaded_hit])
+        np.add.at(hit_color, shaded_hit, light_color)
+
+        color[hit_rays] = hit_color
+        lit[hit_rays] = np.bincount(shaded_hit, minlength=len(hit_rays)) > 0
+
+        return color, lit, km
 
 
     def ray_color(self, ray_w: Ray, ambient_light: np.array, recursion_depth: int, max_recursion_depth: int) -> np.array:
-
+        return np.array(self.ray_color_scalar(ray_w, ambient_light, recursion_depth, max_recursion_depth))
+
+    def ray_color_scalar(self, ray_w: Ray, ambient_light, recursion_depth: int, max_recursion_depth: int) -> tuple:
+        """
+        Traces one ray the way ray_color does, with every vector kept as an (x, y, z) tuple of floats so no
+        small numpy arrays are made per ray. The ray's origin and direction must be tuples too.
+        - returned is the (r, g, b) color
+        """
         if recursion_depth == max_recursion_depth:
-            return np.array([0, 0, 0])
+            return 0.0, 0.0, 0.0
 
-        light: PointLight = self.light
+        lights: LightSet = self.lights
         scene: Scene = self.scene
 
+        self.stats.add("primary_rays" if recursion_depth == 0 else "reflection_rays")
+
         scene_hit_from_eye, eye_record = scene.hit(ray_w, 0, 100)
 
+        if stats.active is not None:
+            stats.active.add(f'rays_at_depth_{recursion_depth}')
+            stats.active.add("hits", int(scene_hit_from_eye))
+
         if not scene_hit_from_eye:
-            #if recursion_depth == 0:
-            return np.array([99 / 255.0, 215 / 255.0, 228 / 255.0])
-            #else:
-            #    return np.array([0, 0, 0])
+            return SKY_COLOR_TUPLE
 
-        normal_w: np.array = eye_record.normal_w
+        normal_w = eye_record.normal_w
 
         material: Material = eye_record.material
-        point_hit: np.array = eye_record.point_hit
+        point_hit = eye_record.point_hit
 
         # add ambient color
-        color = eye_record.material.ka * np.array(ambient_light)
+        ka = material.ka
+        color_r = ka * ambient_light[0]
+        color_g = ka * ambient_light[1]
+        color_b = ka * ambient_light[2]
+
+        diffuse_coefficient = material.kd
+        diffuse_color = material.diffuse_color.tolist()
 
-        # check if hit by light, if so add diffuse and specular color
-        light_position: np.array = light.transform.apply_to_point(np.array([0, 0, 0]))
-        point_to_light_vec: np.array = light_position - point_hit
-        point_to_light_vec_normalized: np.array = math_helper.get_normalized(point_to_light_vec)
-        distance_from_point_to_light: float = math_helper.magnitude(point_to_light_vec)
+        specular_coefficient = material.ks
+        specular_color = material.specular_color.tolist()
 
-        # print(f'point_hit {str(point_hit)}, light position {str(light_position)}, point_to_light_vec {str(point_to_light_vec)}')
+        direction = ray_w.direction
+        normalized_neg_direction = math_helper.get_normalized3((-direction[0], -direction[1], -direction[2]))
 
-        shadow_ray: Ray = Ray(point_hit, point_to_light_vec)
-        scene_hit_before_light, shadow_record = scene.hit(shadow_ray, EPSILON, 1000)
+        color = [color_r, color_g, color_b]
+        lit: bool = False
 
-        # return just ambient light if we're in shadow
-        if scene_hit_before_light:
-            return color
+        # check which lights hit the point, add diffuse and specular color for each
+        for light_index, weight in lights.lights_at(point_hit, normal_w):
+            light_position = lights.position_list[light_index]
+            point_to_light_vec = (light_position[0] - point_hit[0], light_position[1] - point_hit[1], light_position[2] - point_hit[2])
 
-        # print(f'face_normal: {eye_record.face_normal}, point_to_light_vec: {point_to_light_vec}, fn dot ptlv: {math_helper.dot(eye_record.face_normal, point_to_light_vec)}')
-        # print(f'point_hit: {point_hit} face_normal: {eye_record.face_normal}, point_to_light_vec: {point_to_light_vec} normalized_neg_dir: {normalized_neg_direction} h: {h}, fn dot h: {math_helper.dot(eye_record.face_normal, h)}')
+            # the shadow ray runs from the point to the light, so t = 1 is the light itself
+            shadow_ray: Ray = Ray(point_hit, point_to_light_vec)
+            self.stats.add("shadow_rays")
+            scene_hit_before_light: bool = scene.occluded(shadow_ray, EPSILON, 1.0)
 
-        d_sq = pow(distance_from_point_to_light, 2)
-        cos_t = max(0, math_helper.dot(point_to_light_vec_normalized, normal_w))
+            if stats.active is not None:
+                stats.active.add("shadow_hits", int(scene_hit_before_light))
 
-        e = light.intensity * light.color * (1 / d_sq) * cos_t
+            if scene_hit_before_light:
+                continue
+            lit = True
 
-        diffuse_coefficient = material.kd
-        diffuse_ray_color = diffuse_coefficient * material.diffuse_color / np.pi
+            point_to_light_vec_normalized = math_helper.get_normalized3(point_to_light_vec)
+            distance_from_point_to_light: float = math_helper.magnitude3(point_to_light_vec)
 
-        specular_coefficient = material.ks
-        normalized_neg_direction: np.array = math_helper.get_normalized(-ray_w.direction)
-        h: np.array = math_helper.get_normalized(point_to_light_vec_normalized + normalized_neg_direction)
-        spec_calc = pow(max(0, math_helper.dot(h, normal_w)), material.p)
+            d_sq = pow(distance_from_point_to_light, 2)
+            cos_t = max(0, math_helper.dot3(point_to_light_vec_normalized, normal_w))
+
+            radiance = lights.radiance_list[light_index]
+            if weight != 1.0:
+                radiance = [channel * weight for channel in radiance]
+            inv_d_sq = 1 / d_sq
+
+            h = math_helper.get_normalized3((point_to_light_vec_normalized[0] + normalized_neg_direction[0],
+                                             point_to_light_vec_normalized[1] + normalized_neg_direction[1],
+                                             point_to_light_vec_normalized[2] + normalized_neg_direction[2]))
+            spec_calc = pow(max(0, math_helper.dot3(h, normal_w)), material.p)
 
-        specular_ray_color = specular_coefficient * material.specular_color * spec_calc
+            for i in range(3):
+                e = radiance[i] * inv_d_sq * cos_t
+                diffuse_ray_color = diffuse_coefficient * diffuse_color[i] / np.pi
+                specular_ray_color = specular_coefficient * specular_color[i] * spec_calc
+                color[i] += e * (specular_ray_color + diffuse_ray_color)
 
-        color += e * (specular_ray_color + diffuse_ray_color)
+        # return just ambient light if we're in shadow of every light
+        if not lit:
+            return color_r, color_g, color_b
 
         reflection_coefficient = material.km
         if reflection_coefficient > 0:
-            reflection_direction: np.array = ray_w.direction - 2 * math_helper.dot(ray_w.direction, normal_w) * normal_w
+            d_dot_n2 = 2 * math_helper.dot3(direction, normal_w)
+            reflection_direction = (direction[0] - d_dot_n2 * normal_w[0], direction[1] - d_dot_n2 * normal_w[1],
+                                    direction[2] - d_dot_n2 * normal_w[2])
             reflection_ray: Ray = Ray(point_hit, reflection_direction)
-            color += reflection_coefficient * self.ray_color(reflection_ray, ambient_light, recursion_depth + 1, max_recursion_depth)
+            reflected = self.ray_color_scalar(reflection_ray, ambient_light, recursion_depth + 1, max_recursion_depth)
+            for i in range(3):
+                color[i] += reflection_coefficient * reflected[i]
 
-        return np.clip(color, 0, 1)
+        return min(max(color[0], 0.0), 1.0), min(max(color[1], 0.0), 1.0), min(max(color[2], 0.0), 1.0)
+
+    def pixel_color(self, x: int, y: int, ambient_light) -> np.array:
+        curr_ray: Ray = self.camera.get_cam_space_ray_at_pixel(x, y, self.width, self.height, 1)
+        world_space_ray: Ray = self.camera.inverse_project_ray(curr_ray)
+
+        # print(f'dir curr_ray {str(curr_ray.direction)}, world_space_ray {str(world_space_ray.direction)}')
+        # print(f'origin curr_ray {str(curr_ray.origin)}, world_space_ray {str(world_space_ray.origin)}')
+
+        # from here on the ray stays in plain floats, see ray_color_scalar
+        world_space_ray = Ray(tuple(world_space_ray.origin.tolist()), tuple(world_space_ray.direction.tolist()))
+        color = self.ray_color_scalar(world_space_ray, ambient_light, 0, MAX_RECURSION_DEPTH)
+
+        return np.clip(color, 0, 1) * 255
+
+
+def _pixel_error(color_sum: np.array, color_sq_sum: np.array, sample_count: np.array) -> np.array:
+    """
+    - returned is the (width, height) estimated error of each pixel's mean color, see Renderer.render_progressive
+    """
+    count = np.maximum(sample_count, 1)[:, :, None]
+    mean = color_sum / count
+    variance = np.maximum(color_sq_sum / count - mean ** 2, 0)
+    standard_error = np.sqrt(variance / count).max(axis=2)
+
+    # neighbour contrast stands in for the variance of pixels with a single sample
+    padded = np.pad(mean, ((1, 1), (1, 1), (0, 0)), mode="edge")
+    contrast = np.zeros(sample_count.shape)
+    for dx, dy in ((0, 1), (2, 1), (1, 0), (1, 2)):
+        neighbour = padded[dx:dx + mean.shape[0], dy:dy + mean.shape[1]]
+        contrast = np.maximum(contrast, np.abs(mean - neighbour).max(axis=2))
+
+    error = np.where(sample_count >= 2, standard_error, contrast)
+    error[sample_count == 0] = 0
+
+    return error
+
+
+def bounded_map(executor: concurrent.futures.Executor, function, items, max_pending: int):
+    """
+    Like executor.map, but items are only taken from the iterable as results are consumed, with at most
+    max_pending of them submitted at a time. executor.map submits everything up front, which for a big image means
+    a future per tile held for the whole render.
+    - yields the results in the order of items
+    """
+    pending = collections.deque()
+
+    try:
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 def thread_function(args: any) -> any:
+    """
+    - returned is (the tile, its (x1 - x0, y1 - y0, 3) colors)
+    """
+    tile, ambient_light, renderer = args
+    x0, y0, x1, y1 = tile
+
+    return tile, renderer.render_tile(x0, y0, x1, y1, ambient_light, "recursive", renderer._cost_tile(x0, y0, x1, y1))
+
+
+# set up once per worker process by _init_process_worker
+_process_worker_state: dict = {}
+
+
+def _init_process_worker(renderer: Renderer, shm_name: str, shape: tuple, mapped_path: str, ambient_light, mode: str,
+                         kernel_backend: str) -> None:
+    prepare_worker_renderer(renderer, kernel_backend)
+
+    if mapped_path is not None:
+        _process_worker_state["framebuffer"] = np.load(mapped_path, mmap_mode="r+")
+    else:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _process_worker_state["shm"] = shm
+        _process_worker_state["framebuffer"] = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _process_worker_state["renderer"] = renderer
+    _process_worker_state["ambient_light"] = ambient_light
+    _process_worker_state["mode"] = mode
+
+
+def _render_tile_in_process(tile: tuple) -> (tuple, dict, np.array):
+    """
+    - returned is (the tile, its stats counts, its triangle tests per pixel or None)
+    """
+    x0, y0, x1, y1 = tile
+    tile_colors, counts, cost_tile = render_tile_counted(_process_worker_state["renderer"], tile,
+                                                         _process_worker_state["ambient_light"], _process_worker_state["mode"])
+    _process_worker_state["framebuffer"][x0:x1, y0:y1] = tile_colors
+
+    return tile, counts, cost_tile
+
+
+def prepare_worker_renderer(renderer: Renderer, kernel_backend: str) -> None:
+    """
+    Sets up a renderer that was sent to a worker (another process or another host) to render tiles
+    """
+    # a spawned worker starts from the default backend
+    kernels.set_backend(kernel_backend)
 
-    x = args[0]
-    y = args[1]
-    ambient_light = args[2]
-    renderer = args[3]
+    # a forked worker shares the parent's counters until it gets its own
+    renderer.stats = RenderStats(renderer.stats.detailed, renderer.stats.keep_cost_image)
+    if renderer.stats.detailed:
+        stats.active = renderer.stats
 
-    curr_ray: Ray = renderer.camera.get_cam_space_ray_at_pixel(x, y, renderer.screen.width, renderer.screen.height, 1)
-    world_space_ray: Ray = renderer.camera.inverse_project_ray(curr_ray)
 
-    # print(f'dir curr_ray {str(curr_ray.direction)}, world_space_ray {str(world_space_ray.direction)}')
-    # print(f'origin curr_ray {str(curr_ray.origin)}, world_space_ray {str(world_space_ray.origin)}')
+def render_tile_counted(renderer: Renderer, tile: tuple, ambient_light, mode: str) -> (np.array, dict, np.array):
+    """
+    Renders a tile on a worker, whose stats have to be sent back to the renderer it came from
+    - returned is (the tile's (x1 - x0, y1 - y0, 3) colors, its stats counts, its triangle tests per pixel or None)
+    """
+    x0, y0, x1, y1 = tile
 
-    color: np.array = renderer.ray_color(world_space_ray, ambient_light, 0, 3)
+    cost_tile = np.zeros((x1 - x0, y1 - y0)) if renderer.stats.keep_cost_image else None
+    tile_colors = renderer.render_tile(x0, y0, x1, y1, ambient_light, mode, cost_tile)
 
-    renderer.increment_pixels_finished()
+    counts = dict(renderer.stats.totals())
+    renderer.stats.reset()
 
-    return x, y, np.clip(color, 0, 1) * 255
+    return tile_colors, counts, cost_tile
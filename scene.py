@@ -1,4 +1,7 @@
-from hit_record import HitRecord
+import numpy as np
+
+from bvh import BVH
+from hit_record import HitRecord, HitRecordBatch
 from mesh import Mesh
 from ray import Ray
 
@@ -8,18 +11,161 @@ class Scene:
     def __init__(self, meshes: list[Mesh]):
         self.meshes = meshes
 
+        self.bvh = None
+        # the meshes' transform versions the top level BVH was built for
+        self.bvh_versions: list = None
+        self.update()
+
+    def is_stale(self) -> bool:
+        return self.bvh is None or [mesh.transform.version for mesh in self.meshes] != self.bvh_versions
+
+    def update(self) -> bool:
+        """
+        Rebuilds the world space geometry and BVH of every mesh whose transform changed, and the top level BVH
+        if any of them did, whether here or by the mesh itself.
+        - returned is whether anything was rebuilt
+        """
+        changed: bool = False
+        for mesh in self.meshes:
+            changed = mesh.update_world_geometry() or changed
+
+        if changed or self.is_stale():
+            self.build_acceleration_structure()
+            changed = True
+
+        return changed
+
+    def build_acceleration_structure(self) -> None:
+        """
+        Builds the top level BVH over the meshes' world space AABBs
+        """
+        aabb_mins = np.array([mesh.aabb_smallest_point_world for mesh in self.meshes], dtype=np.float64).reshape(-1, 3)
+        aabb_maxs = np.array([mesh.aabb_greatest_point_world for mesh in self.meshes], dtype=np.float64).reshape(-1, 3)
+
+        self.bvh = BVH(aabb_mins, aabb_maxs, max_leaf_size=2)
+        self.bvh_versions = [mesh.transform.version for mesh in self.meshes]
+
     def hit(self, ray: Ray, t_min: float, t_max: float) -> (bool, HitRecord):
+        # meshes moved since the last update are picked up here, as Mesh.hit does for its own geometry
+        if self.is_stale():
+            self.update()
 
+        return self.bvh.closest_hit(ray, t_min, t_max, self._hit_meshes)
+
+    def _hit_meshes(self, ray: Ray, mesh_indices: list, t_min: float, t_max: float) -> (bool, float, HitRecord):
+        """
+        Top level BVH leaf test, finds the closest hit among the meshes in mesh_indices
+        """
         lowest_t: float = t_max + 1
         hit_an_object: bool = False
         closest_obj_hit_record = None
 
-        for mesh in self.meshes:
-            was_hit, hit_record = mesh.hit(ray, t_min, t_max)
+        for mesh_index in mesh_indices:
+            was_hit, hit_record = self.meshes[mesh_index].hit(ray, t_min, t_max)
 
             if was_hit and hit_record.intersection_result.t < lowest_t:
                 hit_an_object = True
                 closest_obj_hit_record = hit_record
                 lowest_t = hit_record.intersection_result.t
 
-        return hit_an_object, closest_obj_hit_record
+        return hit_an_object, lowest_t, closest_obj_hit_record
+
+    def occluded(self, ray: Ray, t_min: float, t_max: float) -> bool:
+        """
+        True if anything blocks the ray within [t_min, t_max], returns on the first hit found
+        """
+        if self.is_stale():
+            self.update()
+
+        return self.bvh.any_hit(ray, t_min, t_max, self._occluded_meshes)
+
+    def _occluded_meshes(self, ray: Ray, mesh_indices: list, t_min: float, t_max: float) -> bool:
+        for mesh_index in mesh_indices:
+            if self.meshes[mesh_index].occluded(ray, t_min, t_max):
+                return True
+
+        return False
+
+    def occluded_batch(self, origins: np.array, directions: np.array, t_min, t_max, triangle_tests: np.array = None) -> np.array:
+        """
+        Vectorized occluded for (M, 3) arrays of ray origins and directions
+        - triangle_tests, if given, is an (M,) array each ray's triangle test count is added to
+        - returned is the (M,) bool array of occluded rays
+        """
+        if self.is_stale():
+            self.update()
+
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+
+        def occluded_leaf_batch(ray_indices, mesh_indices, leaf_t_min, leaf_t_max):
+            occluded = np.zeros(len(ray_indices), dtype=bool)
+
+            for mesh_index in mesh_indices:
+                remaining = np.nonzero(~occluded)[0]
+                if len(remaining) == 0:
+                    break
+
+                remaining_rays = ray_indices[remaining]
+                mesh_triangle_tests = None if triangle_tests is None else np.zeros(len(remaining))
+                occluded[remaining] = self.meshes[mesh_index].occluded_batch(origins[remaining_rays], directions[remaining_rays],
+                                                                             leaf_t_min[remaining], leaf_t_max[remaining], mesh_triangle_tests)
+                if triangle_tests is not None:
+                    triangle_tests[remaining_rays] += mesh_triangle_tests
+
+            return occluded
+
+        return self.bvh.any_hit_batch(origins, directions, t_min, t_max, occluded_leaf_batch)
+
+    def hit_batch(self, origins: np.array, directions: np.array, t_min, t_max, triangle_tests: np.array = None) -> HitRecordBatch:
+        """
+        Vectorized hit for (M, 3) arrays of ray origins and directions
+        - triangle_tests, if given, is an (M,) array each ray's triangle test count is added to
+        """
+        if self.is_stale():
+            self.update()
+
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+
+        ray_count = len(origins)
+        mesh_index = np.full(ray_count, -1, dtype=np.int64)
+        face_index = np.full(ray_count, -1, dtype=np.int64)
+        theta = np.zeros(ray_count)
+        beta = np.zeros(ray_count)
+
+        def hit_leaf_batch(ray_indices, mesh_indices, leaf_t_min, leaf_t_max):
+            lowest_t = np.array(leaf_t_max)
+            hit_an_object = np.zeros(len(ray_indices), dtype=bool)
+
+            for leaf_mesh_index in mesh_indices:
+                mesh_triangle_tests = None if triangle_tests is None else np.zeros(len(ray_indices))
+                was_hit, t, mesh_face_index, mesh_theta, mesh_beta = self.meshes[leaf_mesh_index].hit_batch(
+                    origins[ray_indices], directions[ray_indices], leaf_t_min, lowest_t, mesh_triangle_tests)
+                if triangle_tests is not None:
+                    triangle_tests[ray_indices] += mesh_triangle_tests
+
+                hit_an_object |= was_hit
+                lowest_t[was_hit] = t[was_hit]
+
+                rays_hit = ray_indices[was_hit]
+                mesh_index[rays_hit] = leaf_mesh_index
+                face_index[rays_hit] = mesh_face_index[was_hit]
+                theta[rays_hit] = mesh_theta[was_hit]
+                beta[rays_hit] = mesh_beta[was_hit]
+
+            return hit_an_object, lowest_t
+
+        t = self.bvh.closest_hit_batch(origins, directions, t_min, t_max, hit_leaf_batch)
+
+        hit = mesh_index >= 0
+        t = np.where(hit, t, 0)
+        point_hit = np.where(hit[:, None], origins + directions * t[:, None], 0)
+        face_normal = np.zeros((ray_count, 3))
+        normal_w = np.zeros((ray_count, 3))
+
+        for hit_mesh_index in np.unique(mesh_index[hit]):
+            rays = np.nonzero(mesh_index == hit_mesh_index)[0]
+            face_normal[rays], normal_w[rays] = self.meshes[hit_mesh_index].world_normals_at(face_index[rays], theta[rays], beta[rays])
+
+        return HitRecordBatch(hit, t, point_hit, face_normal, normal_w, mesh_index, face_index)
@@ -0,0 +1,276 @@
+"""
+Compiled scene cache: the meshes of a scene after loading, welding, transforming and BVH building, saved to one
+file so later runs skip all of it.
+
+The file is a single uint8 .npy array so it can be opened with np.load(mmap_mode="r"). It starts with the
+header's length as a little endian uint64 and the JSON header, followed by the raw arrays, each starting at a
+multiple of ALIGNMENT bytes. The header holds the format version, the caller's key, and per mesh its description
+(source STL, weld tolerance, material and transform, see MeshSource), that file's sha256 and where each of its
+arrays is. Arrays come back as views into the mapped file, so only the pages that get used are read.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from bvh import BVH
+from material import Material
+from mesh import Mesh
+from transform import Transform
+
+SCENE_CACHE_FORMAT = 2
+ALIGNMENT = 64
+HEADER_LENGTH = np.dtype("<u8")
+
+
+def file_hash(path: str) -> str:
+    """
+    - returned is the sha256 of the file's contents as hex
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def describe_mesh(source_path: str, weld_tolerance: float, material, hard_edges: bool, transform: Transform) -> dict:
+    """
+    - returned is everything a cached mesh is built from besides its STL's contents, as JSON values
+    """
+    return {
+        "source_path": os.path.abspath(source_path),
+        "weld_tolerance": float(weld_tolerance),
+        "material": {"diffuse_color": np.asarray(material.diffuse_color, dtype=np.float64).tolist(),
+                     "specular_color": np.asarray(material.specular_color, dtype=np.float64).tolist(),
+                     "ka": float(material.ka), "kd": float(material.kd), "ks": float(material.ks),
+                     "ke": float(material.p), "km": float(material.km)},
+        "hard_edges": bool(hard_edges),
+        "matrix": np.asarray(transform.matrix, dtype=np.float64).tolist(),
+    }
+
+
+class MeshSource:
+    """
+    How to build one mesh of a cached scene: the Mesh.from_stl arguments, and a transform set up like a mesh's.
+    The scene cache compares these with what it was saved from, so any change to them rebuilds it.
+    """
+
+    def __init__(self, stl_path: str, diffuse_color: np.array, specular_color: np.array, ka: float, kd: float,
+                 ks: float, ke: float, km: float, hard_edges: bool, weld_tolerance: float = 0.0):
+        self.stl_path: str = stl_path
+        self.material_args: tuple = (diffuse_color, specular_color, ka, kd, ks, ke, km)
+        self.material = Material(ka, kd, diffuse_color, ks, specular_color, ke, km)
+        self.hard_edges: bool = hard_edges
+        self.weld_tolerance: float = weld_tolerance
+        self.transform = Transform()
+
+    def build(self) -> Mesh:
+        mesh = Mesh.from_stl(self.stl_path, *self.material_args, self.hard_edges, self.weld_tolerance)
+        _copy_transform(self.transform, mesh.transform)
+
+        return mesh
+
+    def description(self) -> dict:
+        return describe_mesh(self.stl_path, self.weld_tolerance, self.material, self.hard_edges, self.transform)
+
+
+def _copy_transform(source: Transform, target: Transform) -> None:
+    # copied as is rather than through set_matrix, which would round the rotation differently
+    target.matrix = np.array(source.matrix, dtype=np.float64)
+    target.rotation = np.array(source.rotation, dtype=np.float64)
+    target.scale = np.array(source.scale, dtype=np.float64)
+    target.changed()
+
+
+def _mesh_arrays(mesh: Mesh) -> dict:
+    arrays = {
+        "verts": mesh.verts,
+        "faces": mesh.faces,
+        "normals": mesh.normals,
+        "vertex_normals": mesh.vertex_normals,
+        "world_vertices": mesh.world_vertices,
+        "world_vertex_normals": mesh.world_vertex_normals,
+        "world_face_normals": mesh.world_face_normals,
+        "matrix": mesh.transform.matrix,
+        "rotation": mesh.transform.rotation,
+        "scale": mesh.transform.scale,
+    }
+    arrays.update({"bvh_" + name: values for name, values in mesh.bvh.arrays().items()})
+
+    return arrays
+
+
+def save_scene(path: str, meshes: list[Mesh], key: str = "") -> None:
+    """
+    Compiles the meshes (world geometry and BVH for their current transforms) into a scene cache file.
+    Every mesh has to come from Mesh.from_stl, the cache is checked against its source file.
+    - key is stored as is, load_scene only accepts the file with the same key
+    """
+    header = {"format": SCENE_CACHE_FORMAT, "key": key, "meshes": []}
+    all_arrays = []
+    offset = 0
+
+    for mesh in meshes:
+        if mesh.source_path is None:
+            raise Exception("Only meshes loaded with Mesh.from_stl can be cached")
+
+        mesh.update_world_geometry()
+
+        mesh_header = {
+            "description": describe_mesh(mesh.source_path, mesh.weld_tolerance, mesh.material, mesh.hard_edges,
+                                         mesh.transform),
+            "source_hash": file_hash(mesh.source_path),
+            "bvh": {"max_leaf_size": mesh.bvh.max_leaf_size, "bin_count": mesh.bvh.bin_count},
+            "arrays": {},
+        }
+
+        for name, values in _mesh_arrays(mesh).items():
+            values = np.ascontiguousarray(values)
+            mesh_header["arrays"][name] = {"offset": offset, "dtype": values.dtype.str, "shape": list(values.shape)}
+            all_arrays.append((offset, values))
+            offset += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+
+        header["meshes"].append(mesh_header)
+
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_start = -(-(HEADER_LENGTH.itemsize + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    # written through a memmap so the whole file never has to be in memory at once
+    blob = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(data_start + offset,))
+    blob[:HEADER_LENGTH.itemsize] = np.frombuffer(np.array(len(header_bytes), dtype=HEADER_LENGTH).tobytes(), dtype=np.uint8)
+    blob[HEADER_LENGTH.itemsize:HEADER_LENGTH.itemsize + len(header_bytes)] = np.frombuffer(header_bytes, dtype=np.uint8)
+
+    for array_offset, values in all_arrays:
+        start = data_start + array_offset
+        blob[start:start + values.nbytes] = values.reshape(-1).view(np.uint8)
+
+    blob.flush()
+    del blob
+
+
+def read_header(blob: np.array) -> (dict, int):
+    """
+    - blob is the scene cache file's array
+    - returned is (the header, the byte offset the arrays start at)
+    """
+    header_length = int(blob[:HEADER_LENGTH.itemsize].view(HEADER_LENGTH)[0])
+    header_end = HEADER_LENGTH.itemsize + header_length
+    header = json.loads(blob[HEADER_LENGTH.itemsize:header_end].tobytes().decode("utf-8"))
+
+    return header, -(-header_end // ALIGNMENT) * ALIGNMENT
+
+
+def stale_reason(header: dict, key: str = "", sources: list[MeshSource] = None) -> str:
+    """
+    - sources, if given, are what the cached meshes have to have been built from
+    - returned is why the cache with this header can't be used, None if it can
+    """
+    if header.get("format") != SCENE_CACHE_FORMAT:
+        return f'format {header.get("format")} is not {SCENE_CACHE_FORMAT}'
+
+    if header.get("key") != key:
+        return "it was saved with another key"
+
+    if sources is not None:
+        if len(sources) != len(header["meshes"]):
+            return f'it has {len(header["meshes"])} meshes, not {len(sources)}'
+
+        for source, mesh_header in zip(sources, header["meshes"]):
+            # through JSON so tuples and lists, ints and floats compare the way they were saved
+            if json.loads(json.dumps(source.description())) != mesh_header["description"]:
+                return f'{source.stl_path} has another material, transform or weld tolerance'
+
+    for mesh_header in header["meshes"]:
+        source_path = mesh_header["description"]["source_path"]
+        if not os.path.exists(source_path):
+            return f'{source_path} is gone'
+        if file_hash(source_path) != mesh_header["source_hash"]:
+            return f'{source_path} changed'
+
+    return None
+
+
+def load_scene(path: str, key: str = "", sources: list[MeshSource] = None) -> list[Mesh]:
+    """
+    - sources, if given, are checked against the cached meshes' descriptions, see stale_reason
+    - returned is the cached meshes, ready to render without any preprocessing, or None if there's no cache
+      at path or it's stale (a source STL or a mesh's description changed, the key or format differs)
+    """
+    if not os.path.exists(path):
+        return None
+
+    blob = np.load(path, mmap_mode="r")
+    header, data_start = read_header(blob)
+
+    reason = stale_reason(header, key, sources)
+    if reason is not None:
+        print(f'scene cache {path} is stale, {reason}')
+        return None
+
+    meshes = []
+    for mesh_header in header["meshes"]:
+        arrays = {}
+        for name, layout in mesh_header["arrays"].items():
+            dtype = np.dtype(layout["dtype"])
+            start = data_start + layout["offset"]
+            count = int(np.prod(layout["shape"]))
+            arrays[name] = blob[start:start + count * dtype.itemsize].view(dtype).reshape(layout["shape"])
+
+        meshes.append(_mesh_from_arrays(mesh_header, arrays))
+
+    return meshes
+
+
+def _mesh_from_arrays(mesh_header: dict, arrays: dict) -> Mesh:
+    description = mesh_header["description"]
+    material = description["material"]
+    mesh = Mesh(np.array(material["diffuse_color"]), np.array(material["specular_color"]), material["ka"],
+                material["kd"], material["ks"], material["ke"], material["km"], description["hard_edges"])
+    mesh.source_path = description["source_path"]
+    mesh.weld_tolerance = description["weld_tolerance"]
+
+    # the geometry stays mapped, converted only if the file has other dtypes than the mesh uses
+    mesh.verts = np.asarray(arrays["verts"], dtype=Mesh.VERTEX_DTYPE)
+    mesh.vertex_normals = np.asarray(arrays["vertex_normals"], dtype=Mesh.VERTEX_NORMAL_DTYPE)
+    mesh.faces = np.asarray(arrays["faces"], dtype=Mesh.FACE_DTYPE)
+    mesh.normals = np.asarray(arrays["normals"], dtype=Mesh.NORMAL_DTYPE)
+
+    # restored as saved rather than through set_matrix, which would round the rotation differently
+    mesh.transform.matrix = np.array(arrays["matrix"])
+    mesh.transform.rotation = np.array(arrays["rotation"])
+    mesh.transform.scale = np.array(arrays["scale"])
+    mesh.transform.changed()
+
+    bvh = BVH.from_arrays({name: arrays["bvh_" + name] for name in BVH.ARRAY_NAMES}, **mesh_header["bvh"])
+    mesh.set_world_geometry(arrays["world_vertices"], arrays["world_vertex_normals"], arrays["world_face_normals"], bvh)
+    mesh.world_geometry_version = mesh.transform.version
+
+    return mesh
+
+
+def load_or_build_scene(path: str, sources: list[MeshSource], key: str = "") -> list[Mesh]:
+    """
+    Loads the meshes from the scene cache at path, or builds them from sources and saves them there. The cache is
+    rebuilt when a source's STL, material, transform or weld tolerance changes, or when the file can't be read
+    (truncated or corrupt).
+    - key is for anything else the meshes depend on, the cache is only used with the same key
+    """
+    try:
+        meshes = load_scene(path, key, sources)
+    except (OSError, EOFError, ValueError, KeyError, TypeError) as error:
+        # json and unicode decode errors are ValueErrors, a truncated file fails np.load or the array views
+        print(f'scene cache {path} is unreadable ({type(error).__name__}), rebuilding it')
+        meshes = None
+
+    if meshes is not None:
+        print(f'loaded {len(meshes)} meshes from scene cache {path}')
+        return meshes
+
+    meshes = [source.build() for source in sources]
+    save_scene(path, meshes, key)
+    print(f'saved {len(meshes)} meshes to scene cache {path}')
+
+    return meshes
@@ -2,26 +2,42 @@ import datetime
 import string
 
 import numpy as np
-import pygame
-pygame.init()
 
+from output import OutputSink
 
-class Screen:
 
-    def __init__(self, width, height):
+def _load_pygame():
+    # imported on first use so headless renders never pay pygame's startup or need a display
+    import pygame
+    if not pygame.get_init():
+        pygame.init()
+    return pygame
+
+
+class Screen(OutputSink):
+    """
+    Live preview window, optional output sink that also captures each frame to a png unless capture is False
+    """
+
+    def __init__(self, width, height, capture: bool = True):
         self.width = width
         self.height = height
+        self.capture = capture
+        self.capture_count = 0
 
-        self.surface = pygame.display.set_mode([width, height])
+        self.pygame = _load_pygame()
+        self.surface = self.pygame.display.set_mode([width, height])
 
     def ratio(self):
         return self.width / self.height
 
     def do_capture(self):
-        file_name: string = f'{str(datetime.datetime.now().time())[0:5]}.png'
+        # numbered, so captures in the same minute don't overwrite each other
+        file_name: string = f'{str(datetime.datetime.now().time())[0:5]}_{self.capture_count:04d}.png'
         file_name = file_name.replace(":", "h")
+        self.capture_count += 1
         print(file_name)
-        pygame.image.save(self.surface, file_name)
+        self.pygame.image.save(self.surface, file_name)
 
     def draw(self, buffer):
         if buffer.shape != (self.width, self.height, 3):
@@ -29,9 +45,15 @@ class Screen:
 
         buffer = np.fliplr(buffer)
 
-        pygame.pixelcopy.array_to_surface(self.surface, buffer)
+        self.pygame.pixelcopy.array_to_surface(self.surface, buffer)
+
+        self.pygame.display.flip()
+
+    def write(self, image: np.array) -> None:
+        self.draw(image)
 
-        pygame.display.flip()
+        if self.capture:
+            self.do_capture()
 
     def show(self):
         # running = True
@@ -40,7 +62,7 @@ class Screen:
         #         if event.type == pygame.QUIT:
         #             running = False
 
-        pygame.quit()
+        self.pygame.quit()
 
     def screen_to_pixel(self, x, z) -> np.array:
         p_x = int((x + 1) * (self.width - 1) / 2)  # w - 1 to not overflow
@@ -0,0 +1,130 @@
+import contextlib
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+
+class RenderStats:
+    """
+    Counters gathered while rendering a frame, e.g. rays cast by type.
+    Each thread counts into its own Counter so the hot path takes no lock, totals() merges them.
+    Counts from other processes are folded in with merge().
+    - detailed also counts AABB and triangle tests, hits and the recursion depth rays reach, and times the
+      render stages. The hot path only checks the module's active stats for these, so they cost next to
+      nothing while off
+    - cost_image keeps the number of triangle tests spent on each pixel, see begin_frame
+    """
+
+    def __init__(self, detailed: bool = False, cost_image: bool = False):
+        self.detailed = detailed or cost_image
+        self.keep_cost_image = cost_image
+        self.cost_image: np.array = None
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counters: list[Counter] = []
+
+    def __getstate__(self):
+        # a copy sent to a worker process starts from zero, its counts come back through merge()
+        return {"detailed": self.detailed, "cost_image": self.keep_cost_image}
+
+    def __setstate__(self, state):
+        self.__init__(state["detailed"], state["cost_image"])
+
+    def counter(self) -> Counter:
+        counter = getattr(self._local, "counter", None)
+
+        if counter is None:
+            counter = Counter()
+            self._local.counter = counter
+            with self._lock:
+                self._counters.append(counter)
+
+        return counter
+
+    def add(self, name: str, amount: int = 1) -> None:
+        self.counter()[name] += amount
+
+    def merge(self, counts: dict) -> None:
+        self.counter().update(counts)
+
+    def totals(self) -> Counter:
+        totals = Counter()
+        with self._lock:
+            for counter in self._counters:
+                totals.update(counter)
+
+        return totals
+
+    def rays_cast(self) -> int:
+        """
+        - returned is the primary, reflection and shadow rays cast so far, safe to call while other threads count
+        """
+        with self._lock:
+            return sum(counter.get(name, 0) for counter in self._counters
+                       for name in ("primary_rays", "reflection_rays", "shadow_rays"))
+
+    def reset(self) -> None:
+        with self._lock:
+            for counter in self._counters:
+                counter.clear()
+
+    def begin_frame(self, width: int, height: int) -> None:
+        """
+        Clears the counters and, if detailed, makes this the active stats the hot path counts into
+        """
+        global active
+
+        self.reset()
+        self.cost_image = np.zeros((width, height)) if self.keep_cost_image else None
+        active = self if self.detailed else None
+
+    def end_frame(self) -> None:
+        global active
+
+        if active is self:
+            active = None
+
+    def timer(self, name: str):
+        """
+        - returned is a context manager adding the seconds spent inside it to the time_<name> counter,
+          a no-op unless detailed
+        """
+        if not self.detailed:
+            return contextlib.nullcontext()
+
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add("time_" + name, time.perf_counter() - start_time)
+
+    def recursion_depth_reached(self) -> int:
+        """
+        - returned is the deepest recursion depth any ray was cast at, -1 if nothing was counted
+        """
+        depths = [int(name[len("rays_at_depth_"):]) for name, count in self.totals().items()
+                  if name.startswith("rays_at_depth_") and count > 0]
+
+        return max(depths, default=-1)
+
+    def report(self) -> str:
+        totals = self.totals()
+        lines = [f'{name}: {totals[name]:.4f}' if isinstance(totals[name], float) else f'{name}: {totals[name]}'
+                 for name in sorted(totals)]
+
+        if self.detailed:
+            lines.append(f'recursion_depth_reached: {self.recursion_depth_reached()}')
+
+        return "\n".join(lines)
+
+
+# the stats of the frame being rendered with detailed counting on, None otherwise. Hot path code checks this
+# before counting so there's only an attribute lookup to pay when stats are off
+active: RenderStats = None
@@ -0,0 +1,198 @@
+"""
+Out of core ingestion of binary STL files too big to load at once, see Mesh.from_stl_streamed.
+
+Triangles are read chunk_triangles at a time. Welding is done externally: each vertex is hashed into one of
+several bucket files on disk, so identical vertices always land in the same bucket, then every bucket is welded
+on its own with np.unique. Only a chunk or a bucket is in memory at any time. The welded vertices, faces and
+normals are written to .npy files and handed back memory mapped.
+"""
+import math
+import os
+import tempfile
+
+import numpy as np
+
+STL_HEADER_SIZE = 84
+STL_TRIANGLE = np.dtype([("normal", "<f4", (3,)), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")])
+
+# triangles read per chunk, and roughly how many vertices a bucket holds when it's welded
+STL_CHUNK_TRIANGLES = 1 << 18
+BUCKET_VERTICES = 1 << 20
+
+# spatial hash primes, as in Teschner et al. "Optimized Spatial Hashing for Collision Detection"
+HASH_PRIMES = (np.uint64(73856093), np.uint64(19349663), np.uint64(83492791))
+
+
+def write_mapped(out_dir: str, name: str, dtype, shape: tuple, fill) -> np.array:
+    """
+    Writes an array to name.npy in out_dir through a memory map and maps it back read only. It's written under a
+    temporary name and then moved over the old file, so arrays still mapping the old one are left intact.
+    - fill is an array to copy, or fill(array) writes the contents, a chunk at a time so they're never all in memory
+    - returned is the new file's array
+    """
+    path = os.path.join(out_dir, name + ".npy")
+    temporary_path = os.path.join(out_dir, name + ".tmp.npy")
+
+    values = np.lib.format.open_memmap(temporary_path, mode="w+", dtype=dtype, shape=shape)
+    if callable(fill):
+        fill(values)
+    else:
+        values[:] = fill
+    values.flush()
+    del values
+
+    os.replace(temporary_path, path)
+
+    return np.load(path, mmap_mode="r")
+
+
+def binary_stl_triangle_count(stl_path: str) -> int:
+    """
+    - returned is the number of triangles in the binary STL file, raises if it isn't one
+    """
+    with open(stl_path, "rb") as file:
+        header = file.read(STL_HEADER_SIZE)
+
+    if len(header) < STL_HEADER_SIZE:
+        raise Exception(f'{stl_path} is too short to be a binary STL file')
+
+    triangle_count = int(np.frombuffer(header, dtype="<u4", count=1, offset=80)[0])
+    if os.path.getsize(stl_path) != STL_HEADER_SIZE + triangle_count * STL_TRIANGLE.itemsize:
+        raise Exception(f'{stl_path} is not a binary STL file (ASCII STLs can only be read with Mesh.from_stl)')
+
+    return triangle_count
+
+
+def read_stl_chunks(stl_path: str, chunk_triangles: int = STL_CHUNK_TRIANGLES):
+    """
+    - yields (index of the first triangle, (n, 3, 3) float32 corners) for each chunk of the file's triangles
+    """
+    triangle_count = binary_stl_triangle_count(stl_path)
+
+    with open(stl_path, "rb") as file:
+        file.seek(STL_HEADER_SIZE)
+        for first in range(0, triangle_count, chunk_triangles):
+            records = np.fromfile(file, dtype=STL_TRIANGLE, count=min(chunk_triangles, triangle_count - first))
+            yield first, records["vertices"]
+
+
+def face_normals_of(triangles: np.array) -> np.array:
+    """
+    - returned is the (n, 3) float32 normals of the (n, 3, 3) triangles, not normalized, computed the way
+      numpy-stl does so meshes come out the same as with Mesh.from_stl
+    """
+    return np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+
+
+def _weld_keys(points: np.array, tolerance: float) -> np.array:
+    # the same keys math_helper.weld_vertices welds on
+    if tolerance > 0:
+        return np.round(points / tolerance).astype(np.int64)
+
+    return points + np.float32(0.0)
+
+
+def _bucket_of(keys: np.array, bucket_count: int) -> np.array:
+    words = keys.view(np.uint32 if keys.dtype == np.float32 else np.uint64).astype(np.uint64)
+    hashed = (words[:, 0] * HASH_PRIMES[0]) ^ (words[:, 1] * HASH_PRIMES[1]) ^ (words[:, 2] * HASH_PRIMES[2])
+
+    return (hashed % np.uint64(bucket_count)).astype(np.int64)
+
+
+def stream_stl_to_memmaps(stl_path: str, out_dir: str, weld_tolerance: float = 0.0,
+                          chunk_triangles: int = STL_CHUNK_TRIANGLES, bucket_vertices: int = BUCKET_VERTICES) -> dict:
+    """
+    Welds a binary STL into verts.npy, faces.npy, normals.npy and vertex_normals.npy in out_dir, the same arrays
+    Mesh.from_stl makes, keeping only a chunk of triangles or one bucket of vertices in memory.
+    Vertices are numbered bucket by bucket rather than in order of first appearance.
+    - weld_tolerance is as in Mesh.from_stl
+    - returned is the four arrays by name, memory mapped read only
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    triangle_count = binary_stl_triangle_count(stl_path)
+    point_count = 3 * triangle_count
+    bucket_count = max(1, math.ceil(point_count / bucket_vertices))
+
+    key_dtype = np.dtype(np.int64) if weld_tolerance > 0 else np.dtype(np.float32)
+    record_dtype = np.dtype([("key", key_dtype, (3,)), ("position", "<f4", (3,)), ("point", "<i8")])
+
+    # same dtypes as Mesh.verts, faces, normals and vertex_normals
+    normals = np.lib.format.open_memmap(os.path.join(out_dir, "normals.npy"), mode="w+", dtype=np.float32,
+                                        shape=(triangle_count, 3))
+    faces = np.lib.format.open_memmap(os.path.join(out_dir, "faces.npy"), mode="w+", dtype=np.int32,
+                                      shape=(triangle_count, 3))
+    point_vertex = faces.reshape(-1)
+
+    with tempfile.TemporaryDirectory(dir=out_dir) as work_dir:
+        # pass 1: face normals, and every point sent to its bucket
+        bucket_files = [open(os.path.join(work_dir, f'bucket_{bucket}.bin'), "wb") for bucket in range(bucket_count)]
+        try:
+            for first, triangles in read_stl_chunks(stl_path, chunk_triangles):
+                normals[first:first + len(triangles)] = face_normals_of(triangles)
+
+                points = triangles.reshape(-1, 3)
+                records = np.empty(len(points), dtype=record_dtype)
+                records["key"] = _weld_keys(points, weld_tolerance)
+                records["position"] = points
+                records["point"] = np.arange(3 * first, 3 * first + len(points))
+
+                buckets = _bucket_of(records["key"], bucket_count)
+                # stable, so each bucket keeps its points in file order and np.unique's first index is the first use
+                records = records[np.argsort(buckets, kind="stable")]
+                bucket_ends = np.cumsum(np.bincount(buckets, minlength=bucket_count))
+
+                for bucket, (start, end) in enumerate(zip(np.concatenate(([0], bucket_ends[:-1])), bucket_ends)):
+                    if end > start:
+                        records[start:end].tofile(bucket_files[bucket])
+        finally:
+            for bucket_file in bucket_files:
+                bucket_file.close()
+
+        # pass 2: weld each bucket, appending its vertices and pointing its points at them
+        vertex_count = 0
+        vertices_path = os.path.join(work_dir, "vertices.bin")
+        with open(vertices_path, "wb") as vertices_file:
+            for bucket in range(bucket_count):
+                bucket_path = os.path.join(work_dir, f'bucket_{bucket}.bin')
+                records = np.fromfile(bucket_path, dtype=record_dtype)
+                os.remove(bucket_path)
+                if len(records) == 0:
+                    continue
+
+                keys = np.ascontiguousarray(records["key"])
+                row_view = keys.view(np.dtype((np.void, keys.dtype.itemsize * 3))).ravel()
+                _, first_index, inverse = np.unique(row_view, return_index=True, return_inverse=True)
+
+                if vertex_count + len(first_index) > np.iinfo(np.int32).max:
+                    raise Exception(f'{stl_path} has more vertices than 32 bit face indices can address')
+
+                records["position"][first_index].tofile(vertices_file)
+                point_vertex[records["point"]] = vertex_count + inverse.ravel()
+                vertex_count += len(first_index)
+
+        verts = np.lib.format.open_memmap(os.path.join(out_dir, "verts.npy"), mode="w+", dtype=np.float32,
+                                          shape=(vertex_count, 3))
+        with open(vertices_path, "rb") as vertices_file:
+            for start in range(0, vertex_count, bucket_vertices):
+                chunk = np.fromfile(vertices_file, dtype=np.float32, count=3 * min(bucket_vertices, vertex_count - start))
+                verts[start:start + len(chunk) // 3] = chunk.reshape(-1, 3)
+
+    # pass 3: each vertex normal is the normalized sum of the normals of the faces using it, as in from_stl
+    vertex_normals = np.lib.format.open_memmap(os.path.join(out_dir, "vertex_normals.npy"), mode="w+",
+                                               dtype=np.float64, shape=(vertex_count, 3))
+    for start in range(0, triangle_count, chunk_triangles):
+        end = min(start + chunk_triangles, triangle_count)
+        np.add.at(vertex_normals, faces[start:end].ravel(),
+                  np.repeat(np.asarray(normals[start:end], dtype=np.float64), 3, axis=0))
+
+    for start in range(0, vertex_count, bucket_vertices):
+        chunk = vertex_normals[start:start + bucket_vertices]
+        lengths = np.linalg.norm(chunk, axis=1)
+        chunk /= np.where(lengths > 0, lengths, 1.0)[:, None]
+
+    arrays = {"verts": verts, "faces": faces, "normals": normals, "vertex_normals": vertex_normals}
+    for values in arrays.values():
+        values.flush()
+
+    return {name: np.load(os.path.join(out_dir, name + ".npy"), mmap_mode="r") for name in arrays}
@@ -0,0 +1,106 @@
+import multiprocessing
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import distributed
+from camera import PerspectiveCamera
+from light import PointLight
+from mesh import Mesh
+from output import OutputSink
+from progress import RenderObserver
+from renderer import Renderer
+
+
+class CaptureSink(OutputSink):
+
+    def __init__(self):
+        self.image = None
+
+    def write(self, image: np.array) -> None:
+        self.image = image.copy()
+
+
+class KillWorker(RenderObserver):
+    """
+    Kills a worker process once the first tile of the frame is in
+    """
+
+    def __init__(self, process: multiprocessing.Process):
+        self.process = process
+
+    def on_progress(self, progress) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+
+
+def small_renderer(sink: OutputSink) -> Renderer:
+    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
+    camera.transform.set_position(0, -6, 3)
+    camera.transform.set_rotation(-25, 0, 0)
+
+    sphere = Mesh.from_stl("unit_sphere.stl", np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]),
+                           np.array([1.0, 1.0, 1.0]), 0.2, 0.7, 0.3, 50.0, 0.05, False)
+    sphere.transform.set_position(0, 0, 0.5)
+    floor = Mesh.from_stl("flat_cube.stl", np.array([1.0, 1.0, 1.0]),
+                          np.array([1.0, 1.0, 1.0]), 0.4, 1.0, 0.0, 1.0, 0.05, True)
+    floor.transform.set_position(0, 0, -1)
+
+    light = PointLight(15.0, np.array([1, 1, 1]))
+    light.transform.set_position(-3, -3, 2)
+
+    return Renderer(32, 32, camera, [sphere, floor], light, [sink])
+
+
+def test_dropped_worker_matches_thread_backend():
+    sink = CaptureSink()
+    renderer = small_renderer(sink)
+    renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront", tile_size=8)
+    expected = sink.image
+
+    coordinator = distributed.Coordinator(tile_timeout=30.0, worker_wait=30.0)
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=distributed.run_worker,
+                               args=(coordinator.address[0], coordinator.address[1], coordinator.authkey))
+               for _ in range(2)]
+
+    try:
+        for worker in workers:
+            worker.start()
+
+        deadline = time.monotonic() + 30.0
+        while coordinator.worker_count() < 2:
+            assert time.monotonic() < deadline, "workers didn't connect"
+            time.sleep(0.05)
+
+        renderer.observers = [KillWorker(workers[0])]
+        renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront", tile_size=8,
+                        backend="distributed", coordinator=coordinator)
+    finally:
+        coordinator.close()
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.kill()
+
+    assert not workers[0].is_alive()
+    assert np.array_equal(sink.image, expected)
+
+
+def test_channel_rejects_other_authkey():
+    coordinator_socket, worker_socket = socket.socketpair()
+
+    with coordinator_socket, worker_socket:
+        channels = {}
+        handshake = threading.Thread(target=lambda: channels.update(
+            worker=distributed.Channel(worker_socket, b"worker key", coordinator=False)))
+        handshake.start()
+        coordinator_channel = distributed.Channel(coordinator_socket, b"coordinator key", coordinator=True)
+        handshake.join()
+
+        channels["worker"].send(("hello",))
+        with pytest.raises(distributed.AuthenticationError):
+            coordinator_channel.receive()
@@ -0,0 +1,19 @@
+import pytest
+
+import kernels
+
+# every backend kernels.py knows about, the optional ones are skipped when they aren't installed
+BACKEND_NAMES = ["reference", "numpy"] + list(kernels.OPTIONAL_BACKENDS)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("name", BACKEND_NAMES)
+def test_backend_matches_reference(name: str, seed: int):
+    if name not in kernels.available_backends():
+        pytest.skip(f'{name} is not installed')
+
+    assert kernels.verify_backend(name, seed) == []
+
+
+def test_available_backends_are_tested():
+    assert set(kernels.available_backends()) <= set(BACKEND_NAMES)
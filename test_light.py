@@ -0,0 +1,64 @@
+import numpy as np
+
+import light
+from light import LightSet, PointLight
+
+
+def random_lights(count: int, seed: int = 1) -> list[PointLight]:
+    rng = np.random.default_rng(seed)
+    lights = []
+    for _ in range(count):
+        light = PointLight(1.0, rng.uniform(0.3, 1.0, 3))
+        light.transform.set_position(*rng.uniform(-3, 3, 3))
+        lights.append(light)
+
+    return lights
+
+
+def random_points(count: int, seed: int = 2) -> (np.array, np.array):
+    rng = np.random.default_rng(seed)
+    normals = rng.normal(size=(count, 3))
+    return rng.uniform(-2, 2, (count, 3)), normals / np.linalg.norm(normals, axis=1)[:, None]
+
+
+def pairs_of(pairs: tuple, point: int) -> list:
+    point_indices, light_indices, weights = pairs
+    return list(zip(light_indices[point_indices == point].tolist(), weights[point_indices == point].tolist()))
+
+
+def test_lights_at_picks_what_light_pairs_picks():
+    lights = LightSet(random_lights(40), samples=4)
+    points, normals = random_points(100)
+
+    pairs = lights.light_pairs(points, normals)
+    assert np.all(np.isfinite(pairs[2]))
+
+    for point in range(len(points)):
+        assert lights.lights_at(tuple(points[point]), tuple(normals[point])) == pairs_of(pairs, point)
+
+    # a point's picks don't depend on the rest of the batch
+    assert pairs_of(lights.light_pairs(points[10:11], normals[10:11]), 0) == pairs_of(pairs, 10)
+
+
+def test_points_no_light_reaches_keep_every_light():
+    lights = LightSet(random_lights(40), samples=4)
+
+    # above every light and facing away from them all, so every estimate is zero
+    point, normal = (0.0, 0.0, 10.0), (0.0, 0.0, 1.0)
+    everything = [(light, 1.0) for light in range(40)]
+
+    assert lights.lights_at(point, normal) == everything
+    assert pairs_of(lights.light_pairs(np.array([point]), np.array([normal])), 0) == everything
+
+
+def test_only_lights_with_a_contribution_are_picked(monkeypatch):
+    lights = LightSet(random_lights(4), samples=2)
+
+    # draws at both ends, one right on the total, with zero estimates before and after the others
+    monkeypatch.setattr(light, "point_uniforms", lambda seed, points, count: np.array([[1.0, 0.0]]))
+    estimates = np.array([0.0, 0.3, 0.7, 0.0])
+    picks, weights, sampled = lights._pick(np.zeros((1, 3)), np.array([0]), np.array([4]), estimates)
+
+    assert sampled.tolist() == [True]
+    assert picks.tolist() == [1, 2]
+    assert np.all(np.isfinite(weights))
@@ -0,0 +1,56 @@
+import numpy as np
+
+from mesh import Mesh
+from ray import Ray
+
+# what a rendered mesh may hold per triangle: typed geometry, world space arrays, BVH arrays and traversal lists.
+# Converting the world space triangles to lists for the per-ray path would take over twice this
+MAX_BYTES_PER_TRIANGLE = 600
+
+
+def load_suzanne() -> Mesh:
+    return Mesh.from_stl("suzanne.stl", np.array([1.0, 1.0, 1.0]), np.array([1.0, 1.0, 1.0]),
+                         0.2, 0.7, 0.3, 10.0, 0.05, False)
+
+
+def test_geometry_is_typed_arrays():
+    mesh = load_suzanne()
+
+    assert mesh.verts.dtype == np.float32
+    assert mesh.normals.dtype == np.float32
+    assert mesh.faces.dtype == np.int32
+    assert mesh.vertex_normals.dtype == Mesh.VERTEX_NORMAL_DTYPE
+    assert mesh.faces.shape == mesh.normals.shape == (len(mesh.faces), 3)
+
+
+def test_footprint_stays_bounded_through_rendering():
+    mesh = load_suzanne()
+
+    mesh.update_world_geometry()
+    built = mesh.memory_footprint()
+    assert built["total_bytes_per_triangle"] < MAX_BYTES_PER_TRIANGLE
+
+    hit, _ = mesh.hit(Ray((0.0, -5.0, 0.0), (0.0, 1.0, 0.0)), 0.001, 100.0)
+    assert hit
+    assert not mesh.occluded(Ray((0.0, -5.0, 0.0), (0.0, -1.0, 0.0)), 0.001, 100.0)
+
+    rendered = mesh.memory_footprint()
+    assert rendered["total_bytes_per_triangle"] < MAX_BYTES_PER_TRIANGLE
+    assert rendered["total"] == built["total"]
+
+
+def test_cancelled_vertex_normals_stay_zero():
+    # one triangle whose first two vertex normals point opposite ways, they cancel halfway along that edge
+    mesh = Mesh(np.array([1.0, 1.0, 1.0]), np.array([1.0, 1.0, 1.0]), 0.2, 0.7, 0.3, 10.0, 0.05, False)
+    mesh.verts = np.array([[0, 0, 0], [1, 0, 0], [0, 1, 0]], dtype=Mesh.VERTEX_DTYPE)
+    mesh.faces = np.array([[0, 1, 2]], dtype=Mesh.FACE_DTYPE)
+    mesh.normals = np.array([[0, 0, 1]], dtype=Mesh.NORMAL_DTYPE)
+    mesh.vertex_normals = np.array([[0, 0, 1], [0, 0, -1], [0, 0, 1]], dtype=Mesh.VERTEX_NORMAL_DTYPE)
+    mesh.update_world_geometry()
+
+    _, normal_w = mesh.world_normals_at(np.array([0]), np.array([0.0]), np.array([0.5]))
+    assert normal_w.tolist() == [[0.0, 0.0, 0.0]]
+
+    hit, hit_record = mesh.hit(Ray((0.5, 0.0, 1.0), (0.0, 0.0, -1.0)), 0.001, 100.0)
+    assert hit
+    assert tuple(hit_record.normal_w) == (0.0, 0.0, 0.0)
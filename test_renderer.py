@@ -0,0 +1,202 @@
+import concurrent.futures
+
+import numpy as np
+
+from camera import PerspectiveCamera
+from frames import Frame
+from light import PointLight
+from output import NpySink, OutputSink
+from progress import PrintProgress
+from renderer import Renderer, bounded_map
+from test_script import scene_sources
+
+
+class CaptureSink(OutputSink):
+
+    def __init__(self, width: int = None, height: int = None):
+        # a size like Screen's, for passing it as the renderer's first argument
+        self.width = width
+        self.height = height
+        self.image = None
+
+    def write(self, image: np.array) -> None:
+        self.image = image.copy()
+
+
+def script_camera() -> PerspectiveCamera:
+    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
+    camera.transform.set_position(0, -6, 3)
+    camera.transform.set_rotation(-25, 0, 0)
+    return camera
+
+
+def script_light() -> PointLight:
+    light = PointLight(15.0, np.array([1, 1, 1]))
+    light.transform.set_position(-3, -3, 2)
+    return light
+
+
+def script_renderer(sink: OutputSink, size: int = 24) -> Renderer:
+    """
+    test_script.py's scene at size by size pixels
+    """
+    return Renderer(size, size, script_camera(), [source.build() for source in scene_sources()], script_light(), [sink])
+
+
+def render_script_scene(mode: str) -> np.array:
+    sink = CaptureSink()
+    script_renderer(sink).render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode=mode, tile_size=8)
+    return sink.image
+
+
+def test_recursive_and_wavefront_render_the_same_image():
+    recursive = render_script_scene("recursive")
+    wavefront = render_script_scene("wavefront")
+
+    # something other than the background was rendered
+    assert len(np.unique(recursive.reshape(-1, 3), axis=0)) > 10
+    assert np.array_equal(recursive, wavefront)
+
+
+def test_screen_as_first_argument():
+    screen = CaptureSink(24, 16)
+    renderer = Renderer(screen, script_camera(), [source.build() for source in scene_sources()], script_light())
+
+    assert (renderer.width, renderer.height) == (24, 16)
+    assert renderer.sinks == [screen]
+
+    renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront", tile_size=8)
+    assert screen.image.shape == (24, 16, 3)
+
+
+def test_render_prints_only_through_observers(tmp_path, capsys):
+    path = str(tmp_path / "render.npy")
+    renderer = script_renderer(NpySink(path), size=8)
+
+    renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront")
+    assert capsys.readouterr().out == ""
+
+    renderer.observers = [PrintProgress()]
+    renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront")
+    printed = capsys.readouterr().out
+    assert path in printed
+    assert "Rendering took" in printed
+
+
+def test_progressive_render_is_reproducible():
+    images = []
+    for _ in range(2):
+        sink = CaptureSink()
+        renderer = script_renderer(sink, size=12)
+        renderer.render_progressive([80, 80, 80], [0.1, 0.1, 0.1], target_error=0.001, max_samples=3, tile_size=8,
+                                    batch_size=64, seed=7)
+        images.append(sink.image)
+
+        totals = renderer.stats.totals()
+        assert 12 * 12 < totals["progressive_samples"] <= 3 * 12 * 12
+        assert totals["progressive_samples_busiest_pixel"] <= 3
+
+    assert np.array_equal(images[0], images[1])
+
+
+def test_relight_reuses_the_gbuffer_until_the_view_changes():
+    sink = CaptureSink()
+    renderer = script_renderer(sink, size=16)
+    renderer.render_relight([80, 80, 80], [0.1, 0.1, 0.1], tile_size=8)
+    assert renderer.stats.totals()["gbuffer_traced"] == 1
+    first = sink.image
+
+    renderer.lights.lights[0].transform.set_position(2, -3, 3)
+    renderer.meshes[0].material.kd = 0.3
+    key = renderer.gbuffer_key()
+    renderer.render_relight([80, 80, 80], [0.1, 0.1, 0.1], tile_size=8)
+    relit = sink.image
+    assert not np.array_equal(relit, first)
+
+    # only the light and a material changed, so no eye rays were traced again
+    totals = renderer.stats.totals()
+    assert renderer.gbuffer_key() == key
+    assert totals["gbuffer_reused"] == 1
+    assert totals["primary_rays"] == 0
+
+    renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], mode="wavefront", tile_size=8)
+    assert np.array_equal(relit, sink.image)
+
+    renderer.meshes[0].transform.set_position(0, 0, 1)
+    assert renderer.gbuffer_key() != key
+    renderer.render_relight([80, 80, 80], [0.1, 0.1, 0.1], tile_size=8)
+    assert renderer.stats.totals()["gbuffer_traced"] == 1
+
+    key = renderer.gbuffer_key()
+    renderer.camera.transform.set_position(0, -7, 3)
+    assert renderer.gbuffer_key() != key
+    renderer.render_relight([80, 80, 80], [0.1, 0.1, 0.1], tile_size=8)
+    assert renderer.stats.totals()["gbuffer_traced"] == 1
+    assert renderer.stats.totals()["primary_rays"] == 16 * 16
+
+
+def test_render_frames_moves_only_the_animated_mesh(tmp_path):
+    renderer = script_renderer(CaptureSink(), size=16)
+    sphere = renderer.meshes[0]
+
+    moved = sphere.transform.matrix.copy()
+    moved[0][3] += 1.0
+    # every mesh and the camera get a matrix each frame, the ones that stay put keep their version
+    still = {index: mesh.transform.matrix.copy() for index, mesh in enumerate(renderer.meshes)}
+    frames = [Frame(renderer.camera.transform.matrix.copy(), still),
+              Frame(renderer.camera.transform.matrix.copy(), {**still, 0: moved})]
+
+    versions = [mesh.transform.version for mesh in renderer.meshes]
+    camera_version = renderer.camera.transform.version
+    paths = renderer.render_frames(frames, [80, 80, 80], [0.1, 0.1, 0.1], str(tmp_path / "frame_{index}.npy"),
+                                   mode="wavefront", tile_size=8)
+
+    assert paths == [str(tmp_path / "frame_0.npy"), str(tmp_path / "frame_1.npy")]
+    assert not np.array_equal(np.load(paths[0]), np.load(paths[1]))
+
+    assert sphere.transform.version == versions[0] + 1
+    assert [mesh.transform.version for mesh in renderer.meshes[1:]] == versions[1:]
+    assert renderer.camera.transform.version == camera_version
+
+
+def test_memory_mapped_framebuffer_matches_in_memory_render(tmp_path):
+    sink = CaptureSink()
+    renderer = script_renderer(sink, size=20)
+    in_memory = renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], tile_size=8)
+
+    path = str(tmp_path / "image.npy")
+    mapped = renderer.render("barycentric", [80, 80, 80], [0.1, 0.1, 0.1], tile_size=8, framebuffer_path=path)
+
+    assert isinstance(mapped, np.memmap)
+    assert np.array_equal(sink.image, in_memory)
+    assert np.array_equal(np.load(path), in_memory)
+    assert np.load(path).dtype == in_memory.dtype
+
+
+class CountingExecutor(concurrent.futures.ThreadPoolExecutor):
+    """
+    Records the most futures submitted but not yet consumed at any one time, consumed is counted by the caller
+    """
+
+    def __init__(self):
+        super().__init__(max_workers=2)
+        self.submitted = 0
+        self.consumed = 0
+        self.most_outstanding = 0
+
+    def submit(self, function, *args):
+        self.submitted += 1
+        self.most_outstanding = max(self.most_outstanding, self.submitted - self.consumed)
+        return super().submit(function, *args)
+
+
+def test_bounded_map_keeps_at_most_max_pending_futures():
+    with CountingExecutor() as executor:
+        results = []
+        for result in bounded_map(executor, lambda item: item * 2, range(50), 3):
+            executor.consumed += 1
+            results.append(result)
+
+    assert results == [item * 2 for item in range(50)]
+    assert executor.submitted == 50
+    assert executor.most_outstanding == 3
@@ -0,0 +1,38 @@
+import numpy as np
+
+from mesh import Mesh
+from ray import Ray
+from scene import Scene
+
+
+def load_cube() -> Mesh:
+    return Mesh.from_stl("unit_cube.stl", np.array([1.0, 1.0, 1.0]), np.array([1.0, 1.0, 1.0]),
+                         0.2, 0.7, 0.3, 1.0, 0.05, True)
+
+
+def test_moved_mesh_is_hit_without_update():
+    mesh = load_cube()
+    scene = Scene([mesh])
+    mesh.transform.set_position(10, 0, 0)
+
+    ray = Ray((10.0, -5.0, 0.0), (0.0, 1.0, 0.0))
+    assert scene.hit(ray, 0, 100)[0]
+    assert scene.occluded(ray, 0, 100)
+
+    records = scene.hit_batch(np.array([ray.origin]), np.array([ray.direction]), 0, 100)
+    assert records.hit.tolist() == [True]
+    assert scene.occluded_batch(np.array([ray.origin]), np.array([ray.direction]), 0, 100).tolist() == [True]
+
+    # where the cube was is empty now
+    assert not scene.hit(Ray((0.0, -5.0, 0.0), (0.0, 1.0, 0.0)), 0, 100)[0]
+
+
+def test_mesh_updated_on_its_own_still_moves_the_scene():
+    mesh = load_cube()
+    scene = Scene([mesh])
+    mesh.transform.set_position(10, 0, 0)
+
+    ray = Ray((10.0, -5.0, 0.0), (0.0, 1.0, 0.0))
+    # the mesh brings its own geometry up to date, the scene has to notice the new bounds anyway
+    assert mesh.hit(ray, 0, 100)[0]
+    assert scene.hit(ray, 0, 100)[0]
@@ -0,0 +1,56 @@
+import numpy as np
+
+import scene_cache
+from scene_cache import MeshSource, load_or_build_scene
+
+
+def cube_source(diffuse: float = 0.5, x: float = 0.0, weld_tolerance: float = 0.0) -> MeshSource:
+    source = MeshSource("unit_cube.stl", np.array([diffuse, diffuse, diffuse]), np.array([1.0, 1.0, 1.0]),
+                        0.2, 0.7, 0.3, 1.0, 0.05, True, weld_tolerance)
+    source.transform.set_position(x, 0, 0)
+    return source
+
+
+def test_cache_is_reused(tmp_path):
+    path = str(tmp_path / "scene.npy")
+    built = load_or_build_scene(path, [cube_source()])
+    loaded = scene_cache.load_scene(path, sources=[cube_source()])
+
+    assert loaded is not None
+    assert np.array_equal(loaded[0].world_vertices, built[0].world_vertices)
+    assert np.array_equal(loaded[0].transform.matrix, built[0].transform.matrix)
+
+
+def test_cache_is_stale_after_changing_a_source(tmp_path):
+    path = str(tmp_path / "scene.npy")
+    load_or_build_scene(path, [cube_source()])
+
+    assert scene_cache.load_scene(path, sources=[cube_source(diffuse=0.6)]) is None
+    assert scene_cache.load_scene(path, sources=[cube_source(x=1.0)]) is None
+    assert scene_cache.load_scene(path, sources=[cube_source(weld_tolerance=0.01)]) is None
+    assert scene_cache.load_scene(path, sources=[cube_source(), cube_source()]) is None
+
+    meshes = load_or_build_scene(path, [cube_source(x=1.0)])
+    assert meshes[0].transform.matrix[0][3] == 1.0
+    assert scene_cache.load_scene(path, sources=[cube_source(x=1.0)]) is not None
+
+
+def test_corrupt_cache_is_rebuilt(tmp_path):
+    path = str(tmp_path / "scene.npy")
+    load_or_build_scene(path, [cube_source()])
+
+    with open(path, "r+b") as file:
+        file.truncate(200)
+    meshes = load_or_build_scene(path, [cube_source()])
+    assert len(meshes) == 1
+
+    size = len(open(path, "rb").read())
+    with open(path, "r+b") as file:
+        file.seek(size // 2)
+        file.write(b"\xff" * 64)
+        # the header too, so its JSON no longer parses
+        file.seek(140)
+        file.write(b"\xff" * 16)
+    meshes = load_or_build_scene(path, [cube_source()])
+    assert len(meshes) == 1
+    assert scene_cache.load_scene(path, sources=[cube_source()]) is not None
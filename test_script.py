@@ -1,46 +1,75 @@
+import sys
+
 import numpy as np
 
-from screen import Screen
+from output import PNGSink
+from progress import PrintProgress
 from camera import PerspectiveCamera,OrthoCamera
-from mesh import Mesh
 from renderer import Renderer
 from light import PointLight
+from scene_cache import MeshSource, load_or_build_scene
 
+# rebuilt whenever an STL, material, transform or weld tolerance in scene_sources changes, --no-cache skips it
+SCENE_CACHE_PATH = "test_scene.cache.npy"
 
 
-if __name__ == '__main__':
-    screen = Screen(500, 500)
-
-    # camera = OrthoCamera(-1.0, 1.0, -1.0, 1.0, 1, 60)
-    # camera = PerspectiveCamera(-1.0, 1.0, -1.0, 1.0, 1, 60)
-    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
-    # camera = PerspectiveCamera(-1.0, 1.0, -1.0, 1.0, 1.0, 10)
-    camera.transform.set_position(0, -6, 3)
-    camera.transform.set_rotation(-25, 0, 0)
-
-    mesh = Mesh.from_stl("unit_sphere.stl", np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]),\
+def scene_sources() -> list[MeshSource]:
+    sphere = MeshSource("unit_sphere.stl", np.array([171.0 / 255.0, 132.0 / 255.0, 32.0 / 255.0]),\
         np.array([1.0, 1.0, 1.0]),0.2,0.7,0.3,50.0, 0.05, False)
-    mesh.transform.set_position(0, 0, 0.5)
+    sphere.transform.set_position(0, 0, 0.5)
 
-    mesh2 = Mesh.from_stl("unit_cube.stl", np.array([7.0 / 255.0, 20.0 / 255.0, 32.0 / 255.0]), \
+    cube = MeshSource("unit_cube.stl", np.array([7.0 / 255.0, 20.0 / 255.0, 32.0 / 255.0]), \
                          np.array([1.0, 1.0, 1.0]), 0.2, 0.7, 0.3, 1.0, 0.05, True)
-    mesh2.transform.set_rotation(0, 0, 45)
-    mesh2.transform.set_position(-1.6, -1, 0)
+    cube.transform.set_rotation(0, 0, 45)
+    cube.transform.set_position(-1.6, -1, 0)
 
-    mesh3 = Mesh.from_stl("unit_cube.stl", np.array([161.0 / 255.0, 24.0 / 255.0, 58.0 / 255.0]), \
+    cube2 = MeshSource("unit_cube.stl", np.array([161.0 / 255.0, 24.0 / 255.0, 58.0 / 255.0]), \
                          np.array([1.0, 1.0, 1.0]), 0.2, 0.7, 0.3, 1.0, 0.05, True)
-    mesh3.transform.set_position(1.6, -1, 0)
+    cube2.transform.set_position(1.6, -1, 0)
 
-    floor_mesh = Mesh.from_stl("flat_cube.stl", np.array([1.0, 1.0, 1.0]), \
+    floor = MeshSource("flat_cube.stl", np.array([1.0, 1.0, 1.0]), \
                           np.array([1.0, 1.0, 1.0]), 0.4, 1.0, 0.0, 1.0, 0.05, True)
-    floor_mesh.transform.set_position(0, 0, -1)
+    floor.transform.set_position(0, 0, -1)
+
+    return [sphere, cube, cube2, floor]
 
 
+if __name__ == '__main__':
+    width, height = 500, 500
+
+    # --headless writes straight to a png without opening (or importing) pygame
+    headless = "--headless" in sys.argv
+    if headless:
+        sinks = [PNGSink("render.png")]
+    else:
+        from screen import Screen
+        screen = Screen(width, height)
+        sinks = [screen]
+
+    # camera = OrthoCamera(-1.0, 1.0, -1.0, 1.0, 1, 60)
+    # camera = PerspectiveCamera(-1.0, 1.0, -1.0, 1.0, 1, 60)
+    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
+    # camera = PerspectiveCamera(-1.0, 1.0, -1.0, 1.0, 1.0, 10)
+    camera.transform.set_position(0, -6, 3)
+    camera.transform.set_rotation(-25, 0, 0)
+
+    # --no-cache loads and preprocesses the STLs every time instead of using the compiled scene cache
+    if "--no-cache" in sys.argv:
+        meshes = [source.build() for source in scene_sources()]
+    else:
+        meshes = load_or_build_scene(SCENE_CACHE_PATH, scene_sources())
 
     light = PointLight(15.0, np.array([1, 1, 1]))
     light.transform.set_position(-3, -3, 2)
 
-    renderer = Renderer(screen, camera, [mesh, mesh2, mesh3, floor_mesh], light)
+    renderer = Renderer(width, height, camera, meshes, light, sinks, [PrintProgress()])
+
+    for mesh in meshes:
+        print(f'{mesh.source_path}: BVH of {mesh.bvh.node_count_total()} nodes over {mesh.bvh.primitive_count} '
+              f'triangles, built in {mesh.bvh.build_seconds:.4f}s')
+    print(f'scene: BVH of {renderer.scene.bvh.node_count_total()} nodes over {len(meshes)} meshes')
+
     renderer.render("barycentric",[80,80,80], [0.1, 0.1, 0.1])
 
-    screen.show()
+    if not headless:
+        screen.show()
@@ -0,0 +1,98 @@
+import gc
+import tracemalloc
+
+import numpy as np
+import pytest
+
+import stl_stream
+from camera import PerspectiveCamera
+from light import PointLight
+from mesh import Mesh
+from output import OutputSink
+from renderer import Renderer
+
+
+class NullSink(OutputSink):
+
+    def write(self, image: np.array) -> None:
+        pass
+
+
+def write_grid_stl(path: str, cells: int) -> None:
+    """
+    Writes a binary STL of a flat 2 by 2 grid facing +z, cells by cells quads of two triangles each
+    """
+    xs = np.linspace(-1, 1, cells + 1)
+    x0, y0 = np.meshgrid(xs[:-1], xs[:-1], indexing="ij")
+    x1, y1 = np.meshgrid(xs[1:], xs[1:], indexing="ij")
+    z = np.zeros_like(x0)
+
+    a, b, c, d = (np.stack(corner, axis=-1) for corner in ((x0, y0, z), (x1, y0, z), (x1, y1, z), (x0, y1, z)))
+    triangles = np.concatenate((np.stack((a, b, c), axis=-2).reshape(-1, 3, 3),
+                                np.stack((a, c, d), axis=-2).reshape(-1, 3, 3)))
+
+    records = np.zeros(len(triangles), dtype=stl_stream.STL_TRIANGLE)
+    records["vertices"] = triangles
+    records["normal"] = (0, 0, 1)
+
+    with open(path, "wb") as file:
+        file.write(bytes(80) + np.uint32(len(triangles)).tobytes())
+        records.tofile(file)
+
+
+def streamed_grid_renderer(tmp_path, cells: int) -> Renderer:
+    out_dir = tmp_path / f'grid_{cells}'
+    out_dir.mkdir()
+    write_grid_stl(str(out_dir / "grid.stl"), cells)
+
+    mesh = Mesh.from_stl_streamed(str(out_dir / "grid.stl"), str(out_dir), np.array([0.5, 0.5, 0.5]),
+                                  np.array([1.0, 1.0, 1.0]), 0.2, 0.7, 0.3, 10.0, 0.0, False)
+
+    camera = PerspectiveCamera.from_FOV(45, 1, 60, 1)
+    camera.transform.set_position(0, 0, 3)
+    camera.transform.set_rotation(-90, 0, 0)
+
+    light = PointLight(5.0, np.array([1, 1, 1]))
+    light.transform.set_position(1, 1, 0.5)
+
+    # builds the world space arrays and the BVH, both memory mapped in out_dir
+    return Renderer(16, 16, camera, [mesh], light, [NullSink()])
+
+
+def traced_render(tmp_path, cells: int, mode: str) -> (int, int, Renderer):
+    """
+    - returned is (bytes still allocated once the mesh is loaded and ready to render, peak bytes allocated while
+      rendering, the renderer), as tracemalloc sees them
+    """
+    # garbage left by earlier tests would otherwise be collected, and counted, at whatever point the render hits
+    gc.collect()
+    tracemalloc.start()
+    try:
+        renderer = streamed_grid_renderer(tmp_path, cells)
+        resident = tracemalloc.get_traced_memory()[0]
+
+        tracemalloc.reset_peak()
+        renderer.render("barycentric", [0, 0, 0], [0.1, 0.1, 0.1], mode=mode, tile_size=16)
+        render_peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return resident, render_peak, renderer
+
+
+@pytest.mark.parametrize("mode", ["recursive", "wavefront"])
+def test_streamed_render_memory_does_not_grow_with_triangles(tmp_path, mode: str):
+    # the first render pays for imports and caches
+    traced_render(tmp_path, 4, mode)
+
+    small_resident, small_peak, small = traced_render(tmp_path, 16, mode)
+    large_resident, large_peak, large = traced_render(tmp_path, 64, mode)
+
+    assert len(large.meshes[0].faces) == 16 * len(small.meshes[0].faces)
+    assert isinstance(large.meshes[0].world_vertices, np.memmap)
+    assert isinstance(large.meshes[0].bvh.node_min, np.memmap)
+
+    # 16 times the triangles, but with the geometry, world space arrays and BVH on disk neither what stays in
+    # memory nor what rendering allocates grows with them
+    assert large_resident < small_resident + 64 * 1024
+    assert large_peak < 2 * small_peak + 64 * 1024
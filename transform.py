@@ -8,6 +8,22 @@ class Transform:
     def __init__(self):
         self.matrix: np.array = np.identity(4)
 
+        # matrix is translation * rotation * scale, the rotation and scale are kept apart to rebuild it from
+        self.rotation: np.array = np.identity(3)
+        self.scale: np.array = np.ones(3)
+
+        # bumped on every change so users can tell when cached world space data is stale
+        self.version: int = 0
+
+        # built on first use after a change
+        self._inverse: np.array = None
+        self._normal_matrix: np.array = None
+
+    def changed(self) -> None:
+        self.version += 1
+        self._inverse = None
+        self._normal_matrix = None
+
     def transformation_matrix(self) -> np.array:
         return self.matrix
 
@@ -15,6 +31,37 @@ class Transform:
         self.matrix[0][3] = x
         self.matrix[1][3] = y
         self.matrix[2][3] = z
+        self.changed()
+
+    def set_matrix(self, matrix: np.array) -> None:
+        """
+        Replaces the whole transform with a 4x4 matrix made of a translation, rotation and positive scale
+        (no shear or mirroring). Setting the matrix it already has changes nothing, so the version stays put
+        and nothing cached against it gets rebuilt.
+        """
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.shape != (4, 4):
+            raise Exception("Transform matrix must be 4x4")
+
+        if np.array_equal(matrix, self.matrix):
+            return
+
+        scale = np.linalg.norm(matrix[0:3, 0:3], axis=0)
+        if np.any(scale == 0):
+            raise Exception("Scale must be non-zero on every axis")
+
+        self.rotation = matrix[0:3, 0:3] / scale
+        self.scale = scale
+        self.matrix = matrix.copy()
+        self.changed()
+
+    def set_scale(self, x, y, z) -> None:
+        if x == 0 or y == 0 or z == 0:
+            raise Exception("Scale must be non-zero on every axis")
+
+        self.scale = np.array([x, y, z], dtype=np.float64)
+        self.matrix[0:3, 0:3] = self.rotation * self.scale
+        self.changed()
 
     # apply transform to (0, 0, 0) instead
     # def get_position(self) -> np.array:
@@ -54,36 +101,79 @@ class Transform:
         ])
 
         yx = math_helper.multiply_matrices(x_mat, y_mat)
-        self.matrix[0:3, 0:3] = math_helper.multiply_matrices(yx, z_mat)
+        self.rotation = math_helper.multiply_matrices(yx, z_mat)
+        self.matrix[0:3, 0:3] = self.rotation * self.scale
+        self.changed()
 
     def inverse_matrix(self) -> np.array:
-        inverse = np.identity(4)
+        """
+        - returned is the cached inverse of matrix, don't modify it
+        """
+        if self._inverse is None:
+            inverse = np.identity(4)
 
-        # transpose of inverse is sufficient for our purpose
-        inverse[0:3, 0:3] = self.matrix[0:3, 0:3].T
+            # inverse of a rotation is its transpose, the scale is undone before it
+            inverse[0:3, 0:3] = self.rotation.T / self.scale[:, None]
 
-        # 3x3 mult 3x1 -> 3x1
-        inverse[0:3, 3] = math_helper.multiply_matrices(inverse[0:3, 0:3] * -1, self.matrix[0:3, 3])
+            # 3x3 mult 3x1 -> 3x1
+            inverse[0:3, 3] = math_helper.multiply_matrices(inverse[0:3, 0:3] * -1, self.matrix[0:3, 3])
 
-        return inverse
+            self._inverse = inverse
+
+        return self._inverse
+
+    def normal_matrix(self) -> np.array:
+        """
+        - returned is the cached 3x3 inverse transpose of the rotation and scale, which keeps normals
+          perpendicular to their surfaces under non-uniform scale. Normals it transforms aren't unit length anymore
+          unless the scale is uniform
+        """
+        if self._normal_matrix is None:
+            self._normal_matrix = self.rotation / self.scale
+
+        return self._normal_matrix
 
     def apply_to_point(self, p) -> np.array:
-        a_p: np.array = np.append(p, 1)
-        return math_helper.multiply_matrices(self.matrix, a_p)[0:3]
-    
+        return self.matrix[0:3, 0:3] @ p + self.matrix[0:3, 3]
+
     def apply_inverse_to_point(self, p: np.array) -> np.array:
-        a_p: np.array = np.append(p, 1)
-        # 4x4 times 4x1 -> 4x1 -> 3x1
-        return math_helper.multiply_matrices(self.inverse_matrix(), a_p)[0:3]
-
-    def apply_inverse_to_normal(self, p: np.array) -> np.array:
-        a_p: np.array = np.append(p, 0)
-        # 4x4 times 4x1 -> 4x1 -> 3x1
-        return math_helper.multiply_matrices(self.inverse_matrix(), a_p)[0:3]
-    
+        inverse = self.inverse_matrix()
+        return inverse[0:3, 0:3] @ p + inverse[0:3, 3]
+
+    def apply_to_direction(self, d: np.array) -> np.array:
+        """
+        Directions (like a ray's) are moved by the rotation and scale but not the translation
+        """
+        return self.matrix[0:3, 0:3] @ d
+
+    def apply_inverse_to_direction(self, d: np.array) -> np.array:
+        return self.inverse_matrix()[0:3, 0:3] @ d
+
     def apply_to_normal(self, n) -> np.array:
-        a_n: np.array = np.append(n, 0)
-        return math_helper.multiply_matrices(self.matrix, a_n)[0:3]
+        return self.normal_matrix() @ n
+
+    def apply_inverse_to_normal(self, n: np.array) -> np.array:
+        # the inverse of the inverse transpose is the transpose
+        return self.matrix[0:3, 0:3].T @ n
+
+    def apply_to_points(self, points: np.array) -> np.array:
+        """
+        - points is an (N, 3) array, returned is the (N, 3) transformed points
+        """
+        return points @ self.matrix[0:3, 0:3].T + self.matrix[0:3, 3]
+
+    def apply_inverse_to_points(self, points: np.array) -> np.array:
+        inverse = self.inverse_matrix()
+        return points @ inverse[0:3, 0:3].T + inverse[0:3, 3]
+
+    def apply_to_directions(self, directions: np.array) -> np.array:
+        return directions @ self.matrix[0:3, 0:3].T
+
+    def apply_to_normals(self, normals: np.array) -> np.array:
+        """
+        - normals is an (N, 3) array, returned is the (N, 3) transformed normals, not renormalized
+        """
+        return normals @ self.normal_matrix().T
 
     # EXTRA CREDIT
     def set_axis_rotation(self, axis, rotation) -> None:
@@ -101,4 +191,6 @@ class Transform:
 
         result = e0 + e1 + e2
 
-        self.matrix[0:3, 0:3] = result
+        self.rotation = result
+        self.matrix[0:3, 0:3] = self.rotation * self.scale
+        self.changed()